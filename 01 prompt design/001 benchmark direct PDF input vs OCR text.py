@@ -0,0 +1,232 @@
+import os
+import time
+import json
+import fitz
+import pandas as pd
+import google.generativeai as genai
+from local_gemini import LocalGenerativeModel
+
+# Compares the two ways of feeding an invoice to Gemini:
+#   ocr_text = Document AI OCR (001) followed by prompts with the OCR text
+#   pdf      = the first 15 PDF pages sent inline with the supplier and VAT prompts, no OCR call
+# For every invoice both paths run one supplier call and one VAT call. The report shows latency, bytes sent,
+# input tokens and whether the two paths agree on supplier number and payable amount.
+
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
+
+genai.configure()
+
+run_name = "Your run name here"
+
+USE_LOCAL_MODEL = True  # False = benchmark against Gemini itself
+INVOICE_LIMIT = 50
+
+supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
+vat_codes_df = pd.read_csv('context/vat_codes.csv', encoding='ISO-8859-1')
+
+supplier_context = "\n".join([f"{row['Supplier name']}, {row['Supplier number']}, {row['Organization number']}"
+                              for _, row in supplier_df.iterrows()])
+
+pdf_input_folder = "runs/" + run_name + "/000 Initial input"
+ocr_text_folder = "runs/" + run_name + "/001 Output from OCR"
+ocr_report_path = os.path.join(ocr_text_folder, "ocr_report.csv")
+output_folder = "runs/" + run_name + "/001 Benchmark direct PDF"
+output_csv_path = os.path.join(output_folder, "benchmark.csv")
+
+call_log = []
+
+
+class MeasuredModel:
+    """Wraps the model and logs latency, bytes and input tokens of every generate_content call."""
+
+    def __init__(self, model_name):
+        self.model = LocalGenerativeModel(model_name) if USE_LOCAL_MODEL else genai.GenerativeModel(model_name)
+
+    def generate_content(self, contents, **kwargs):
+        parts = contents if isinstance(contents, list) else [contents]
+        bytes_sent = sum(len(p.encode("utf-8")) if isinstance(p, str) else len(p["data"]) for p in parts)
+
+        started = time.perf_counter()
+        response = self.model.generate_content(contents, **kwargs)
+
+        call_log.append({
+            "seconds": time.perf_counter() - started,
+            "bytes_sent": bytes_sent,
+            "prompt_tokens": response.usage_metadata.prompt_token_count
+        })
+        return response
+
+
+def extract_first_15_pages(input_path):
+    """Extracts the first 15 pages of a PDF using PyMuPDF and returns them as PDF bytes."""
+    doc = fitz.open(input_path)
+    new_doc = fitz.open()
+
+    new_doc.insert_pdf(doc, from_page=0, to_page=min(15, len(doc)) - 1)
+
+    pdf_bytes = new_doc.tobytes(no_new_id=True)
+    new_doc.close()
+    doc.close()
+
+    return pdf_bytes
+
+
+def strip_markdown(json_text):
+    json_text = json_text.strip()
+    if json_text.startswith("```json"):
+        json_text = json_text[7:]
+    if json_text.endswith("```"):
+        json_text = json_text[:-3]
+    return json_text.strip()
+
+
+def extract_supplier_from_gemini(invoice_text, invoice_pdf=None):
+    if invoice_pdf is not None:
+        invoice_text = "The invoice is attached as a PDF."
+
+    prompt = f"""
+Choose the correct supplier number from the supplier list based on invoice text.
+    - Ignore [Redacted] and [Redacted]. That's our company.
+    - If there are several suppliers mentioned, return empty values.
+    - If you can't find a perfect match for either the supplier name or the organization number, return empty values.
+    - If you can't find the supplier in the supplier list, return empty values.
+    - If there are several potential matches from the supplier list, return empty values.
+
+    Empty values = the JSON below with no added content.
+
+    Supplier List:
+    {supplier_context}
+
+    Invoice Text:
+    {invoice_text}
+
+    Return the result in JSON format:
+    {{
+      "supplier_name": "",
+      "supplier_number": "",
+      "organization_number": ""
+    }}
+    """
+
+    contents = prompt if invoice_pdf is None else [prompt, {"mime_type": "application/pdf", "data": invoice_pdf}]
+
+    try:
+        model = MeasuredModel("gemini-2.0-flash")
+        response = model.generate_content(contents, generation_config={"temperature": 1})
+        parsed = json.loads(strip_markdown(response.candidates[0].content.parts[0].text))
+        return parsed if isinstance(parsed, dict) else {}
+
+    except Exception as e:
+        print(f"Invalid or non-JSON response. Error: {e}")
+        return {}
+
+
+def extract_invoice_details(invoice_text, supplier_data, invoice_pdf=None):
+    """Zero-shot branch of the supplier specific VAT split prompt."""
+    if invoice_pdf is not None:
+        invoice_text = "The invoice is attached as a PDF."
+
+    prompt = f"""
+            Please find the sum payable and group the attached invoice by VAT type.
+            - The payable amount should be a gross amount, i.e. should include VAT
+            - The sum per VAT type should be net, i.e. should not include VAT
+            - Only use the attached VAT codes.
+            - If there is supplier context, please adhere to it
+            - Negative amounts are for credit notes. Positive amounts are for costs.
+
+            ### **Supplier:**
+            {json.dumps(supplier_data, indent=2)}
+
+            ### **VAT Codes:**
+            {json.dumps(vat_codes_df.to_dict(orient='records'), indent=2)}
+
+            ### **Invoice Text:**
+            {invoice_text}
+
+            ### **Return the result as RAW JSON:**
+            - Do NOT format the JSON in markdown.
+            - Do NOT use backticks.
+            - Return raw JSON directly, like this:
+            [
+                {{
+                    "date": "",
+                    "general description": "",
+                    "payable_gross_amount": "",
+                    "vat_lines":
+                        [
+                            {{
+                                "vatType": "",
+                                "net_amount": ""
+                            }}
+                        ]
+                }}
+            ]
+        """
+
+    contents = prompt if invoice_pdf is None else [prompt, {"mime_type": "application/pdf", "data": invoice_pdf}]
+
+    try:
+        model = MeasuredModel("gemini-2.0-flash")
+        response = model.generate_content(contents, generation_config={"temperature": 1})
+        parsed = json.loads(strip_markdown(response.candidates[0].content.parts[0].text))
+        return [item for item in parsed if isinstance(item, dict)] if isinstance(parsed, list) else []
+
+    except Exception as e:
+        print(f"Invalid or non-JSON response. Error: {e}")
+        return []
+
+
+os.makedirs(output_folder, exist_ok=True)
+
+# OCR latency per PDF from the 001 run, so the ocr_text path is charged for its OCR hop
+ocr_seconds = {}
+if os.path.exists(ocr_report_path):
+    ocr_report = pd.read_csv(ocr_report_path)
+    ocr_seconds = dict(zip(ocr_report["pdf_file"].str.replace(".pdf", "", regex=False), ocr_report["seconds"]))
+
+benchmark_rows = []
+invoice_numbers = sorted(
+    f.replace(".txt", "") for f in os.listdir(ocr_text_folder)
+    if f.endswith(".txt") and os.path.exists(os.path.join(pdf_input_folder, f.replace(".txt", ".pdf")))
+)[:INVOICE_LIMIT]
+
+for invoice_number in invoice_numbers:
+    with open(os.path.join(ocr_text_folder, f"{invoice_number}.txt"), "r", encoding="utf-8") as file:
+        invoice_text = file.read()
+
+    invoice_pdf = extract_first_15_pages(os.path.join(pdf_input_folder, f"{invoice_number}.pdf"))
+
+    for mode in ["ocr_text", "pdf"]:
+        pdf = invoice_pdf if mode == "pdf" else None
+        del call_log[:]
+
+        supplier = extract_supplier_from_gemini(invoice_text, pdf)
+        invoice_details = extract_invoice_details(invoice_text, supplier, pdf)
+
+        benchmark_rows.append({
+            "invoice_number": invoice_number,
+            "mode": mode,
+            "ocr_seconds": ocr_seconds.get(invoice_number, 0.0) if mode == "ocr_text" else 0.0,
+            "model_seconds": sum(c["seconds"] for c in call_log),
+            "bytes_sent": sum(c["bytes_sent"] for c in call_log),
+            "prompt_tokens": sum(c["prompt_tokens"] for c in call_log),
+            "supplier_number": str(supplier.get("supplier_number", "")),
+            "payable_gross_amount": str(invoice_details[0].get("payable_gross_amount", "")) if invoice_details else ""
+        })
+
+    print(f"Benchmarked {invoice_number}")
+
+benchmark_df = pd.DataFrame(benchmark_rows)
+benchmark_df["total_seconds"] = benchmark_df["ocr_seconds"] + benchmark_df["model_seconds"]
+benchmark_df.to_csv(output_csv_path, index=False)
+
+if not benchmark_df.empty:
+    summary = benchmark_df.groupby("mode")[["total_seconds", "ocr_seconds", "model_seconds", "bytes_sent", "prompt_tokens"]].mean()
+    print(summary.round(3).to_string())
+
+    paired = benchmark_df.pivot(index="invoice_number", columns="mode", values=["supplier_number", "payable_gross_amount"])
+    supplier_agreement = (paired["supplier_number"]["ocr_text"] == paired["supplier_number"]["pdf"]).mean()
+    amount_agreement = (paired["payable_gross_amount"]["ocr_text"] == paired["payable_gross_amount"]["pdf"]).mean()
+    print(f"Agreement with the OCR text path: supplier number {supplier_agreement:.0%}, payable amount {amount_agreement:.0%}")
+
+print(f"Benchmark saved to {output_csv_path}")
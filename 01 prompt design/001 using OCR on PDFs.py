@@ -1,52 +1,411 @@
 import os
+import csv
+import json
+import time
+import hashlib
+import difflib
+import sqlite3
+import re
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import documentai_v1 as documentai
 import google.generativeai as genai
 import fitz
+from ocr_layout_store import document_layout_rows, text_layer_layout_rows, write_layout_store
+from duplicate_index import DuplicateIndex, content_key, extract_fingerprints, fingerprint_keys
+from run_manifest import hash_value, load_manifest, save_manifest
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Goolge credentials as a JSON file here"
 
 # Google Cloud settings
 PROJECT_ID = "Your Google Cloud project ID here"
-LOCATION = "eu" 
-PROCESSOR_ID = "Your Document AI processor ID here"  
+LOCATION = "eu"
+PROCESSOR_ID = "Your Document AI processor ID here"
 
-document_ai_client = documentai.DocumentProcessorServiceClient(
-    client_options={"api_endpoint": f"{LOCATION}-documentai.googleapis.com"}
-)
+# OCR settings
+OCR_WORKERS = 8  # Document AI requests kept in flight at the same time. 1 = one PDF at a time
+USE_LOCAL_PROCESSOR = False  # True = use LocalOcrProcessor instead of Document AI (no credentials needed)
+LOCAL_PROCESSOR_LATENCY = 0.5  # Seconds the local stand-in sleeps per request to mimic a Document AI round trip
+MAX_OCR_PAGES = 15
+PAGES_PER_SHARD = 0  # > 0 = split each PDF into shards of this many pages, OCR them concurrently and stitch the text in page order
+SHARD_WORKERS = 16  # Shard requests in flight across all invoices. With sharding MAX_OCR_PAGES can go above 15
+PAGE_MARKER = "--- Page {page} ---"
+OCR_MODE = "online"  # "online" = one process_document call per PDF, "batch" = batch_process_documents for bulk backfills
+BATCH_BACKEND = "gcs"  # "gcs" = upload to GCS_BUCKET and run the processor, "local" = LocalBatchBackend on the filesystem
+BATCH_SIZE = 100  # PDFs per batch request
+BATCH_POLL_SECONDS = 10
+GCS_BUCKET = "Your GCS bucket for batch OCR here"
+GCS_PREFIX = "ocr-batches"
+PAGE_SELECTION = "local"  # "local" = slice pages in memory with PyMuPDF, "processor" = send original bytes and let Document AI pick the pages, "relevance" = slice the best scoring pages
+PAGE_BUDGET = 5  # Pages sent per invoice when PAGE_SELECTION = "relevance", 0 = all pages
+
+# Page relevance scoring. Words on totals, VAT summary and supplier identity pages score up, terms and conditions score down
+RELEVANCE_KEYWORDS = {
+    "totalt": 3, "total": 3, "å betale": 3, "sum": 2, "mva": 3, "kid": 3, "org.nr": 3, "org. nr": 3, "orgnr": 3,
+    "foretaksregisteret": 2, "forfallsdato": 2, "fakturanummer": 2, "faktura": 1, "beløp": 1,
+    "invoice": 1, "vat": 2, "amount due": 3,
+    "vilkår": -2, "betingelser": -2, "terms and conditions": -3, "general terms": -2
+}
+RELEVANCE_PATTERNS = {re.compile(r"\b" + re.escape(k) + r"\b"): w for k, w in RELEVANCE_KEYWORDS.items()}
+AMOUNT_PATTERN = re.compile(r"\d[\d .]*,\d{2}\b|\d[\d ,]*\.\d{2}\b")
+LAST_PAGE_BONUS = 2  # Totals usually sit on the last page, and scanned pages have no text to score
+USE_TEXT_LAYER = True  # Take the embedded text of born-digital PDFs and only send scanned PDFs to Document AI
+TEXT_LAYER_MIN_CHARS_PER_PAGE = 200  # Average non-whitespace characters per page for the text layer to count as usable
+TEXT_LAYER_MIN_PRINTABLE_RATIO = 0.95  # Share of printable characters, catches broken font encodings
+DOWNSAMPLE_IMAGES = False  # Recompress page images above TARGET_DPI to JPEG before upload. Keeps the original if that isn't smaller
+TARGET_DPI = 200
+JPEG_QUALITY = 75
+DOWNSAMPLE_COMPARE = False  # Also OCR the original bytes and report latency and text similarity. Doubles the calls, use with the local stand-in
+SAVE_LAYOUT = True  # Keep tokens, lines, boxes and confidences in "001 Output from OCR/layout.arrow" (see ocr_layout_store.py)
+DUPLICATE_HANDLING = "skip"  # "skip" = don't OCR or write text for invoices seen before, "flag" = process them but mark them in the report, "off"
+DUPLICATE_INDEX_PATH = "runs/duplicate_index.sqlite"
+OWN_ORGANIZATION_NUMBERS = []  # Our company's org numbers, printed on every invoice as the buyer. Not used as fingerprints
+USE_OCR_CACHE = True  # Reuse OCR text for byte-identical PDFs across runs
+OCR_CACHE_PATH = "runs/ocr_cache.sqlite"
+OCR_CACHE_MAX_BYTES = 500 * 1024 * 1024  # Least recently used entries are evicted above this size
+
+
+class LocalOcrProcessor:
+    """Stand-in for DocumentProcessorServiceClient that reads the PDF text layer with PyMuPDF."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def process_document(self, request):
+        time.sleep(self.latency)
+
+        doc = fitz.open(stream=request.raw_document.content, filetype="pdf")
+
+        # Mirror Document AI's from_start page selection when it is set
+        page_count = len(doc)
+        if request.process_options and request.process_options.from_start:
+            page_count = min(page_count, request.process_options.from_start)
+
+        # Build pages, lines and tokens with text anchors and normalized boxes like Document AI does,
+        # so page splitting and the layout store work against the stand-in
+        text = ""
+        pages = []
+        for i in range(page_count):
+            page = doc[i]
+            width, height = page.rect.width, page.rect.height
+            page_start = len(text)
+            lines = {}
+
+            for x0, y0, x1, y1, word, block_no, line_no, _ in page.get_text("words"):
+                lines.setdefault((block_no, line_no), []).append((x0 / width, y0 / height, x1 / width, y1 / height, word))
+
+            tokens = []
+            page_lines = []
+            for words in lines.values():
+                line_start = len(text)
+                for x0, y0, x1, y1, word in words:
+                    tokens.append(self._element(len(text), len(text) + len(word) + 1, (x0, y0, x1, y1)))
+                    text += word + " "
+                text = text[:-1] + "\n"
+
+                line_box = (min(w[0] for w in words), min(w[1] for w in words), max(w[2] for w in words), max(w[3] for w in words))
+                page_lines.append(self._element(line_start, len(text), line_box))
+
+            page_layout = self._element(page_start, len(text), (0, 0, 1, 1)).layout
+            pages.append(SimpleNamespace(page_number=i + 1, layout=page_layout, tokens=tokens, lines=page_lines))
+        doc.close()
+
+        return SimpleNamespace(document=SimpleNamespace(text=text, pages=pages))
+
+    @staticmethod
+    def _element(start, end, box):
+        x0, y0, x1, y1 = box
+        vertices = [SimpleNamespace(x=x0, y=y0), SimpleNamespace(x=x1, y=y0), SimpleNamespace(x=x1, y=y1), SimpleNamespace(x=x0, y=y1)]
+        return SimpleNamespace(layout=SimpleNamespace(
+            text_anchor=SimpleNamespace(text_segments=[SimpleNamespace(start_index=start, end_index=end)]),
+            bounding_poly=SimpleNamespace(normalized_vertices=vertices),
+            confidence=1.0
+        ))
+
+
+class OcrCache:
+    """Persistent OCR text cache keyed by a hash of the PDF bytes sent and the processor, with LRU eviction.
+
+    Each entry keeps the layout rows of the response next to the text, with pages numbered within the request and
+    no invoice number, so an invoice served from the cache still gets its rows in the layout store of its own run."""
+
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL, layout TEXT)"
+        )
+        # Caches written before the layout column existed
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(ocr_cache)")]
+        if "layout" not in columns:
+            self.connection.execute("ALTER TABLE ocr_cache ADD COLUMN layout TEXT")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(pdf_bytes, processor_id, page_selection):
+        digest = hashlib.sha256(pdf_bytes)
+        digest.update(f"|{processor_id}|{page_selection}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns (text, layout rows) or None. The layout is empty for entries stored without one."""
+        with self.lock:
+            row = self.connection.execute("SELECT text, layout FROM ocr_cache WHERE key = ?", (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.connection.execute("UPDATE ocr_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            return row[0], json.loads(row[1]) if row[1] else []
+
+    def put(self, key, text, layout=None):
+        layout = json.dumps(layout) if layout else None
+        size = len(text.encode("utf-8")) + len((layout or "").encode("utf-8"))
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, text, size, last_used, layout) VALUES (?, ?, ?, ?, ?)",
+                (key, text, size, time.time(), layout)
+            )
+
+            total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+            while total_size > self.max_bytes:
+                oldest_key, oldest_size = self.connection.execute(
+                    "SELECT key, size FROM ocr_cache ORDER BY last_used LIMIT 1"
+                ).fetchone()
+                self.connection.execute("DELETE FROM ocr_cache WHERE key = ?", (oldest_key,))
+                total_size -= oldest_size
+                self.evictions += 1
+
+            self.connection.commit()
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return f"OCR cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%} hit rate), {self.evictions} evicted"
+
+
+ocr_cache = OcrCache(OCR_CACHE_PATH, OCR_CACHE_MAX_BYTES) if USE_OCR_CACHE else None
+duplicate_index = DuplicateIndex(DUPLICATE_INDEX_PATH) if DUPLICATE_HANDLING != "off" else None
+
+# Layout rows collected by all workers, written to the layout store at the end of the run
+layout_rows = []
+layout_lock = threading.Lock()
+
+def record_layout(rows):
+    with layout_lock:
+        layout_rows.extend(rows)
+
+def request_layout_rows(invoice_number, rows, page_numbers):
+    """Layout rows of one OCR request (as kept in the OCR cache) for an invoice, on its original page numbers."""
+    return [{**row, "invoice_number": invoice_number, "page": page_numbers[row["page"] - 1] if page_numbers else row["page"]}
+            for row in rows]
+
+# Upload sizes and OCR timings per invoice, summed over shards
+upload_stats = {}
+upload_lock = threading.Lock()
+
+def record_upload(invoice_number, **stats):
+    with upload_lock:
+        invoice_stats = upload_stats.setdefault(invoice_number, {})
+        for key, value in stats.items():
+            invoice_stats[key] = invoice_stats.get(key, 0) + value
+
+if USE_LOCAL_PROCESSOR:
+    document_ai_client = LocalOcrProcessor(latency=LOCAL_PROCESSOR_LATENCY)
+else:
+    document_ai_client = documentai.DocumentProcessorServiceClient(
+        client_options={"api_endpoint": f"{LOCATION}-documentai.googleapis.com"}
+    )
 
 run_name = "Your run name here"
 
 genai.configure()
 
-def extract_first_15_pages(input_path, output_path):
-    """Extracts the first 15 pages of a PDF using PyMuPDF."""
+def score_page(page, page_index, page_count):
+    """Cheap relevance score for one page from its text layer and where amounts sit on the page.
+
+    Scanned pages have no text layer, so they only get LAST_PAGE_BONUS. With USE_TEXT_LAYER born-digital PDFs skip
+    OCR, so the PDFs that get here are mostly scanned and their selection is positional: the first page, the last
+    page, then pages in document order."""
+    text = page.get_text().lower()
+    score = sum(weight for pattern, weight in RELEVANCE_PATTERNS.items() if pattern.search(text))
+
+    # Amounts in the bottom third usually belong to the totals or VAT summary
+    bottom = page.rect.height * 2 / 3
+    for block in page.get_text("blocks"):
+        if block[1] > bottom:
+            score += 0.5 * min(3, len(AMOUNT_PATTERN.findall(block[4])))
+
+    if page_index == page_count - 1:
+        score += LAST_PAGE_BONUS
+
+    return score
+
+def select_ocr_pages(doc):
+    """Returns the 0-based page numbers to OCR, in document order."""
+    if PAGE_SELECTION != "relevance":
+        return list(range(min(MAX_OCR_PAGES, len(doc))))
+
+    if PAGE_BUDGET <= 0 or len(doc) <= PAGE_BUDGET:
+        return list(range(len(doc)))
+
+    # The first page always goes in, it carries the supplier header
+    scores = {i: score_page(doc[i], i, len(doc)) for i in range(1, len(doc))}
+    ranked = sorted(scores, key=lambda i: (-scores[i], i))
+
+    return sorted([0] + ranked[:PAGE_BUDGET - 1])
+
+def extract_first_15_pages(input_path, page_indexes=None):
+    """Extracts the given 0-based pages (select_ocr_pages when None, the first 15 by default) as PDF bytes."""
     doc = fitz.open(input_path)
     new_doc = fitz.open()
 
-    for i in range(min(15, len(doc))):
+    for i in select_ocr_pages(doc) if page_indexes is None else page_indexes:
         new_doc.insert_pdf(doc, from_page=i, to_page=i)
 
-    new_doc.save(output_path)
+    # no_new_id keeps the bytes identical between runs, so OCR cache keys stay stable
+    pdf_bytes = new_doc.tobytes(no_new_id=True)
     new_doc.close()
     doc.close()
 
+    return pdf_bytes
+
+def downsample_pdf_bytes(pdf_bytes):
+    """Recompresses images above TARGET_DPI to JPEG at JPEG_QUALITY. Returns the original bytes if the result isn't smaller."""
+    if not DOWNSAMPLE_IMAGES:
+        return pdf_bytes
+
+    try:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        # Images only slightly above the target are left alone, re-encoding them saves little
+        doc.rewrite_images(dpi_threshold=int(TARGET_DPI * 1.2), dpi_target=TARGET_DPI, quality=JPEG_QUALITY)
+        # garbage=3 drops the replaced image streams
+        downsampled = doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+        doc.close()
+
+    except Exception as e:
+        print(f"Error downsampling images, sending the original: {e}")
+        return pdf_bytes
+
+    return downsampled if len(downsampled) < len(pdf_bytes) else pdf_bytes
+
+def text_layer_is_usable(text, page_count):
+    """Quality heuristic for an embedded text layer: enough characters per page and mostly printable."""
+    characters = [ch for ch in text if not ch.isspace()]
+
+    if page_count == 0 or len(characters) / page_count < TEXT_LAYER_MIN_CHARS_PER_PAGE:
+        return False
+
+    printable = sum(1 for ch in characters if ch.isprintable() and ch != "\ufffd")
+    return printable / len(characters) >= TEXT_LAYER_MIN_PRINTABLE_RATIO
+
+def extract_text_layer(pdf_path):
+    """Returns the embedded text of the first pages of a PDF, or None if it looks scanned or image-only."""
+    try:
+        doc = fitz.open(pdf_path)
+        page_count = min(MAX_OCR_PAGES, len(doc))
+        text = "".join(doc[i].get_text() for i in range(page_count))
+        usable = text_layer_is_usable(text, page_count)
+
+        if usable and SAVE_LAYOUT:
+            invoice_number = os.path.basename(pdf_path).replace(".pdf", "")
+            record_layout(text_layer_layout_rows(invoice_number, doc, range(1, page_count + 1)))
+
+        doc.close()
+
+    except Exception as e:
+        print(f"Error reading text layer of '{pdf_path}': {e}")
+        return None
+
+    return text if usable else None
+
+def downsample_setting():
+    return f"{TARGET_DPI}dpi:q{JPEG_QUALITY}" if DOWNSAMPLE_IMAGES else "original"
+
+def prepare_ocr_input(pdf_path):
+    """Returns the PDF bytes to send, the Document AI process options, the OCR cache key and the original
+    1-based page numbers of the pages sent (None when Document AI selects the pages)."""
+    if PAGE_SELECTION == "processor":
+        # Send the original file and let Document AI keep the first pages
+        with open(pdf_path, "rb") as file:
+            pdf_bytes = file.read()
+
+        process_options = documentai.ProcessOptions(from_start=MAX_OCR_PAGES)
+        page_numbers = None
+    else:
+        # Pages are selected once, then sliced in memory, so no temp file is shared between concurrent workers
+        doc = fitz.open(pdf_path)
+        page_indexes = select_ocr_pages(doc)
+        doc.close()
+
+        pdf_bytes = extract_first_15_pages(pdf_path, page_indexes)
+        process_options = None
+        page_numbers = [i + 1 for i in page_indexes]
+
+    cache_key = OcrCache.make_key(pdf_bytes, PROCESSOR_ID, f"{PAGE_SELECTION}:{MAX_OCR_PAGES}:{downsample_setting()}")
+
+    return pdf_bytes, process_options, cache_key, page_numbers
+
 def process_invoice_ocr(pdf_path):
     """Processes a PDF invoice and extracts text using Google Document AI OCR."""
     try:
-        temp_pdf = "temp_first_15_pages.pdf"
-        extract_first_15_pages(pdf_path, temp_pdf)
+        pdf_bytes, process_options, cache_key, page_numbers = prepare_ocr_input(pdf_path)
+        invoice_number = os.path.basename(pdf_path).replace(".pdf", "")
 
-        with open(temp_pdf, "rb") as file:
-            pdf_bytes = file.read()
+        if ocr_cache:
+            cached = ocr_cache.get(cache_key)
+
+            if cached is not None:
+                cached_text, cached_layout = cached
+                if SAVE_LAYOUT:
+                    record_layout(request_layout_rows(invoice_number, cached_layout, page_numbers))
+                return cached_text
+
+        upload_bytes = downsample_pdf_bytes(pdf_bytes)
 
         request = documentai.ProcessRequest(
             name=f"projects/{PROJECT_ID}/locations/{LOCATION}/processors/{PROCESSOR_ID}",
-            raw_document=documentai.RawDocument(content=pdf_bytes, mime_type="application/pdf")
+            raw_document=documentai.RawDocument(content=upload_bytes, mime_type="application/pdf"),
+            process_options=process_options
         )
 
+        started = time.perf_counter()
         result = document_ai_client.process_document(request=request)
+        record_upload(invoice_number, original_bytes=len(pdf_bytes), upload_bytes=len(upload_bytes),
+                      ocr_seconds=time.perf_counter() - started)
+
+        if DOWNSAMPLE_COMPARE:
+            original_request = documentai.ProcessRequest(
+                name=request.name,
+                raw_document=documentai.RawDocument(content=pdf_bytes, mime_type="application/pdf"),
+                process_options=process_options
+            )
+
+            started = time.perf_counter()
+            original_result = document_ai_client.process_document(request=original_request)
+            record_upload(invoice_number, original_ocr_seconds=time.perf_counter() - started,
+                          text_similarity=difflib.SequenceMatcher(None, original_result.document.text, result.document.text).ratio())
+
+        # Pages numbered within the request, mapped back to the original pages for this invoice
+        layout = document_layout_rows("", result.document)
+
+        if ocr_cache and result.document.text:
+            ocr_cache.put(cache_key, result.document.text, layout)
 
-        os.remove(temp_pdf)
+        if SAVE_LAYOUT:
+            record_layout(request_layout_rows(invoice_number, layout, page_numbers))
 
         return result.document.text
 
@@ -55,24 +414,502 @@ def process_invoice_ocr(pdf_path):
         return None
 
 
+def document_page_texts(document):
+    """Splits a Document AI document into one text per page using the page layout text anchors."""
+    page_texts = []
+
+    for page in document.pages:
+        segments = page.layout.text_anchor.text_segments
+        page_texts.append("".join(document.text[int(seg.start_index):int(seg.end_index)] for seg in segments))
+
+    return page_texts if page_texts else [document.text]
+
+def extract_page_shards(input_path):
+    """Splits the selected pages of a PDF into PDFs of PAGES_PER_SHARD pages. Returns (page numbers, bytes) pairs."""
+    doc = fitz.open(input_path)
+    page_numbers = select_ocr_pages(doc)
+    shards = []
+
+    for start in range(0, len(page_numbers), PAGES_PER_SHARD):
+        shard_pages = page_numbers[start:start + PAGES_PER_SHARD]
+        shard_doc = fitz.open()
+
+        for i in shard_pages:
+            shard_doc.insert_pdf(doc, from_page=i, to_page=i)
+
+        shards.append(([i + 1 for i in shard_pages], shard_doc.tobytes(no_new_id=True)))
+        shard_doc.close()
+
+    doc.close()
+    return shards
+
+def ocr_shard(invoice_number, page_numbers, pdf_bytes):
+    """OCRs one shard and returns the text of each of its pages."""
+    cache_key = OcrCache.make_key(pdf_bytes, PROCESSOR_ID, f"shard:{downsample_setting()}")
+
+    if ocr_cache:
+        cached = ocr_cache.get(cache_key)
+
+        # Empty shards cached before they were kept out of the cache are sent again
+        if cached is not None and any(text.strip() for text in json.loads(cached[0])):
+            cached_text, cached_layout = cached
+            if SAVE_LAYOUT:
+                record_layout(request_layout_rows(invoice_number, cached_layout, page_numbers))
+            return json.loads(cached_text)
+
+    upload_bytes = downsample_pdf_bytes(pdf_bytes)
+
+    request = documentai.ProcessRequest(
+        name=f"projects/{PROJECT_ID}/locations/{LOCATION}/processors/{PROCESSOR_ID}",
+        raw_document=documentai.RawDocument(content=upload_bytes, mime_type="application/pdf")
+    )
+
+    started = time.perf_counter()
+    result = document_ai_client.process_document(request=request)
+    record_upload(invoice_number, original_bytes=len(pdf_bytes), upload_bytes=len(upload_bytes),
+                  ocr_seconds=time.perf_counter() - started)
+    page_texts = document_page_texts(result.document)
+    layout = document_layout_rows("", result.document)
+
+    if SAVE_LAYOUT:
+        record_layout(request_layout_rows(invoice_number, layout, page_numbers))
+
+    # Like the unsharded path, empty OCR results are not cached, so the shard is sent again next time
+    if ocr_cache and any(text.strip() for text in page_texts):
+        ocr_cache.put(cache_key, json.dumps(page_texts), layout)
+
+    return page_texts
+
+def process_invoice_ocr_sharded(pdf_path):
+    """OCRs the pages of a PDF in concurrent shards and joins them in page order with a marker per page."""
+    try:
+        shards = extract_page_shards(pdf_path)
+        invoice_number = os.path.basename(pdf_path).replace(".pdf", "")
+        shard_results = list(shard_executor.map(
+            ocr_shard,
+            [invoice_number] * len(shards),
+            [page_numbers for page_numbers, _ in shards],
+            [pdf_bytes for _, pdf_bytes in shards]
+        ))
+
+        # No text on any page is a failed OCR, not a document of page markers
+        if not any(text.strip() for page_texts in shard_results for text in page_texts):
+            return None
+
+        pages = []
+        for (page_numbers, _), page_texts in zip(shards, shard_results):
+            for page_number, page_text in zip(page_numbers, page_texts):
+                pages.append(PAGE_MARKER.format(page=page_number) + "\n" + page_text)
+
+        return "\n".join(pages)
+
+    except Exception as e:
+        print(f"Error processing file '{pdf_path}': {e}")
+        return None
+
+
+class LocalBatchBackend:
+    """Filesystem stand-in for GCS + batch_process_documents. Writes Document JSON like the real output."""
+
+    def __init__(self, root_folder, latency=0.0):
+        self.root_folder = root_folder
+        self.latency = latency
+        self.processor = LocalOcrProcessor()
+
+    def submit(self, batch_id, documents, process_options):
+        batch_folder = os.path.join(self.root_folder, batch_id)
+        os.makedirs(os.path.join(batch_folder, "input"), exist_ok=True)
+        os.makedirs(os.path.join(batch_folder, "output"), exist_ok=True)
+
+        for name, pdf_bytes in documents:
+            with open(os.path.join(batch_folder, "input", f"{name}.pdf"), "wb") as file:
+                file.write(pdf_bytes)
+
+        return {"batch_folder": batch_folder, "process_options": process_options, "submitted": time.time()}
+
+    def is_done(self, operation):
+        return time.time() - operation["submitted"] >= self.latency
+
+    def collect(self, operation):
+        input_folder_path = os.path.join(operation["batch_folder"], "input")
+        output_folder_path = os.path.join(operation["batch_folder"], "output")
+        texts = {}
+
+        for pdf_name in sorted(os.listdir(input_folder_path)):
+            with open(os.path.join(input_folder_path, pdf_name), "rb") as file:
+                request = SimpleNamespace(
+                    raw_document=SimpleNamespace(content=file.read()),
+                    process_options=operation["process_options"]
+                )
+
+            text = self.processor.process_document(request).document.text
+            name = pdf_name[:-len(".pdf")]
+
+            with open(os.path.join(output_folder_path, f"{name}-0.json"), "w", encoding="utf-8") as file:
+                json.dump({"text": text}, file)
+
+            texts[name] = text
+
+        return texts
+
+
+class GcsBatchBackend:
+    """Uploads PDFs to GCS, runs batch_process_documents and reads the sharded Document JSON back."""
+
+    def __init__(self, bucket_name, prefix):
+        # Only needed for batch runs against GCS
+        from google.cloud import storage
+
+        self.bucket = storage.Client(project=PROJECT_ID).bucket(bucket_name)
+        self.prefix = prefix.rstrip("/")
+
+    def submit(self, batch_id, documents, process_options):
+        input_prefix = f"{self.prefix}/{batch_id}/input"
+        output_uri = f"gs://{self.bucket.name}/{self.prefix}/{batch_id}/output/"
+        gcs_documents = []
+
+        for name, pdf_bytes in documents:
+            blob = self.bucket.blob(f"{input_prefix}/{name}.pdf")
+            blob.upload_from_string(pdf_bytes, content_type="application/pdf")
+            gcs_documents.append(
+                documentai.GcsDocument(gcs_uri=f"gs://{self.bucket.name}/{blob.name}", mime_type="application/pdf")
+            )
+
+        request = documentai.BatchProcessRequest(
+            name=f"projects/{PROJECT_ID}/locations/{LOCATION}/processors/{PROCESSOR_ID}",
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(documents=gcs_documents)
+            ),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(gcs_uri=output_uri)
+            ),
+            process_options=process_options
+        )
+
+        return document_ai_client.batch_process_documents(request=request)
+
+    def is_done(self, operation):
+        return operation.done()
+
+    def collect(self, operation):
+        operation.result()
+        metadata = documentai.BatchProcessMetadata(operation.metadata)
+        texts = {}
+
+        for status in metadata.individual_process_statuses:
+            name = os.path.basename(status.input_gcs_source)[:-len(".pdf")]
+            # Trailing slash, so the prefix of document 1 does not also list the output of documents 10-19
+            output_prefix = status.output_gcs_destination.replace(f"gs://{self.bucket.name}/", "", 1).rstrip("/") + "/"
+
+            # Large documents are split into several shards, each holding the text of its own pages
+            shards = []
+            for blob in self.bucket.list_blobs(prefix=output_prefix):
+                if blob.name.endswith(".json"):
+                    document = documentai.Document.from_json(blob.download_as_bytes(), ignore_unknown_fields=True)
+                    shards.append((document.shard_info.shard_index, document.text))
+
+            texts[name] = "".join(text for _, text in sorted(shards))
+
+        return texts
+
+
+def run_batch_ocr(pdf_files):
+    """OCRs the PDFs through batch requests of BATCH_SIZE documents and returns one report row per PDF."""
+    reports = {}
+    pending = []
+
+    for pdf_file in pdf_files:
+        pdf_path = os.path.join(input_folder, pdf_file)
+
+        duplicate_of = find_duplicate_pdf(pdf_file)
+        if duplicate_of and DUPLICATE_HANDLING == "skip":
+            reports[pdf_file] = duplicate_report(pdf_file, duplicate_of)
+            continue
+
+        extracted_text = extract_text_layer(pdf_path) if USE_TEXT_LAYER else None
+
+        if extracted_text:
+            reports[pdf_file] = write_ocr_text(pdf_file, extracted_text, "text_layer", 0.0)
+            continue
+
+        try:
+            pdf_bytes, process_options, cache_key, _ = prepare_ocr_input(pdf_path)
+        except Exception as e:
+            print(f"Error processing file '{pdf_path}': {e}")
+            reports[pdf_file] = write_ocr_text(pdf_file, None, "document_ai", 0.0)
+            continue
+
+        cached = ocr_cache.get(cache_key) if ocr_cache else None
+
+        if cached is not None:
+            reports[pdf_file] = write_ocr_text(pdf_file, cached[0], "document_ai", 0.0)
+        else:
+            pending.append((pdf_file, pdf_bytes, cache_key))
+
+    if PAGE_SELECTION == "processor":
+        process_options = documentai.ProcessOptions(from_start=MAX_OCR_PAGES)
+    else:
+        process_options = None
+
+    # Submit every batch first, then poll, so the batches run side by side on the Document AI side
+    operations = []
+    for start in range(0, len(pending), BATCH_SIZE):
+        batch = pending[start:start + BATCH_SIZE]
+        batch_id = f"batch-{start // BATCH_SIZE:04d}"
+        documents = []
+        for pdf_file, pdf_bytes, _ in batch:
+            upload_bytes = downsample_pdf_bytes(pdf_bytes)
+            record_upload(pdf_file.replace(".pdf", ""), original_bytes=len(pdf_bytes), upload_bytes=len(upload_bytes))
+            documents.append((pdf_file.replace(".pdf", ""), upload_bytes))
+
+        operation = batch_backend.submit(batch_id, documents, process_options)
+        operations.append((batch, operation, time.perf_counter()))
+        print(f"Submitted OCR batch {batch_id} with {len(batch)} PDFs")
+
+    while operations:
+        time.sleep(BATCH_POLL_SECONDS)
+        still_running = []
+
+        for batch, operation, submitted in operations:
+            if not batch_backend.is_done(operation):
+                still_running.append((batch, operation, submitted))
+                continue
+
+            try:
+                texts = batch_backend.collect(operation)
+            except Exception as e:
+                print(f"Error collecting OCR batch: {e}")
+                texts = {}
+
+            seconds = round(time.perf_counter() - submitted, 3)
+
+            for pdf_file, _, cache_key in batch:
+                text = texts.get(pdf_file.replace(".pdf", ""))
+
+                if ocr_cache and text:
+                    ocr_cache.put(cache_key, text)
+
+                reports[pdf_file] = write_ocr_text(pdf_file, text, "document_ai", seconds)
+
+        operations = still_running
+
+    return [reports[pdf_file] for pdf_file in pdf_files]
+
+
+def pdf_content_key(pdf_file):
+    with open(os.path.join(input_folder, pdf_file), "rb") as file:
+        return content_key(file.read())
+
+def find_duplicate_pdf(pdf_file):
+    """Checks the PDF bytes against the duplicate index before any OCR. Returns the earlier invoice or None.
+
+    A copy being OCRed by another worker counts as earlier; its bytes are reserved until write_ocr_text."""
+    if not duplicate_index:
+        return None
+
+    return duplicate_index.check([pdf_content_key(pdf_file)], run_name, pdf_file.replace(".pdf", ""))
+
+def duplicate_report(pdf_file, duplicate_of):
+    print(f"Duplicate of {duplicate_of}: {pdf_file}")
+    return {"pdf_file": pdf_file, "status": "duplicate", "ocr_path": "", "characters": 0, "seconds": 0.0,
+            "duplicate_of": duplicate_of}
+
+def write_ocr_text(pdf_file, extracted_text, ocr_path, seconds):
+    """Writes the OCR text of one PDF to the output folder and returns its report row.
+
+    Text whose org number, invoice number, KID and amount match an earlier invoice is caught here,
+    before the supplier prediction stage sees it. The invoice only goes into the duplicate index once its
+    text is written; otherwise the keys its checks reserved are released, so a PDF whose OCR failed is not a
+    duplicate when it is sent again."""
+    report = {
+        "pdf_file": pdf_file,
+        "status": "failed",
+        "ocr_path": ocr_path,
+        "characters": 0,
+        "seconds": seconds
+    }
+
+    keys = []
+    if extracted_text and duplicate_index:
+        keys = fingerprint_keys(extract_fingerprints(extracted_text, OWN_ORGANIZATION_NUMBERS))
+        duplicate_of = duplicate_index.check(keys, run_name, pdf_file.replace(".pdf", ""))
+
+        if duplicate_of and DUPLICATE_HANDLING == "skip":
+            duplicate_index.release(run_name, pdf_file.replace(".pdf", ""))
+            return {**duplicate_report(pdf_file, duplicate_of), "ocr_path": ocr_path, "seconds": seconds}
+        if duplicate_of:
+            report["duplicate_of"] = duplicate_of
+
+    if extracted_text:
+        output_text_path = os.path.join(output_text_folder, pdf_file.replace(".pdf", ".txt"))
+
+        with open(output_text_path, "w", encoding="utf-8") as text_file:
+            text_file.write(extracted_text)
+
+        report["status"] = "processed"
+        report["characters"] = len(extracted_text)
+
+        if duplicate_index:
+            duplicate_index.add([pdf_content_key(pdf_file)] + keys, run_name, pdf_file.replace(".pdf", ""))
+
+        print(f"Processed OCR: {pdf_file} → {output_text_path} via {ocr_path} ({seconds} s)")
+
+    else:
+        if duplicate_index:
+            duplicate_index.release(run_name, pdf_file.replace(".pdf", ""))
+
+        print(f"Failed to process OCR: {pdf_file}")
+
+    return report
+
+def ocr_pdf_file(pdf_file):
+    """OCRs one PDF from the input folder, writes the .txt and returns a report row."""
+    pdf_path = os.path.join(input_folder, pdf_file)
+    started = time.perf_counter()
+
+    duplicate_of = find_duplicate_pdf(pdf_file)
+    if duplicate_of and DUPLICATE_HANDLING == "skip":
+        return duplicate_report(pdf_file, duplicate_of)
+
+    extracted_text = extract_text_layer(pdf_path) if USE_TEXT_LAYER else None
+    ocr_path = "text_layer"
+
+    if not extracted_text and PAGES_PER_SHARD > 0:
+        extracted_text = process_invoice_ocr_sharded(pdf_path)
+        ocr_path = "document_ai_sharded"
+    elif not extracted_text:
+        extracted_text = process_invoice_ocr(pdf_path)
+        ocr_path = "document_ai"
+
+    report = write_ocr_text(pdf_file, extracted_text, ocr_path, round(time.perf_counter() - started, 3))
+    if duplicate_of:
+        report["duplicate_of"] = duplicate_of
+    return report
+
+
 input_folder = "runs/" + run_name + "/000 Initial input"
 output_text_folder = "runs/" + run_name + "/001 Output from OCR/"
+report_csv_path = os.path.join(output_text_folder, "ocr_report.csv")
+layout_path = os.path.join(output_text_folder, "layout.arrow")
+manifest_path = os.path.join(output_text_folder, "manifest.json")
 
 os.makedirs(output_text_folder, exist_ok=True)
 
+# Everything besides the PDF itself that changes the OCR text
+ocr_settings = {
+    "processor_id": PROCESSOR_ID,
+    "page_selection": PAGE_SELECTION,
+    "max_pages": MAX_OCR_PAGES,
+    "page_budget": PAGE_BUDGET if PAGE_SELECTION == "relevance" else None,
+    "downsample": downsample_setting(),
+    "pages_per_shard": PAGES_PER_SHARD,
+    "text_layer": [USE_TEXT_LAYER, TEXT_LAYER_MIN_CHARS_PER_PAGE, TEXT_LAYER_MIN_PRINTABLE_RATIO]
+}
+
+manifest = load_manifest(manifest_path)
+
+new_manifest = {}
+pdf_files = []
+reports = []
+run_started = time.perf_counter()
+
 for pdf_file in os.listdir(input_folder):
-    if pdf_file.endswith(".pdf"):
-        pdf_path = os.path.join(input_folder, pdf_file)
+    if not pdf_file.endswith(".pdf"):
+        continue
 
-        extracted_text = process_invoice_ocr(pdf_path)
+    with open(os.path.join(input_folder, pdf_file), "rb") as file:
+        dependencies = {"input": hash_value(file.read()), **ocr_settings}
 
-        if extracted_text:
-            output_text_path = os.path.join(output_text_folder, pdf_file.replace(".pdf", ".txt"))
+    new_manifest[pdf_file] = {"dependencies": dependencies}
+    output_text_path = os.path.join(output_text_folder, pdf_file.replace(".pdf", ".txt"))
 
-            with open(output_text_path, "w", encoding="utf-8") as text_file:
-                text_file.write(extracted_text)
+    # Skip PDFs whose bytes and OCR settings are unchanged since the .txt was written
+    previous = manifest.get(pdf_file)
+    if previous and previous["dependencies"] == dependencies and os.path.exists(output_text_path):
+        with open(output_text_path, "r", encoding="utf-8") as text_file:
+            characters = len(text_file.read())
 
-            print(f"Processed OCR: {pdf_file} → {output_text_path}")
+        reports.append({"pdf_file": pdf_file, "status": "processed", "ocr_path": "reused",
+                        "characters": characters, "seconds": 0.0})
+    else:
+        pdf_files.append(pdf_file)
 
-        else:
-            print(f"Failed to process OCR: {pdf_file}")
+# Shared by all invoices so SHARD_WORKERS bounds the shard requests in flight
+shard_executor = ThreadPoolExecutor(max_workers=max(1, SHARD_WORKERS))
+
+if OCR_MODE == "batch":
+    # Batch requests are already asynchronous on the Document AI side, so they are not sharded
+    if BATCH_BACKEND == "gcs":
+        batch_backend = GcsBatchBackend(GCS_BUCKET, f"{GCS_PREFIX}/{run_name}")
+    else:
+        batch_backend = LocalBatchBackend("runs/" + run_name + "/001 OCR batches", latency=LOCAL_PROCESSOR_LATENCY)
+
+    reports += run_batch_ocr(pdf_files)
+else:
+    with ThreadPoolExecutor(max_workers=max(1, OCR_WORKERS)) as executor:
+        futures = [executor.submit(ocr_pdf_file, pdf_file) for pdf_file in pdf_files]
+
+        for future in as_completed(futures):
+            reports.append(future.result())
+
+shard_executor.shutdown()
+
+# Invoices served from the OCR cache get their rows from the cache entry; invoices reused from the manifest keep
+# the rows already in this run's store
+if SAVE_LAYOUT and layout_rows:
+    write_layout_store(layout_path, layout_rows)
+
+# Failed PDFs stay out of the manifest so the next run retries them
+for report in reports:
+    if report["status"] != "processed":
+        del new_manifest[report["pdf_file"]]
+
+save_manifest(manifest_path, new_manifest)
+
+run_seconds = time.perf_counter() - run_started
+
+for report in reports:
+    for key, value in upload_stats.get(report["pdf_file"].replace(".pdf", ""), {}).items():
+        report[key] = round(value, 3)
+
+with open(report_csv_path, "w", newline="", encoding="utf-8") as report_file:
+    writer = csv.DictWriter(report_file, restval="", fieldnames=[
+        "pdf_file", "status", "ocr_path", "characters", "seconds", "duplicate_of",
+        "original_bytes", "upload_bytes", "ocr_seconds", "original_ocr_seconds", "text_similarity"
+    ])
+    writer.writeheader()
+    writer.writerows(sorted(reports, key=lambda r: r["pdf_file"]))
+
+processed = sum(1 for r in reports if r["status"] == "processed")
+duplicates = sum(1 for r in reports if r["status"] == "duplicate")
+failed = len(reports) - processed - duplicates
+
+print(f"OCR finished in {OCR_MODE} mode: {processed} processed, {duplicates} duplicates, {failed} failed, {run_seconds:.1f} s total")
+if reports and run_seconds > 0:
+    print(f"Throughput: {len(reports) / run_seconds:.2f} PDFs/s, "
+          f"average {sum(r['seconds'] for r in reports) / len(reports):.2f} s per PDF")
+reused_count = sum(1 for r in reports if r["ocr_path"] == "reused")
+print(f"Reused {reused_count} of {len(reports)} PDFs from the previous run")
+if processed:
+    text_layer_count = sum(1 for r in reports if r["status"] == "processed" and r["ocr_path"] == "text_layer")
+    print(f"Text layer used for {text_layer_count} of {processed} invoices "
+          f"({text_layer_count / processed:.0%} avoided the Document AI call)")
+if upload_stats:
+    original_total = sum(stats["original_bytes"] for stats in upload_stats.values())
+    upload_total = sum(stats["upload_bytes"] for stats in upload_stats.values())
+    print(f"Uploaded {upload_total / 1e6:.1f} MB of {original_total / 1e6:.1f} MB "
+          f"({(original_total - upload_total) / 1e6:.1f} MB saved by downsampling)")
+
+    timed = [stats for stats in upload_stats.values() if "ocr_seconds" in stats]
+    if timed:
+        print(f"Average OCR call: {sum(s['ocr_seconds'] for s in timed) / len(timed):.2f} s")
+
+    compared = [stats for stats in upload_stats.values() if "original_ocr_seconds" in stats]
+    if compared:
+        print(f"Average OCR call on original bytes: {sum(s['original_ocr_seconds'] for s in compared) / len(compared):.2f} s, "
+              f"average text similarity {sum(s['text_similarity'] for s in compared) / len(compared):.3f}")
+if ocr_cache:
+    print(ocr_cache.summary())
+if duplicate_index:
+    print(duplicate_index.summary())
+print(f"Per-file report saved to {report_csv_path}")
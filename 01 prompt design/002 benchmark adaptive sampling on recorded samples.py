@@ -0,0 +1,78 @@
+import os
+import glob
+import json
+import pandas as pd
+from collections import Counter
+from adaptive_sampler import AdaptiveSampler
+from ground_truth import supplier_ground_truth
+
+# Replays the supplier answers recorded by the 002 five-sample script (samples.jsonl, written with SAMPLING = "all")
+# through the adaptive stopping rules. For every policy it reports calls per invoice, agreement with the fixed
+# five-sample majority vote and, for runs with a 006 evaluation, accuracy against the supplier the accountants
+# booked.
+
+SAMPLES = 5
+MAJORITY = 3
+
+POLICIES = {
+    "fixed-5": None,
+    "agreement start 2": AdaptiveSampler(start=2, cap=SAMPLES, rule="agreement"),
+    "agreement start 3": AdaptiveSampler(start=3, cap=SAMPLES, rule="agreement"),
+    "sprt start 2": AdaptiveSampler(start=2, cap=SAMPLES, rule="sprt"),
+}
+
+output_folder = "runs/Benchmarks/002 Adaptive sampling"
+output_csv_path = os.path.join(output_folder, "adaptive_sampling.csv")
+
+
+def fixed_majority(answers):
+    supplier, count = Counter(answers).most_common(1)[0]
+    return supplier if supplier != "" and count >= MAJORITY else ""
+
+
+rows = []
+for samples_path in glob.glob("runs/*/002 Supplier prediction/samples.jsonl"):
+    run_folder = os.path.dirname(os.path.dirname(samples_path))
+
+    ground_truth = supplier_ground_truth(run_folder)
+
+    # The last complete recording of each invoice. Only SAMPLING = "all" draws every sample regardless of the
+    # vote; concurrent waves reach five answers only on disagreement, which would bias the set to hard invoices
+    recorded = {}
+    with open(samples_path, "r", encoding="utf-8") as samples_file:
+        for line in samples_file:
+            sample = json.loads(line)
+            if sample.get("sampling") == "all" and len(sample["answers"]) >= SAMPLES:
+                recorded[sample["invoice_number"]] = sample["answers"][:SAMPLES]
+
+    for invoice_number, answers in recorded.items():
+        baseline = fixed_majority(answers)
+
+        for policy, sampler in POLICIES.items():
+            answer, calls = (baseline, SAMPLES) if sampler is None else sampler.replay(answers)
+            rows.append({
+                "run": os.path.basename(run_folder),
+                "invoice_number": invoice_number,
+                "policy": policy,
+                "calls": calls,
+                "supplier_number": answer,
+                "agrees_with_fixed_5": answer == baseline,
+                "correct": answer == ground_truth[invoice_number] if invoice_number in ground_truth else None
+            })
+
+    print(f"Replayed {len(recorded)} invoices from {samples_path}")
+
+os.makedirs(output_folder, exist_ok=True)
+benchmark_df = pd.DataFrame(rows)
+benchmark_df.to_csv(output_csv_path, index=False)
+
+if not benchmark_df.empty:
+    summary = benchmark_df.groupby("policy", sort=False).agg(
+        calls_per_invoice=("calls", "mean"),
+        agreement_with_fixed_5=("agrees_with_fixed_5", "mean"),
+        evaluated=("correct", lambda c: c.notna().sum()),
+        accuracy=("correct", lambda c: c.dropna().astype(float).mean())
+    )
+    print(summary.round(3).to_string())
+
+print(f"Per-invoice replay saved to {output_csv_path}")
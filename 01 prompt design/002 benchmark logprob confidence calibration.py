@@ -0,0 +1,63 @@
+import os
+import glob
+import json
+import pandas as pd
+from ground_truth import supplier_ground_truth
+from logprob_calibration import Calibration, reliability_table, expected_calibration_error
+
+# Reliability curve of the single-call logprob confidence (SAMPLING = "logprobs" in the 002 five-sample script).
+# Each recorded single-call answer is compared with the supplier booked in the run's 006 evaluation; invoices
+# without ground truth are left out. The bin accuracies are saved as the calibration the 002 script maps raw
+# confidences with.
+
+LOGPROB_CALIBRATION_PATH = "runs/logprob_calibration.json"
+
+output_folder = "runs/Benchmarks/002 Logprob calibration"
+output_csv_path = os.path.join(output_folder, "logprob_confidence.csv")
+reliability_csv_path = os.path.join(output_folder, "reliability_curve.csv")
+
+rows = []
+for samples_path in glob.glob("runs/*/002 Supplier prediction/samples.jsonl"):
+    run_folder = os.path.dirname(os.path.dirname(samples_path))
+
+    ground_truth = supplier_ground_truth(run_folder)
+
+    # The last single-call answer of each invoice
+    single_calls = {}
+    with open(samples_path, "r", encoding="utf-8") as samples_file:
+        for line in samples_file:
+            sample = json.loads(line)
+            if "confidence" in sample:
+                single_calls[sample["invoice_number"]] = (sample["answers"][0], sample["confidence"])
+
+    evaluated = [n for n in single_calls if n in ground_truth]
+    for invoice_number in evaluated:
+        answer, confidence = single_calls[invoice_number]
+        rows.append({
+            "run": os.path.basename(run_folder),
+            "invoice_number": invoice_number,
+            "supplier_number": answer,
+            "ground_truth": ground_truth[invoice_number],
+            "confidence": confidence,
+            "correct": answer == ground_truth[invoice_number]
+        })
+
+    print(f"Found {len(single_calls)} single-call answers in {samples_path}, {len(evaluated)} with 006 ground truth")
+
+os.makedirs(output_folder, exist_ok=True)
+benchmark_df = pd.DataFrame(rows)
+benchmark_df.to_csv(output_csv_path, index=False)
+
+if not benchmark_df.empty:
+    table = reliability_table(benchmark_df["confidence"], benchmark_df["correct"])
+    table.to_csv(reliability_csv_path)
+    print(table.round(3).to_string())
+    print(f"{len(benchmark_df)} answers, accuracy {benchmark_df['correct'].mean():.1%}, "
+          f"expected calibration error {expected_calibration_error(table):.3f}")
+
+    calibration = Calibration(LOGPROB_CALIBRATION_PATH)
+    calibration.fit(table)
+    calibration.save()
+    print(f"Calibration saved to {LOGPROB_CALIBRATION_PATH}")
+
+print(f"Per-invoice confidences saved to {output_csv_path}")
@@ -0,0 +1,142 @@
+import os
+import time
+import json
+import pandas as pd
+import google.generativeai as genai
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from local_gemini import LocalGenerativeModel
+
+# Compares the two ways of drawing N supplier samples per invoice:
+#   calls      = N separate generate_content calls, sent concurrently (SAMPLING = "concurrent"/"all" in 002)
+#   candidates = one call with candidate_count = N (SAMPLING = "candidates" in 002, ATTEMPT_MODE = "candidates" in 004)
+# For every invoice the report shows input tokens billed, wall time, and whether the majority votes agree.
+
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
+
+genai.configure()
+
+run_name = "Your run name here"
+
+USE_LOCAL_MODEL = True  # False = benchmark against Gemini itself
+SAMPLES = 5
+MAJORITY = 3
+INVOICE_LIMIT = 50
+
+supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
+
+supplier_context = "\n".join([f"{row['Supplier name']}, {row['Supplier number']}, {row['Organization number']}"
+                              for _, row in supplier_df.iterrows()])
+
+input_folder = "runs/" + run_name + "/001 Output from OCR"
+output_folder = "runs/" + run_name + "/002 Benchmark multi-candidate sampling"
+output_csv_path = os.path.join(output_folder, "multi_candidate.csv")
+
+
+def supplier_prompt(invoice_text):
+    return f"""
+    Supplier List:
+    {supplier_context}
+
+Choose the correct supplier number from the supplier list above based on invoice text.
+    - Ignore [Redacted] and [Redacted]. That's our company.
+    - If there are several suppliers mentioned, return empty values.
+    - If you can't find a perfect match for either the supplier name or the organization number, return empty values.
+    - If you can't find the supplier in the supplier list, return empty values.
+    - If there are several potential matches from the supplier list, return empty values.
+
+    Empty values = the JSON below with no added content.
+
+    Invoice Text:
+    {invoice_text}
+
+    Return the result in JSON format:
+    {{
+      "supplier_name": "",
+      "supplier_number": "",
+      "organization_number": ""
+    }}
+    """
+
+
+def supplier_numbers(response, candidate_count):
+    """Supplier number of every candidate in the response, "" for missing or malformed ones."""
+    numbers = []
+    for candidate in list(response.candidates)[:candidate_count]:
+        try:
+            json_text = candidate.content.parts[0].text.strip()
+            if json_text.startswith("```json"):
+                json_text = json_text[7:]
+            if json_text.endswith("```"):
+                json_text = json_text[:-3]
+            parsed = json.loads(json_text.strip())
+            numbers.append(str(parsed.get("supplier_number", "")) if isinstance(parsed, dict) else "")
+        except Exception:
+            numbers.append("")
+    return numbers + [""] * (candidate_count - len(numbers))
+
+
+def call(prompt, candidate_count):
+    model = LocalGenerativeModel("gemini-2.0-flash") if USE_LOCAL_MODEL else genai.GenerativeModel("gemini-2.0-flash")
+    config = {"temperature": 1}
+    if candidate_count > 1:
+        config["candidate_count"] = candidate_count
+
+    started = time.perf_counter()
+    response = model.generate_content(prompt, generation_config=config)
+    return response, time.perf_counter() - started
+
+
+def majority(numbers):
+    supplier, count = Counter(numbers).most_common(1)[0]
+    return supplier if supplier != "" and count >= MAJORITY else ""
+
+
+os.makedirs(output_folder, exist_ok=True)
+
+invoice_numbers = sorted(f.replace(".txt", "") for f in os.listdir(input_folder) if f.endswith(".txt"))[:INVOICE_LIMIT]
+
+benchmark_rows = []
+for invoice_number in invoice_numbers:
+    with open(os.path.join(input_folder, f"{invoice_number}.txt"), "r", encoding="utf-8") as file:
+        prompt = supplier_prompt(file.read())
+
+    # N calls at the same time
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=SAMPLES) as executor:
+        results = list(executor.map(lambda _: call(prompt, 1), range(SAMPLES)))
+    calls_seconds = time.perf_counter() - started
+    calls_numbers = [supplier_numbers(response, 1)[0] for response, _ in results]
+
+    # One call with N candidates
+    response, candidates_seconds = call(prompt, SAMPLES)
+    candidates_numbers = supplier_numbers(response, SAMPLES)
+
+    for mode, numbers, tokens, seconds, request_seconds in [
+        ("calls", calls_numbers, sum(r.usage_metadata.prompt_token_count for r, _ in results), calls_seconds,
+         sum(s for _, s in results)),
+        ("candidates", candidates_numbers, response.usage_metadata.prompt_token_count, candidates_seconds,
+         candidates_seconds)
+    ]:
+        benchmark_rows.append({
+            "invoice_number": invoice_number,
+            "mode": mode,
+            "prompt_tokens": tokens,
+            "wall_seconds": seconds,
+            "request_seconds": request_seconds,
+            "answers": json.dumps(numbers),
+            "supplier_number": majority(numbers)
+        })
+
+    print(f"Benchmarked {invoice_number}")
+
+benchmark_df = pd.DataFrame(benchmark_rows)
+benchmark_df.to_csv(output_csv_path, index=False)
+
+if not benchmark_df.empty:
+    print(benchmark_df.groupby("mode")[["prompt_tokens", "wall_seconds", "request_seconds"]].mean().round(3).to_string())
+
+    paired = benchmark_df.pivot(index="invoice_number", columns="mode", values="supplier_number")
+    print(f"Majority vote agreement between the two modes: {(paired['calls'] == paired['candidates']).mean():.0%}")
+
+print(f"Benchmark saved to {output_csv_path}")
@@ -0,0 +1,154 @@
+import os
+import time
+import json
+import pandas as pd
+import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor
+from local_gemini import LocalGenerativeModel
+from ground_truth import supplier_ground_truth
+
+# Accuracy vs. batch size for batched supplier prompts (BATCH_SIZE in the 002 five-sample script).
+# Every invoice of the run with 006 ground truth is sent once per batch size, in batches of that many invoices,
+# and the answers are compared with the supplier the accountants booked. The report shows accuracy, how many invoices
+# the responses dropped (these would be re-queued), and input tokens and time per invoice.
+
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
+
+genai.configure()
+
+run_name = "Your run name here"
+
+USE_LOCAL_MODEL = True  # False = benchmark against Gemini itself
+BATCH_SIZES = [1, 2, 5, 10, 20]
+INVOICE_LIMIT = 100
+WORKERS = 8
+
+supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
+
+supplier_context = "\n".join([f"{row['Supplier name']}, {row['Supplier number']}, {row['Organization number']}"
+                              for _, row in supplier_df.iterrows()])
+
+input_folder = "runs/" + run_name + "/001 Output from OCR"
+output_folder = "runs/" + run_name + "/002 Benchmark batch size"
+output_csv_path = os.path.join(output_folder, "batch_size.csv")
+
+
+def supplier_prompt_prefix(supplier_list):
+    return f"""
+    Supplier List:
+    {supplier_list}
+
+"""
+
+
+def extract_suppliers_batch(invoices):
+    """Batched supplier prompt of the 002 five-sample script. Returns ({invoice_number: result}, prompt tokens)."""
+    invoice_blocks = "\n\n".join(
+        f"=== INVOICE {invoice_number} START ===\n{invoice_text}\n=== INVOICE {invoice_number} END ==="
+        for invoice_number, invoice_text in invoices
+    )
+
+    prompt = f"""
+Choose the correct supplier number from the supplier list above for each of the invoices below, based on invoice text.
+    - Every invoice is between its START and END line. Treat each invoice on its own.
+    - Ignore [Redacted] and [Redacted]. That's our company.
+    - If there are several suppliers mentioned, return empty values.
+    - If you can't find a perfect match for either the supplier name or the organization number, return empty values.
+    - If you can't find the supplier in the supplier list, return empty values.
+    - If there are several potential matches from the supplier list, return empty values.
+
+    Empty values = the JSON object below with only the invoice_number filled in.
+
+    Invoices:
+    {invoice_blocks}
+
+    Return one JSON object per invoice, in a JSON array:
+    [
+      {{
+        "invoice_number": "",
+        "supplier_name": "",
+        "supplier_number": "",
+        "organization_number": ""
+      }}
+    ]
+    """
+
+    model = LocalGenerativeModel("gemini-2.0-flash") if USE_LOCAL_MODEL else genai.GenerativeModel("gemini-2.0-flash")
+
+    try:
+        response = model.generate_content([supplier_prompt_prefix(supplier_context), prompt],
+                                          generation_config={"temperature": 1})
+        prompt_tokens = response.usage_metadata.prompt_token_count
+
+        json_text = response.candidates[0].content.parts[0].text.strip()
+        if json_text.startswith("```json"):
+            json_text = json_text[7:]
+        if json_text.endswith("```"):
+            json_text = json_text[:-3]
+        parsed = json.loads(json_text.strip())
+
+    except Exception as e:
+        print(f"Invalid or non-JSON batch response. Error: {e}")
+        return {}, 0
+
+    results = {}
+    for item in parsed if isinstance(parsed, list) else []:
+        if isinstance(item, dict) and "supplier_number" in item:
+            results.setdefault(str(item.get("invoice_number", "")), str(item["supplier_number"]))
+    return results, prompt_tokens
+
+
+os.makedirs(output_folder, exist_ok=True)
+
+ground_truth = supplier_ground_truth("runs/" + run_name)
+if not ground_truth:
+    print(f"No 006 ground truth for run {run_name}, nothing to score against")
+
+invoices = []
+for invoice_number in sorted(ground_truth)[:INVOICE_LIMIT]:
+    text_path = os.path.join(input_folder, f"{invoice_number}.txt")
+    if os.path.exists(text_path):
+        with open(text_path, "r", encoding="utf-8") as file:
+            invoices.append((invoice_number, file.read()))
+
+benchmark_rows = []
+for batch_size in BATCH_SIZES:
+    batches = [invoices[i:i + batch_size] for i in range(0, len(invoices), batch_size)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        answers = list(executor.map(extract_suppliers_batch, batches))
+    seconds = time.perf_counter() - started
+
+    prompt_tokens = sum(tokens for _, tokens in answers)
+    for batch, (results, _) in zip(batches, answers):
+        for invoice_number, _ in batch:
+            answer = results.get(invoice_number)
+            benchmark_rows.append({
+                "batch_size": batch_size,
+                "invoice_number": invoice_number,
+                "ground_truth": ground_truth[invoice_number],
+                "answer": answer if answer is not None else "",
+                "dropped": answer is None,
+                "correct": answer == ground_truth[invoice_number],
+                "requests": len(batches),
+                "prompt_tokens_per_invoice": prompt_tokens / max(len(invoices), 1),
+                "seconds_per_invoice": seconds / max(len(invoices), 1)
+            })
+
+    print(f"Batch size {batch_size}: {len(batches)} requests")
+
+benchmark_df = pd.DataFrame(benchmark_rows)
+benchmark_df.to_csv(output_csv_path, index=False)
+
+if not benchmark_df.empty:
+    summary = benchmark_df.groupby("batch_size").agg(
+        accuracy=("correct", "mean"),
+        dropped=("dropped", "mean"),
+        requests=("requests", "first"),
+        prompt_tokens_per_invoice=("prompt_tokens_per_invoice", "first"),
+        seconds_per_invoice=("seconds_per_invoice", "first")
+    )
+    print(summary.round(3).to_string())
+
+print(f"Benchmark saved to {output_csv_path}")
@@ -0,0 +1,74 @@
+import os
+import glob
+import pandas as pd
+import google.generativeai as genai
+from local_gemini import LocalGenerativeModel
+from supplier_retrieval import SupplierRetriever
+from ground_truth import supplier_ground_truth
+
+# Measures how often the supplier booked in a run's 006 evaluation is among the top k retrieved suppliers (recall@k),
+# and how many prompt tokens the top-k supplier list saves compared to the whole list.
+# Use it to pick TOP_K_SUPPLIERS in the 002 supplier prediction script: the smallest k with recall close to 100%.
+
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
+
+genai.configure()
+
+USE_LOCAL_MODEL = True  # True = count tokens with the local estimate, False = with the Gemini count_tokens endpoint
+K_VALUES = [1, 5, 10, 25, 50, 100]
+
+supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
+retriever = SupplierRetriever(supplier_df)
+model = LocalGenerativeModel("gemini-2.0-flash") if USE_LOCAL_MODEL else genai.GenerativeModel("gemini-2.0-flash")
+
+output_folder = "runs/Benchmarks/002 Supplier retrieval"
+output_csv_path = os.path.join(output_folder, "recall_at_k.csv")
+
+
+def format_supplier_context(suppliers):
+    return "\n".join([f"{row['Supplier name']}, {row['Supplier number']}, {row['Organization number']}"
+                      for _, row in suppliers.iterrows()])
+
+
+full_context_tokens = model.count_tokens(format_supplier_context(supplier_df)).total_tokens
+
+# Every invoice with 006 ground truth in any run, paired with its OCR text. Suppliers predicted by earlier 002 runs
+# are not used: those runs may have used top-k retrieval themselves
+rows = []
+for ocr_folder in glob.glob("runs/*/001 Output from OCR"):
+    run_folder = os.path.dirname(ocr_folder)
+    ground_truth = supplier_ground_truth(run_folder)
+
+    for invoice_number, supplier_number in ground_truth.items():
+        text_path = os.path.join(ocr_folder, f"{invoice_number}.txt")
+        if not os.path.exists(text_path):
+            continue
+
+        with open(text_path, "r", encoding="utf-8") as file:
+            invoice_text = file.read()
+
+        ranking = retriever.rank(invoice_text)
+        rank = ranking.index(supplier_number) + 1 if supplier_number in ranking else None
+
+        row = {"run": os.path.basename(run_folder), "invoice_number": invoice_number, "rank": rank}
+        for k in K_VALUES:
+            context = format_supplier_context(retriever.top_k(invoice_text, k))
+            row[f"tokens_at_{k}"] = model.count_tokens(context).total_tokens
+        rows.append(row)
+
+    print(f"Scored {len(ground_truth)} invoices with ground truth in {run_folder}")
+
+os.makedirs(output_folder, exist_ok=True)
+benchmark_df = pd.DataFrame(rows)
+benchmark_df.to_csv(output_csv_path, index=False)
+
+print(f"{len(benchmark_df)} invoices, {len(supplier_df)} suppliers, {full_context_tokens} tokens for the whole supplier list")
+
+if not benchmark_df.empty:
+    for k in K_VALUES:
+        recall = (benchmark_df["rank"].notna() & (benchmark_df["rank"] <= k)).mean()
+        tokens = benchmark_df[f"tokens_at_{k}"].mean()
+        print(f"k={k:>4}: recall {recall:.1%}, {tokens:.0f} supplier tokens per prompt "
+              f"({1 - tokens / full_context_tokens:.0%} saved)")
+
+print(f"Per-invoice ranks saved to {output_csv_path}")
@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import pandas as pd
+import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor
+from local_gemini import LocalGenerativeModel
+from ground_truth import supplier_ground_truth
+
+# Token savings and accuracy deltas of the TEXT_WINDOW modes of the 002 five-sample script.
+# Every invoice of the run with 006 ground truth gets one supplier call per mode. The windowed modes escalate to
+# the full text when the trimmed attempt returns no supplier, like the script does. Answers are compared with the
+# supplier the accountants booked, so a run that itself used windows isn't graded against its own output. The
+# tokens of the trimmed attempt and the escalated total are reported separately; a window mode only pays off if
+# its total stays below the full text at no loss in accuracy.
+
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
+
+genai.configure()
+
+run_name = "Your run name here"
+
+USE_LOCAL_MODEL = True  # False = benchmark against Gemini itself
+TEXT_WINDOWS = ["full", "header_footer", "page_header_footer"]
+WINDOW_LINES = 10
+INVOICE_LIMIT = 100
+WORKERS = 8
+
+supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
+
+supplier_context = "\n".join([f"{row['Supplier name']}, {row['Supplier number']}, {row['Organization number']}"
+                              for _, row in supplier_df.iterrows()])
+
+input_folder = "runs/" + run_name + "/001 Output from OCR"
+output_folder = "runs/" + run_name + "/002 Benchmark text windows"
+output_csv_path = os.path.join(output_folder, "text_windows.csv")
+
+
+def window_text(invoice_text, text_window):
+    """Same windows as window_text in the 002 five-sample script."""
+    if text_window == "full":
+        return invoice_text
+
+    if text_window == "page_header_footer":
+        pages = [p for p in re.split(r"^--- Page \d+ ---$|\f", invoice_text, flags=re.M) if p.strip()]
+        if len(pages) > 1:
+            header = pages[0].strip().split('\n')[:WINDOW_LINES]
+            footer = pages[-1].strip().split('\n')[-WINDOW_LINES:]
+            return '\n'.join(header) + '\n[...]\n' + '\n'.join(footer)
+
+    lines = invoice_text.strip().split('\n')
+    if len(lines) <= 2 * WINDOW_LINES:
+        return invoice_text
+    header, footer = lines[:WINDOW_LINES], lines[-WINDOW_LINES:]
+
+    return '\n'.join(header) + '\n[...]\n' + '\n'.join(footer)
+
+
+def extract_supplier_from_gemini(invoice_text):
+    """Supplier prompt of the 002 five-sample script. Returns (supplier number, prompt tokens)."""
+    prompt = f"""
+Choose the correct supplier number from the supplier list above based on invoice text.
+    - Ignore [Redacted] and [Redacted]. That's our company.
+    - If there are several suppliers mentioned, return empty values.
+    - If you can't find a perfect match for either the supplier name or the organization number, return empty values.
+    - If you can't find the supplier in the supplier list, return empty values.
+    - If there are several potential matches from the supplier list, return empty values.
+
+    Empty values = the JSON below with no added content.
+
+    Invoice Text:
+    {invoice_text}
+
+    Return the result in JSON format:
+    {{
+      "supplier_name": "",
+      "supplier_number": "",
+      "organization_number": ""
+    }}
+    """
+
+    model = LocalGenerativeModel("gemini-2.0-flash") if USE_LOCAL_MODEL else genai.GenerativeModel("gemini-2.0-flash")
+
+    try:
+        response = model.generate_content([f"\n    Supplier List:\n    {supplier_context}\n\n", prompt],
+                                          generation_config={"temperature": 1})
+        json_text = response.candidates[0].content.parts[0].text.strip()
+        if json_text.startswith("```json"):
+            json_text = json_text[7:]
+        if json_text.endswith("```"):
+            json_text = json_text[:-3]
+        parsed = json.loads(json_text.strip())
+        return str(parsed.get("supplier_number", "")) if isinstance(parsed, dict) else "", \
+            response.usage_metadata.prompt_token_count
+
+    except Exception as e:
+        print(f"Invalid or non-JSON response. Error: {e}")
+        return "", 0
+
+
+def benchmark_invoice(invoice_number, invoice_text, text_window):
+    trimmed = window_text(invoice_text, text_window)
+    answer, trimmed_tokens = extract_supplier_from_gemini(trimmed)
+    escalated = answer == "" and trimmed != invoice_text
+    escalation_tokens = 0
+
+    if escalated:
+        answer, escalation_tokens = extract_supplier_from_gemini(invoice_text)
+
+    return {
+        "invoice_number": invoice_number,
+        "text_window": text_window,
+        "answer": answer,
+        "ground_truth": ground_truth[invoice_number],
+        "correct": answer == ground_truth[invoice_number],
+        "escalated": escalated,
+        "trimmed_tokens": trimmed_tokens,
+        "escalation_tokens": escalation_tokens,
+        "prompt_tokens": trimmed_tokens + escalation_tokens
+    }
+
+
+os.makedirs(output_folder, exist_ok=True)
+
+ground_truth = supplier_ground_truth("runs/" + run_name)
+if not ground_truth:
+    print(f"No 006 ground truth for run {run_name}, nothing to score against")
+
+invoices = []
+for invoice_number in sorted(ground_truth)[:INVOICE_LIMIT]:
+    text_path = os.path.join(input_folder, f"{invoice_number}.txt")
+    if os.path.exists(text_path):
+        with open(text_path, "r", encoding="utf-8") as file:
+            invoices.append((invoice_number, file.read()))
+
+with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+    benchmark_rows = list(executor.map(
+        lambda job: benchmark_invoice(*job),
+        [(n, t, w) for w in TEXT_WINDOWS for n, t in invoices]
+    ))
+
+benchmark_df = pd.DataFrame(benchmark_rows)
+benchmark_df.to_csv(output_csv_path, index=False)
+
+if not benchmark_df.empty:
+    summary = benchmark_df.groupby("text_window", sort=False).agg(
+        accuracy=("correct", "mean"),
+        escalated=("escalated", "mean"),
+        trimmed_tokens=("trimmed_tokens", "mean"),
+        escalation_tokens=("escalation_tokens", "mean"),
+        prompt_tokens=("prompt_tokens", "mean")
+    )
+    summary["accuracy_delta"] = summary["accuracy"] - summary.loc["full", "accuracy"]
+    summary["net_tokens_vs_full"] = summary["prompt_tokens"] - summary.loc["full", "prompt_tokens"]
+    print(summary.round(3).to_string())
+
+    paying_off = summary[(summary["net_tokens_vs_full"] < 0) & (summary["accuracy_delta"] >= 0)]
+    if paying_off.empty:
+        print('No window mode saves tokens at no loss in accuracy, keep TEXT_WINDOW = "full"')
+    else:
+        best = paying_off["net_tokens_vs_full"].idxmin()
+        print(f'TEXT_WINDOW = "{best}" saves {-summary.loc[best, "net_tokens_vs_full"]:.0f} prompt tokens per invoice '
+              f'net of escalations, at no loss in accuracy')
+
+print(f"Benchmark saved to {output_csv_path}")
@@ -3,12 +3,17 @@ import pandas as pd
 import json
 import google.generativeai as genai
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from coalescing_model import CoalescingModel
 
 # Set up Google Cloud credentials
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
 
 genai.configure()
 
+# At temperature 0 the three requests per invoice are the same request, so they share one real call
+model = CoalescingModel(genai.GenerativeModel("gemini-2.0-flash"))
+
 # Load the supplier list
 supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
 
@@ -57,7 +62,6 @@ Choose the correct supplier number from the supplier list based on invoice text.
     }
 
     try:
-        model = genai.GenerativeModel("gemini-2.0-flash")
         response = model.generate_content(
             prompt,
             generation_config={
@@ -96,8 +100,9 @@ for txt_file in os.listdir(input_folder):
         with open(file_path, "r", encoding="utf-8") as file:
             invoice_text = file.read()
 
-        # 3 Gemini requests per invoice
-        responses = [extract_supplier_from_gemini(invoice_text) for _ in range(3)]
+        # 3 Gemini requests per invoice, sent at the same time
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            responses = list(executor.map(lambda _: extract_supplier_from_gemini(invoice_text), range(3)))
 
         # Count occurrences of supplier_number
         supplier_counts = Counter(
@@ -129,4 +134,6 @@ for txt_file in os.listdir(input_folder):
 
 result_df.to_csv(output_csv_path, index=False)
 
+print(model.summary())
+
 print(f"Results saved to {output_csv_path}")
@@ -1,14 +1,52 @@
 import os
+import re
 import pandas as pd
 import json
+import time
+import inspect
+import fitz
 import google.generativeai as genai
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from local_gemini import LocalGenerativeModel, count_tokens
+import supplier_matcher
+from supplier_matcher import SupplierMatcher
+from supplier_retrieval import SupplierRetriever
+from adaptive_sampler import AdaptiveSampler
+from supplier_policy import SupplierPolicyStore
+from logprob_calibration import Calibration, supplier_number_confidence
+from context_cache import PrefixCachedModel
+from coalescing_model import CoalescingModel
+from run_manifest import hash_value, load_manifest, save_manifest
 
 # Set up Google Cloud credentials
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
 
 genai.configure()
 
+INPUT_MODE = "ocr_text"  # "ocr_text" = prompt with the text in 001 Output from OCR, "pdf" = send the first 15 PDF pages inline and skip OCR
+USE_LOCAL_MODEL = False  # True = answer with the LocalGenerativeModel stand-in instead of Gemini
+USE_PRE_MATCHER = True  # Resolve invoices with exactly one org number or name hit in the supplier list without calling Gemini
+OWN_ORGANIZATION_NUMBERS = []  # Our company's org numbers, printed on every invoice as the buyer
+SAMPLING = "concurrent"  # "concurrent" = concurrent waves of requests until the majority is decided, "all" = wait for all SAMPLES, "candidates" = one request for SAMPLES candidates, "adaptive" = see below, "policy" = per-supplier policy, "logprobs" = see below
+SAMPLES = 5  # Most Gemini requests per invoice. The cap in adaptive mode
+MAJORITY = 3  # Votes a supplier needs. No further samples are sent once the outcome can't change
+ADAPTIVE_START = 2  # Adaptive mode: samples drawn before the stopping rule is checked, one more per disagreement
+ADAPTIVE_RULE = "agreement"  # "agreement" = leader two votes ahead, "sprt" = sequential probability ratio test
+POLICY_STORE_PATH = "runs/supplier_policy.json"  # Policy mode: one temperature 0 call, then ensemble size, temperature and verification by the supplier's tier
+LEARN_POLICY = True  # Policy mode: rebuild the store from the result.csv and sense-check outputs of every run before predicting
+LOGPROB_THRESHOLD = 0.95  # Logprobs mode: one temperature 0 call with token log-probabilities; invoices below this calibrated confidence escalate to the ensemble
+LOGPROB_CALIBRATION_PATH = "runs/logprob_calibration.json"  # Written by the logprob calibration report; raw confidences are used until it exists
+TOP_K_SUPPLIERS = 0  # Suppliers retrieved into each prompt, 0 = the whole supplier list. Only set a k the recall@k benchmark shows keeps the booked supplier
+BATCH_SIZE = 1  # Invoices per supplier request. Above 1 all SAMPLES are sent as batched prompts, see the batch size benchmark
+BATCH_ROUNDS = 3  # Times invoices missing from a batched response are re-queued before they are sent one by one
+BATCH_WORKERS = 8  # Batched requests in flight at the same time
+TEXT_WINDOW = "full"  # "full" = whole OCR text, "header_footer" = first and last WINDOW_LINES lines, "page_header_footer" = top of page 1 and bottom of the last page. Keep "full" unless the text window benchmark shows a net token saving at no loss in accuracy
+WINDOW_LINES = 10  # Lines per window. The supplier is almost always in the header or footer
+USE_CONTEXT_CACHE = True  # Register the whole supplier list once per run as cached content if it reaches the cache minimum. Used when TOP_K_SUPPLIERS = 0 or INPUT_MODE = "pdf"
+
+GenerativeModel = LocalGenerativeModel if USE_LOCAL_MODEL else genai.GenerativeModel
+
 # Load the supplier list
 supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
 
@@ -16,17 +54,100 @@ supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
 supplier_context = "\n".join([f"{row['Supplier name']}, {row['Supplier number']}, {row['Organization number']}" 
                               for _, row in supplier_df.iterrows()])
 
+matcher = SupplierMatcher(supplier_df, OWN_ORGANIZATION_NUMBERS)
+retriever = SupplierRetriever(supplier_df)
+
+
+def format_supplier_context(suppliers):
+    return "\n".join([f"{row['Supplier name']}, {row['Supplier number']}, {row['Organization number']}"
+                      for _, row in suppliers.iterrows()])
+
+
+def supplier_prompt_prefix(supplier_list):
+    """Static start of the supplier prompt. Identical for every call, so it can be cached."""
+    return f"""
+    Supplier List:
+    {supplier_list}
+
+"""
+
+
+# The whole supplier list is the same for every invoice; top-k candidate lists are not, so they are sent uncached
+supplier_model = PrefixCachedModel(
+    "gemini-2.0-flash-001",
+    supplier_prompt_prefix(supplier_context),
+    use_cache=USE_CONTEXT_CACHE and (not TOP_K_SUPPLIERS or INPUT_MODE == "pdf"),
+    use_local_model=USE_LOCAL_MODEL
+)
+
+# Single-candidate temperature 0 requests (the first call in policy mode, the logprobs call) are deterministic, so
+# identical ones share one call. Sampled requests pass straight through
+coalesced_supplier_model = CoalescingModel(supplier_model)
+candidate_model = CoalescingModel(GenerativeModel("gemini-2.0-flash"))
+
 run_name = "Your run name here"
 
 # Paths
 input_folder = "runs/" + run_name + "/001 Output from OCR"
+pdf_input_folder = "runs/" + run_name + "/000 Initial input"
 output_csv_path = "runs/" + run_name + "/002 Supplier prediction/result.csv"
+samples_path = "runs/" + run_name + "/002 Supplier prediction/samples.jsonl"  # Every answer in order, for replaying stopping rules
+manifest_path = "runs/" + run_name + "/002 Supplier prediction/manifest.json"
 
 result_df = pd.DataFrame(columns=["invoice_number", "supplier_name", "supplier_number", "organization_number"])
 
-def extract_supplier_from_gemini(invoice_text):
+def window_text(invoice_text):
+    """Cuts the invoice text down to the windows of TEXT_WINDOW. Short texts are returned whole.
+
+    Pages are split on the page markers of sharded OCR ("--- Page n ---") or form feeds; without them the text is
+    treated as a single page.
+    """
+    if TEXT_WINDOW == "full":
+        return invoice_text
+
+    if TEXT_WINDOW == "page_header_footer":
+        pages = [p for p in re.split(r"^--- Page \d+ ---$|\f", invoice_text, flags=re.M) if p.strip()]
+        if len(pages) > 1:
+            header = pages[0].strip().split('\n')[:WINDOW_LINES]
+            footer = pages[-1].strip().split('\n')[-WINDOW_LINES:]
+            return '\n'.join(header) + '\n[...]\n' + '\n'.join(footer)
+
+    lines = invoice_text.strip().split('\n')
+    if len(lines) <= 2 * WINDOW_LINES:
+        return invoice_text
+    header, footer = lines[:WINDOW_LINES], lines[-WINDOW_LINES:]
+
+    return '\n'.join(header) + '\n[...]\n' + '\n'.join(footer)
+
+
+def extract_first_15_pages(input_path):
+    """Extracts the first 15 pages of a PDF using PyMuPDF and returns them as PDF bytes."""
+    doc = fitz.open(input_path)
+    new_doc = fitz.open()
+
+    new_doc.insert_pdf(doc, from_page=0, to_page=min(15, len(doc)) - 1)
+
+    pdf_bytes = new_doc.tobytes(no_new_id=True)
+    new_doc.close()
+    doc.close()
+
+    return pdf_bytes
+
+def extract_supplier_from_gemini(invoice_text, invoice_pdf=None, candidate_context=None, temperature=1):
+    """candidate_context replaces the full supplier list with the retrieved top-k suppliers."""
+    return extract_supplier_candidates(invoice_text, invoice_pdf, candidate_context, 1, temperature)[0]
+
+
+def extract_supplier_candidates(invoice_text, invoice_pdf=None, candidate_context=None, candidate_count=1, temperature=1,
+                                logprobs=False):
+    """One request for candidate_count answers to the same prompt. Returns a result per requested candidate,
+    the empty result for any candidate that is missing or malformed. With logprobs, well-formed results also carry
+    the raw confidence of their supplier_number."""
+    if invoice_pdf is not None:
+        invoice_text = "The invoice is attached as a PDF."
+
     prompt = f"""
-Choose the correct supplier number from the supplier list based on invoice text.
+Choose the correct supplier number from the supplier list above based on invoice text.
     - Ignore [Redacted] and [Redacted]. That's our company.
     - If there are several suppliers mentioned, return empty values.
     - If you can't find a perfect match for either the supplier name or the organization number, return empty values.
@@ -35,9 +156,6 @@ Choose the correct supplier number from the supplier list based on invoice text.
 
     Empty values = the JSON below with no added content.
 
-    Supplier List:
-    {supplier_context}
-
     Invoice Text:
     {invoice_text}
 
@@ -56,15 +174,109 @@ Choose the correct supplier number from the supplier list based on invoice text.
     }
 
     try:
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        response = model.generate_content(
-            prompt,
-            generation_config={
-                "temperature": 1
-            }
-        )
+        # In pdf mode the pages go in as an inline document part after the prompt
+        contents = prompt if invoice_pdf is None else [prompt, {"mime_type": "application/pdf", "data": invoice_pdf}]
+
+        generation_config = {"temperature": temperature}
+        if candidate_count > 1:
+            generation_config["candidate_count"] = candidate_count
+        if logprobs:
+            generation_config["response_logprobs"] = True
+
+        if candidate_context is None:
+            response = coalesced_supplier_model.generate_content(contents, generation_config=generation_config)
+        else:
+            parts = contents if isinstance(contents, list) else [contents]
+            response = candidate_model.generate_content(
+                [supplier_prompt_prefix(candidate_context)] + parts,
+                generation_config=generation_config
+            )
+        candidates = list(response.candidates)
+
+    except Exception as e:
+        print(f"Request failed. Replacing with empty results. Error: {e}")
+        return [{**empty_result, "failed": True}] * candidate_count
+
+    results = []
+    for candidate in candidates[:candidate_count]:
+        try:
+            json_text = candidate.content.parts[0].text
+
+            # Remove markdown formatting if present
+            if json_text.startswith("```json"):
+                json_text = json_text[7:]
+            if json_text.endswith("```"):
+                json_text = json_text[:-3]
+
+            parsed = json.loads(json_text.strip())
+
+            # Ensure it's a valid supplier JSON
+            if not isinstance(parsed, dict):
+                parsed = empty_result
+
+            if not all(k in parsed for k in ["supplier_name", "supplier_number", "organization_number"]):
+                parsed = empty_result
+            elif logprobs:
+                parsed = {**parsed, "confidence": supplier_number_confidence(candidate)}
+
+            results.append(parsed)
+
+        except Exception as e:
+            print(f"Invalid or non-JSON response. Replacing with empty result. Error: {e}")
+            results.append({**empty_result, "failed": True})
 
-        json_text = response.candidates[0].content.parts[0].text
+    return results + [empty_result] * (candidate_count - len(results))
+
+
+def extract_suppliers_batch(invoices, candidate_context=None):
+    """One request for several invoices. invoices is a list of (invoice_number, invoice_text).
+
+    Returns {invoice_number: supplier result} for the invoices the response answered with a well-formed result.
+    Invoices that are missing, repeated or malformed in the response are left out, so the caller can re-queue them.
+    """
+    invoice_blocks = "\n\n".join(
+        f"=== INVOICE {invoice_number} START ===\n{invoice_text}\n=== INVOICE {invoice_number} END ==="
+        for invoice_number, invoice_text in invoices
+    )
+
+    prompt = f"""
+Choose the correct supplier number from the supplier list above for each of the invoices below, based on invoice text.
+    - Every invoice is between its START and END line. Treat each invoice on its own.
+    - Ignore [Redacted] and [Redacted]. That's our company.
+    - If there are several suppliers mentioned, return empty values.
+    - If you can't find a perfect match for either the supplier name or the organization number, return empty values.
+    - If you can't find the supplier in the supplier list, return empty values.
+    - If there are several potential matches from the supplier list, return empty values.
+
+    Empty values = the JSON object below with only the invoice_number filled in.
+
+    Invoices:
+    {invoice_blocks}
+
+    Return one JSON object per invoice, in a JSON array:
+    [
+      {{
+        "invoice_number": "",
+        "supplier_name": "",
+        "supplier_number": "",
+        "organization_number": ""
+      }}
+    ]
+    """
+
+    try:
+        if candidate_context is None:
+            response = supplier_model.generate_content(prompt, generation_config={"temperature": 1})
+        else:
+            model = GenerativeModel("gemini-2.0-flash")
+            response = model.generate_content(
+                [supplier_prompt_prefix(candidate_context), prompt],
+                generation_config={
+                    "temperature": 1
+                }
+            )
+
+        json_text = response.candidates[0].content.parts[0].text.strip()
 
         # Remove markdown formatting if present
         if json_text.startswith("```json"):
@@ -74,58 +286,372 @@ Choose the correct supplier number from the supplier list based on invoice text.
 
         parsed = json.loads(json_text.strip())
 
-        # Ensure it's a valid supplier JSON
-        if not isinstance(parsed, dict):
-            return empty_result
+    except Exception as e:
+        print(f"Invalid or non-JSON batch response. Re-queuing {len(invoices)} invoices. Error: {e}")
+        return {}
 
-        if not all(k in parsed for k in ["supplier_name", "supplier_number", "organization_number"]):
-            return empty_result
+    if not isinstance(parsed, list):
+        return {}
 
-        return parsed
+    asked = {str(invoice_number) for invoice_number, _ in invoices}
+    results = {}
+    for item in parsed:
+        if not isinstance(item, dict) or not all(k in item for k in ["supplier_name", "supplier_number", "organization_number"]):
+            continue
+        invoice_number = str(item.get("invoice_number", ""))
+        if invoice_number in asked and invoice_number not in results:
+            results[invoice_number] = {k: item[k] for k in ["supplier_name", "supplier_number", "organization_number"]}
 
-    except Exception as e:
-        print(f"Invalid or non-JSON response. Replacing with empty result. Error: {e}")
-        return empty_result
+    return results
 
 
-# Process all text files
-for txt_file in os.listdir(input_folder):
-    if txt_file.endswith(".txt"):
-        file_path = os.path.join(input_folder, txt_file)
+def predict_suppliers_batched(invoices):
+    """Runs SAMPLES samples for every invoice with batched prompts. Returns ({invoice_number: responses}, requeued).
 
-        with open(file_path, "r", encoding="utf-8") as file:
-            invoice_text = file.read()
+    invoices maps invoice_number to (invoice_text, top-k candidate rows or None). Each round sends the outstanding
+    (invoice, sample) pairs in batches of BATCH_SIZE, with the union of the batch's candidates as supplier list.
+    Invoices a response leaves out go back in the queue; after BATCH_ROUNDS they are sent one by one.
+    """
+    responses = {invoice_number: [] for invoice_number in invoices}
+    pending = [(invoice_number, sample) for sample in range(SAMPLES) for invoice_number in invoices]
+    requeued = 0
+
+    def send(batch):
+        candidates = [invoices[n][1] for n in batch]
+        context = None
+        if all(c is not None for c in candidates):
+            context = format_supplier_context(pd.concat(candidates).drop_duplicates())
+        return extract_suppliers_batch([(n, invoices[n][0]) for n in batch], context)
+
+    for _ in range(BATCH_ROUNDS):
+        if not pending:
+            break
+
+        batches = []
+        for sample in range(SAMPLES):
+            numbers = [n for n, s in pending if s == sample]
+            batches += [(sample, numbers[i:i + BATCH_SIZE]) for i in range(0, len(numbers), BATCH_SIZE)]
+
+        with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+            answers = list(executor.map(lambda batch: send(batch[1]), batches))
+
+        pending = []
+        for (sample, numbers), answer in zip(batches, answers):
+            for invoice_number in numbers:
+                if str(invoice_number) in answer:
+                    responses[invoice_number].append(answer[str(invoice_number)])
+                else:
+                    pending.append((invoice_number, sample))
+                    requeued += 1
+
+    for invoice_number, _ in pending:
+        invoice_text, candidates = invoices[invoice_number]
+        context = format_supplier_context(candidates) if candidates is not None else None
+        responses[invoice_number].append(extract_supplier_from_gemini(invoice_text, None, context))
+
+    return responses, requeued
+
+
+def run_ensemble(invoice_text, invoice_pdf=None, candidate_context=None):
+    """Draws up to SAMPLES supplier samples in concurrent waves and returns every response.
+
+    The first wave is MAJORITY requests, each further wave the votes the leading answer still misses. Sampling stops
+    as soon as one answer (a supplier number or the empty answer) has MAJORITY votes, or no answer can get there with
+    the samples left, so no request is sent that the vote doesn't need. SAMPLING = "all" sends all SAMPLES at once.
+    """
+    responses = []
+    votes = Counter()
 
-        # 5 Gemini requests per invoice
-        responses = [extract_supplier_from_gemini(invoice_text) for _ in range(5)]
+    with ThreadPoolExecutor(max_workers=SAMPLES) as executor:
+        while len(responses) < SAMPLES:
+            leader_count = votes.most_common(1)[0][1] if votes else 0
+            remaining = SAMPLES - len(responses)
+            if SAMPLING != "all" and responses and (leader_count >= MAJORITY or leader_count + remaining < MAJORITY):
+                break
 
-        # Extract supplier numbers
-        supplier_numbers = [r.get('supplier_number', '') for r in responses]
+            wave = remaining if SAMPLING == "all" else min(MAJORITY - leader_count, remaining)
+            for response in executor.map(
+                lambda _: extract_supplier_from_gemini(invoice_text, invoice_pdf, candidate_context), range(wave)
+            ):
+                responses.append(response)
+                votes[response.get('supplier_number', '')] += 1
 
-        # Count occurrences
-        supplier_counts = Counter(supplier_numbers)
-        most_common_supplier, count = supplier_counts.most_common(1)[0]
+    return responses
 
-        # Determine majority result
-        if most_common_supplier == "" or count < 3:
-            final_result = {
-                "supplier_name": "",
-                "supplier_number": "",
-                "organization_number": ""
-            }
-        else:
-            final_result = next(r for r in responses if r['supplier_number'] == most_common_supplier)
 
-        new_row = pd.DataFrame([{
-            "invoice_number": txt_file.replace(".txt", ""),
-            "supplier_name": final_result["supplier_name"],
-            "supplier_number": final_result["supplier_number"],
-            "organization_number": final_result["organization_number"],
-            "majority_count": count
-        }])
+sampler = AdaptiveSampler(start=ADAPTIVE_START, cap=SAMPLES, rule=ADAPTIVE_RULE)
+
+policy_store = SupplierPolicyStore(POLICY_STORE_PATH)
+if SAMPLING == "policy":
+    if LEARN_POLICY:
+        policy_store.learn("runs")
+    print(policy_store.summary())
+
+
+def run_policy(invoice_text, invoice_pdf=None, candidate_context=None):
+    """One cheap temperature 0 prediction, then the rest of the ensemble its supplier's tier asks for.
+
+    Returns (responses, majority, tier, verify). Trusted suppliers stop at the first call; an empty first answer
+    falls in the unknown tier and gets the full ensemble.
+    """
+    first = extract_supplier_from_gemini(invoice_text, invoice_pdf, candidate_context, temperature=0)
+    tier, policy = policy_store.policy_for(first.get("supplier_number", ""))
+
+    responses = [first]
+    if policy["samples"] > 1:
+        with ThreadPoolExecutor(max_workers=policy["samples"] - 1) as executor:
+            responses += list(executor.map(
+                lambda _: extract_supplier_from_gemini(invoice_text, invoice_pdf, candidate_context, policy["temperature"]),
+                range(policy["samples"] - 1)
+            ))
+
+    return responses, policy["samples"] // 2 + 1, tier, policy["verify"]
+
+
+calibration = Calibration(LOGPROB_CALIBRATION_PATH)
+
+
+# Dependencies shared by every invoice: the supplier list and the prompt template (source of the prompt function)
+stage_dependencies = {
+    "suppliers": hash_value(supplier_context),
+    "prompt_version": hash_value(inspect.getsource(supplier_prompt_prefix) + inspect.getsource(extract_supplier_candidates)),
+    "samples": SAMPLES,
+    "majority": MAJORITY,
+    "sampling": [SAMPLING, ADAPTIVE_START, ADAPTIVE_RULE] if SAMPLING == "adaptive"
+                else [SAMPLING, hash_value(policy_store.suppliers)] if SAMPLING == "policy"
+                else [SAMPLING, LOGPROB_THRESHOLD, calibration.accuracy] if SAMPLING == "logprobs" else SAMPLING,
+    "pre_matcher": hash_value(inspect.getsource(supplier_matcher)) if USE_PRE_MATCHER else "off",
+    "top_k_suppliers": TOP_K_SUPPLIERS,
+    "batch_size": BATCH_SIZE,
+    "text_window": [TEXT_WINDOW, WINDOW_LINES]
+}
+
+manifest = load_manifest(manifest_path)
+new_manifest = {}
+reused = 0
+batch_queue = {}  # invoice_number -> (invoice_text, top-k candidates, dependencies), sent after the loop in batched mode
+
+
+def majority_row(invoice_number, responses, seconds, adaptive_answer=None, sampling=SAMPLING, majority=MAJORITY,
+                 confidence=None):
+    """Votes over the responses of one invoice and returns its result row. Also records the answers in samples.jsonl,
+    with the raw logprob confidence of a single-call answer."""
+    # Extract supplier numbers
+    supplier_numbers = [r.get('supplier_number', '') for r in responses]
+
+    # Count occurrences
+    supplier_counts = Counter(supplier_numbers)
+    most_common_supplier, count = supplier_counts.most_common(1)[0]
+
+    record = {"invoice_number": invoice_number, "sampling": sampling, "answers": supplier_numbers}
+    if confidence is not None:
+        record["confidence"] = confidence
+    with open(samples_path, "a", encoding="utf-8") as samples_file:
+        samples_file.write(json.dumps(record) + "\n")
+
+    # Determine majority result. In adaptive mode the stopping rule has already picked the answer
+    if adaptive_answer is not None:
+        accepted = adaptive_answer != ""
+        most_common_supplier, count = adaptive_answer, supplier_counts[adaptive_answer]
+    else:
+        accepted = most_common_supplier != "" and count >= majority
+
+    if not accepted:
+        final_result = {
+            "supplier_name": "",
+            "supplier_number": "",
+            "organization_number": ""
+        }
+    else:
+        final_result = next(r for r in responses if r['supplier_number'] == most_common_supplier)
+
+    return {
+        "invoice_number": invoice_number,
+        "supplier_name": final_result["supplier_name"],
+        "supplier_number": final_result["supplier_number"],
+        "organization_number": final_result["organization_number"],
+        "majority_count": count,
+        "matched_by": "gemini",
+        "votes": json.dumps(dict(supplier_counts)),
+        "samples_used": len(responses),
+        "failed_samples": sum(1 for r in responses if r.get("failed")),
+        "seconds": seconds
+    }
+
+
+if INPUT_MODE == "pdf":
+    invoice_files = [f for f in os.listdir(pdf_input_folder) if f.endswith(".pdf")]
+else:
+    invoice_files = [f for f in os.listdir(input_folder) if f.endswith(".txt")]
+
+def predict_invoice(invoice_number, invoice_text, invoice_pdf, candidate_context):
+    """Concurrent Gemini requests for one invoice, stopping once the majority is decided. Returns the result row."""
+    started = time.perf_counter()
+    adaptive_answer = None
+    if SAMPLING == "policy":
+        responses, majority, tier, verify = run_policy(invoice_text, invoice_pdf, candidate_context)
+        seconds = round(time.perf_counter() - started, 3)
+        return {**majority_row(invoice_number, responses, seconds, majority=majority), "tier": tier, "verify": verify}
+    elif SAMPLING == "logprobs":
+        first = extract_supplier_candidates(invoice_text, invoice_pdf, candidate_context, 1, temperature=0, logprobs=True)[0]
+        confidence = calibration.calibrate(first.get("confidence"))
+        row = majority_row(invoice_number, [first], round(time.perf_counter() - started, 3), majority=1,
+                           confidence=first.get("confidence"))
+        if confidence is not None and confidence >= LOGPROB_THRESHOLD:
+            return {**row, "confidence": round(confidence, 4)}
+
+        # Uncertain: the ensemble decides, with the logprob answer as one of the votes, so majority_count and
+        # samples_used both count every call
+        responses = [first] + run_ensemble(invoice_text, invoice_pdf, candidate_context)
+        row = majority_row(invoice_number, responses, round(time.perf_counter() - started, 3), sampling="escalated")
+        return {**row, "confidence": round(confidence, 4) if confidence is not None else ""}
+    elif SAMPLING == "adaptive":
+        responses, adaptive_answer = sampler.run(
+            lambda: extract_supplier_from_gemini(invoice_text, invoice_pdf, candidate_context)
+        )
+    elif SAMPLING == "candidates":
+        responses = extract_supplier_candidates(invoice_text, invoice_pdf, candidate_context, SAMPLES)
+    else:
+        responses = run_ensemble(invoice_text, invoice_pdf, candidate_context)
+    seconds = round(time.perf_counter() - started, 3)
+
+    return majority_row(invoice_number, responses, seconds, adaptive_answer)
+
+
+def escalated_row(windowed_row, full_row, invoice_text):
+    """The full-text result of an escalated invoice, with the calls, time and tokens of both attempts."""
+    return {**full_row,
+            "samples_used": windowed_row["samples_used"] + full_row["samples_used"],
+            "seconds": round(windowed_row["seconds"] + full_row["seconds"], 3),
+            "text_tokens": windowed_row["text_tokens"] + count_tokens(invoice_text),
+            "escalated": True}
+
+
+# Process all invoices
+for invoice_file in invoice_files:
+    invoice_number = os.path.splitext(invoice_file)[0]
+
+    if INPUT_MODE == "pdf":
+        invoice_text = ""
+        invoice_pdf = extract_first_15_pages(os.path.join(pdf_input_folder, invoice_file))
+        input_hash = hash_value(invoice_pdf)
+    else:
+        with open(os.path.join(input_folder, invoice_file), "r", encoding="utf-8") as file:
+            invoice_text = file.read()
+        invoice_pdf = None
+        input_hash = hash_value(invoice_text)
+
+    dependencies = {"input": input_hash, "input_mode": INPUT_MODE, **stage_dependencies}
+
+    # Reuse the previous result if nothing this invoice depends on has changed
+    previous = manifest.get(invoice_number)
+    if previous and previous["dependencies"] == dependencies:
+        result_df = pd.concat([result_df, pd.DataFrame([previous["result"]])], ignore_index=True)
+        new_manifest[invoice_number] = previous
+        reused += 1
+        continue
+
+    # Unambiguous invoices are resolved from the supplier list, the rest go to the ensemble
+    if USE_PRE_MATCHER and invoice_text:
+        match, matched_by = matcher.match(invoice_text)
+        if match:
+            row = {"invoice_number": invoice_number, **match, "majority_count": "", "matched_by": matched_by}
+            new_manifest[invoice_number] = {"dependencies": dependencies, "result": row}
+            result_df = pd.concat([result_df, pd.DataFrame([row])], ignore_index=True)
+            continue
+
+    # Only the suppliers most similar to the invoice text go into the prompt. PDF input has no text to retrieve with
+    candidates = retriever.top_k(invoice_text, TOP_K_SUPPLIERS) if TOP_K_SUPPLIERS and invoice_text else None
+    candidate_context = format_supplier_context(candidates) if candidates is not None else None
+
+    # Batched mode: queue the invoice and send it together with others after the loop
+    if BATCH_SIZE > 1 and invoice_pdf is None:
+        batch_queue[invoice_number] = (window_text(invoice_text), candidates, dependencies)
+        continue
+
+    # Supplier prediction on the header and footer windows, escalating to the full text when it finds nothing
+    prompt_text = window_text(invoice_text)
+    row = predict_invoice(invoice_number, prompt_text, invoice_pdf, candidate_context)
+    row["text_tokens"] = count_tokens(prompt_text) if invoice_text else 0
+    row["escalated"] = False
+
+    if row["supplier_number"] == "" and prompt_text != invoice_text:
+        row = escalated_row(row, predict_invoice(invoice_number, invoice_text, invoice_pdf, candidate_context),
+                            invoice_text)
+
+    row["full_text_tokens"] = count_tokens(invoice_text) if invoice_text else 0
+    # Invoices with failed requests stay out of the manifest so the next run retries them
+    if not row.get("failed_samples"):
+        new_manifest[invoice_number] = {"dependencies": dependencies, "result": row}
+
+    result_df = pd.concat([result_df, pd.DataFrame([row])], ignore_index=True)
+
+# Batched mode: SAMPLES samples per invoice, BATCH_SIZE invoices per request
+if batch_queue:
+    started = time.perf_counter()
+    batched_responses, requeued = predict_suppliers_batched({n: q[:2] for n, q in batch_queue.items()})
+    seconds = round((time.perf_counter() - started) / len(batch_queue), 3)
+
+    for invoice_number, responses in batched_responses.items():
+        row = majority_row(invoice_number, responses, seconds, sampling="batched")
+        prompt_text = batch_queue[invoice_number][0]
+        row["text_tokens"] = count_tokens(prompt_text)
+        row["escalated"] = False
+
+        # Escalate windowed invoices without a supplier to the full text, one invoice per request
+        with open(os.path.join(input_folder, f"{invoice_number}.txt"), "r", encoding="utf-8") as file:
+            invoice_text = file.read()
+        if row["supplier_number"] == "" and prompt_text != invoice_text:
+            candidates = batch_queue[invoice_number][1]
+            candidate_context = format_supplier_context(candidates) if candidates is not None else None
+            row = escalated_row(row, predict_invoice(invoice_number, invoice_text, None, candidate_context), invoice_text)
+
+        row["full_text_tokens"] = count_tokens(invoice_text)
+        if not row.get("failed_samples"):
+            new_manifest[invoice_number] = {"dependencies": batch_queue[invoice_number][2], "result": row}
+        result_df = pd.concat([result_df, pd.DataFrame([row])], ignore_index=True)
 
-        result_df = pd.concat([result_df, new_row], ignore_index=True)
+    print(f"Sent {len(batch_queue)} invoices in batches of {BATCH_SIZE}, {requeued} invoice samples re-queued")
 
 result_df.to_csv(output_csv_path, index=False)
+save_manifest(manifest_path, new_manifest)
+
+print(f"Reused {reused} of {len(result_df)} invoices from the previous run")
+
+if len(result_df):
+    bypassed = (result_df["matched_by"] != "gemini").sum()
+    print(f"Pre-matcher resolved {bypassed} of {len(result_df)} invoices without Gemini ({bypassed / len(result_df):.0%} bypass rate)")
+    print(result_df["matched_by"].value_counts().to_string())
+
+ensembled = result_df[result_df["matched_by"] == "gemini"]
+if len(ensembled):
+    print(f"Ensemble used {ensembled['samples_used'].astype(float).mean():.2f} samples per invoice "
+          f"(at most {SAMPLES} per attempt, escalated invoices make two attempts), "
+          f"{ensembled['seconds'].astype(float).mean():.2f} s per invoice on average")
+
+if len(ensembled) and TEXT_WINDOW != "full":
+    escalated = ensembled["escalated"].astype(bool)
+    sent, full = ensembled["text_tokens"].astype(float).sum(), ensembled["full_text_tokens"].astype(float).sum()
+    escalation = ensembled.loc[escalated, "full_text_tokens"].astype(float).sum()
+    print(f"Text windows ({TEXT_WINDOW}): {escalated.sum()} of {len(ensembled)} invoices escalated to the full text. "
+          f"Invoice text tokens per sample: {sent - escalation:.0f} in trimmed attempts, {escalation:.0f} in escalations, "
+          f"{sent:.0f} in total against {full:.0f} for the full text ({full - sent:+.0f} net saving)")
+
+if len(ensembled) and SAMPLING == "policy":
+    by_tier = ensembled.groupby("tier").agg(invoices=("invoice_number", "count"),
+                                           calls_per_invoice=("samples_used", lambda s: s.astype(float).mean()))
+    print(f"Calls per invoice by supplier tier ({ensembled['samples_used'].astype(float).mean():.2f} overall):")
+    print(by_tier.round(2).to_string())
+
+if len(ensembled) and SAMPLING == "logprobs":
+    single = (ensembled["samples_used"].astype(float) == 1).sum()
+    print(f"Logprob confidence: {single} of {len(ensembled)} invoices settled with one call at or above "
+          f"{LOGPROB_THRESHOLD}, {ensembled['samples_used'].astype(float).mean():.2f} calls per invoice")
+
+print(supplier_model.summary())
+for model in (coalesced_supplier_model, candidate_model):
+    if model.calls:
+        print(model.summary())
+supplier_model.close()
 
 print(f"Results saved to {output_csv_path}")
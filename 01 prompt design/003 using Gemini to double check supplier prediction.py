@@ -1,7 +1,11 @@
 import os
 import pandas as pd
 import json
+import inspect
 import google.generativeai as genai
+from supplier_matcher import normalize_words
+from supplier_policy import SupplierPolicyStore
+from run_manifest import hash_value, load_manifest, save_manifest
 
 # Set up Google Cloud credentials
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
@@ -17,16 +21,20 @@ supplier_context = "\n".join([f"{row['Supplier name']}, {row['Supplier number']}
 
 run_name = "Your run name here"
 
-
+USE_CONFIDENCE_GATE = True  # Only send predictions below GATE_THRESHOLD to Gemini, accept the rest as "correct"
+GATE_THRESHOLD = 0.9  # Confidence needed to skip the double-check
+GATE_WEIGHTS = {"votes": 0.5, "window": 0.3, "history": 0.2}  # Vote share, supplier in the header/footer, past accuracy
+POLICY_STORE_PATH = "runs/supplier_policy.json"  # Supplier history learned by the 002 policy mode
 
 input_folder = "runs/" + run_name + "/001 Output from OCR"
 results_csv_path = "runs/" + run_name + "/002 Supplier prediction/result.csv"
 output_csv_path = "runs/" + run_name + "/003 Supplier sense-check/double_checked_results.csv"
+manifest_path = "runs/" + run_name + "/003 Supplier sense-check/manifest.json"
 
 # Load previous results
-results_df = pd.read_csv(results_csv_path)
+results_df = pd.read_csv(results_csv_path, dtype={"supplier_number": str, "organization_number": str}).fillna("")
 
-corrected_df = pd.DataFrame(columns=["invoice_number", "supplier_name", "supplier_number", "organization_number", "status"])
+corrected_df = pd.DataFrame(columns=["invoice_number", "supplier_name", "supplier_number", "organization_number", "status", "gated"])
 
 def double_check_with_gemini(invoice_text, previous_supplier_data):
 
@@ -91,6 +99,52 @@ You are tasked with double-checking supplier data extracted from an invoice.
         print(f"Error double-checking supplier data: {e}")
         return None
 
+policy_store = SupplierPolicyStore(POLICY_STORE_PATH)
+
+
+def supplier_in_windows(invoice_text, previous_supplier_data):
+    """True if the org number or the whole supplier name is printed in the first or last 10 lines."""
+    lines = invoice_text.strip().split('\n')
+    windows = '\n'.join(lines[:10] + lines[-10:])
+
+    org_number = str(previous_supplier_data["organization_number"]).replace(" ", "")
+    if org_number and org_number in windows.replace(" ", "").replace(".", ""):
+        return True
+
+    name_words = normalize_words(str(previous_supplier_data["supplier_name"]))
+    window_words = " ".join(normalize_words(windows))
+    return bool(name_words) and f" {' '.join(name_words)} " in f" {window_words} "
+
+
+def confidence_score(row, invoice_text, previous_supplier_data):
+    """Weighted confidence in the 002 prediction from GATE_WEIGHTS. Empty predictions score 0."""
+    if not str(previous_supplier_data["supplier_number"]):
+        return 0.0
+
+    # Pre-matched rows have no votes; the matcher only answers when exactly one supplier is found
+    if str(row.get("majority_count", "")) in ("", "nan"):
+        vote_share = 1.0
+    elif str(row.get("confidence", "")) not in ("", "nan") and float(row.get("samples_used") or 0) == 1:
+        # A logprob answer settled with one call has no votes; its calibrated confidence stands in for the share
+        vote_share = float(row["confidence"])
+    else:
+        vote_share = min(float(row["majority_count"]) / float(row.get("samples_used", 5) or 5), 1.0)
+
+    history = policy_store.suppliers.get(str(previous_supplier_data["supplier_number"]), {})
+    accuracy = history.get("accuracy")
+
+    return (GATE_WEIGHTS["votes"] * vote_share
+            + GATE_WEIGHTS["window"] * supplier_in_windows(invoice_text, previous_supplier_data)
+            + GATE_WEIGHTS["history"] * (accuracy if accuracy is not None else 0.5))
+
+
+prompt_version = hash_value(inspect.getsource(double_check_with_gemini))
+gate_version = [USE_CONFIDENCE_GATE, GATE_THRESHOLD, GATE_WEIGHTS, hash_value(policy_store.suppliers),
+                hash_value(inspect.getsource(confidence_score) + inspect.getsource(supplier_in_windows))]
+manifest = load_manifest(manifest_path)
+new_manifest = {}
+reused = 0
+
 for _, row in results_df.iterrows():
     invoice_number = row['invoice_number']
     file_path = os.path.join(input_folder, f"{invoice_number}.txt")
@@ -106,18 +160,52 @@ for _, row in results_df.iterrows():
             "organization_number": row["organization_number"]
         }
 
+        dependencies = {
+            "input": hash_value(invoice_text),
+            "supplier_prediction": hash_value(previous_supplier_data),
+            "prompt_version": prompt_version,
+            "confidence_gate": gate_version,
+            "verify": str(row.get("verify", True))
+        }
+
+        # Reuse the previous status if neither the invoice nor its supplier prediction changed
+        previous = manifest.get(str(invoice_number))
+        if previous and previous["dependencies"] == dependencies:
+            corrected_df = pd.concat([corrected_df, pd.DataFrame([previous["result"]])], ignore_index=True)
+            new_manifest[str(invoice_number)] = previous
+            reused += 1
+            continue
+
+        # Confident predictions, and suppliers the 002 policy store trusts (verify = False), skip the second opinion
+        confidence = confidence_score(row, invoice_text, previous_supplier_data) if USE_CONFIDENCE_GATE else 0.0
+        if confidence >= GATE_THRESHOLD or str(row.get("verify", True)) == "False":
+            new_row = {"invoice_number": invoice_number, "status": "correct", "gated": True}
+            new_manifest[str(invoice_number)] = {"dependencies": dependencies, "result": new_row}
+            corrected_df = pd.concat([corrected_df, pd.DataFrame([new_row])], ignore_index=True)
+            continue
+
         # Double-check with Gemini
         corrected_data = double_check_with_gemini(invoice_text, previous_supplier_data)
 
         if corrected_data:
             # Save corrected data
-            new_row = pd.DataFrame([{
+            new_row = {
                 "invoice_number": invoice_number,
-                "status": corrected_data.get("status", "uncertain")
-            }])
+                "status": corrected_data.get("status", "uncertain"),
+                "gated": False
+            }
+            new_manifest[str(invoice_number)] = {"dependencies": dependencies, "result": new_row}
 
-            corrected_df = pd.concat([corrected_df, new_row], ignore_index=True)
+            corrected_df = pd.concat([corrected_df, pd.DataFrame([new_row])], ignore_index=True)
 
 corrected_df.to_csv(output_csv_path, index=False)
+save_manifest(manifest_path, new_manifest)
+
+print(f"Reused {reused} of {len(new_manifest)} invoices from the previous run")
+
+if len(corrected_df):
+    gated = corrected_df["gated"].astype(bool).sum()
+    print(f"Confidence gate accepted {gated} of {len(corrected_df)} predictions, "
+          f"{gated} double-check calls saved ({gated / len(corrected_df):.0%})")
 
 print(f"Double-checked results saved to {output_csv_path}")
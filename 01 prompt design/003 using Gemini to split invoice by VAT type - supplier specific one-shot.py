@@ -1,7 +1,11 @@
 import os
 import pandas as pd
 import json
+import inspect
+import fitz
 import google.generativeai as genai
+from context_cache import PrefixCachedModel
+from run_manifest import hash_value, load_manifest, save_manifest
 
 # Set up Google Cloud credentials
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
@@ -9,6 +13,10 @@ os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSO
 # Configure Gemini API
 genai.configure()
 
+INPUT_MODE = "ocr_text"  # "ocr_text" = prompt with the text in 001 Output from OCR, "pdf" = send the first 15 PDF pages inline and skip OCR
+USE_LOCAL_MODEL = False  # True = answer with the LocalGenerativeModel stand-in instead of Gemini
+USE_CONTEXT_CACHE = True  # Register the VAT codes once per run as cached content instead of sending them with every invoice, if they reach the cache minimum
+
 run_name = "Your run name here"
 
 result_df = pd.read_csv('runs/' + run_name + '/002 Supplier prediction/result.csv', encoding='ISO-8859-1')
@@ -85,14 +93,43 @@ def load_voucher_text(voucher_id):
 
 
 
-def extract_invoice_details(invoice_text, supplier_data, has_old_voucher, old_voucher, old_voucher_return):
+def extract_first_15_pages(input_path):
+    """Extracts the first 15 pages of a PDF using PyMuPDF and returns them as PDF bytes."""
+    doc = fitz.open(input_path)
+    new_doc = fitz.open()
+
+    new_doc.insert_pdf(doc, from_page=0, to_page=min(15, len(doc)) - 1)
+
+    pdf_bytes = new_doc.tobytes(no_new_id=True)
+    new_doc.close()
+    doc.close()
+
+    return pdf_bytes
+
+
+def vat_prompt_prefix():
+    """Static start of the VAT prompt. Identical for every invoice, so it can be cached."""
+    return f"""
+            ### **VAT Codes:**  
+            {json.dumps(vat_codes_df.to_dict(orient='records'), indent=2)}
+        """
+
+
+vat_model = PrefixCachedModel("gemini-2.0-flash-001", vat_prompt_prefix(), use_cache=USE_CONTEXT_CACHE,
+                              use_local_model=USE_LOCAL_MODEL)
+
+
+def extract_invoice_details(invoice_text, supplier_data, has_old_voucher, old_voucher, old_voucher_return, invoice_pdf=None):
+
+    if invoice_pdf is not None:
+        invoice_text = "The invoice is attached as a PDF."
 
     if has_old_voucher:
         prompt = f"""
             Please find the sum payable and group the attached invoice by VAT type.
             - The payable amount should be a gross amount, i.e. should include VAT
             - The sum per VAT type should be net, i.e. should not include VAT
-            - Only use the attached VAT codes.
+            - Only use the VAT codes above.
             - If there is supplier context, please adhere to it
             - Negative amounts are for credit notes. Positive amounts are for costs.
             - If the invoice mentions "credit note", multiply the amounts by -1. (100 becomes -100).
@@ -101,9 +138,6 @@ def extract_invoice_details(invoice_text, supplier_data, has_old_voucher, old_vo
             ### **Supplier:**  
             {json.dumps(supplier_data, indent=2)}
 
-            ### **VAT Codes:**  
-            {json.dumps(vat_codes_df.to_dict(orient='records'), indent=2)}
-
             ### **Invoice Text:**  
             {invoice_text}
 
@@ -140,16 +174,13 @@ def extract_invoice_details(invoice_text, supplier_data, has_old_voucher, old_vo
             Please find the sum payable and group the attached invoice by VAT type.
             - The payable amount should be a gross amount, i.e. should include VAT
             - The sum per VAT type should be net, i.e. should not include VAT
-            - Only use the attached VAT codes.
+            - Only use the VAT codes above.
             - If there is supplier context, please adhere to it
             - Negative amounts are for credit notes. Positive amounts are for costs.
 
             ### **Supplier:**  
             {json.dumps(supplier_data, indent=2)}
 
-            ### **VAT Codes:**  
-            {json.dumps(vat_codes_df.to_dict(orient='records'), indent=2)}
-
             ### **Invoice Text:**  
             {invoice_text}
 
@@ -174,9 +205,11 @@ def extract_invoice_details(invoice_text, supplier_data, has_old_voucher, old_vo
         """
 
 
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    response = model.generate_content(
-        prompt,
+    # In pdf mode the pages go in as an inline document part after the prompt
+    contents = prompt if invoice_pdf is None else [prompt, {"mime_type": "application/pdf", "data": invoice_pdf}]
+
+    response = vat_model.generate_content(
+        contents,
         generation_config={"temperature": 1}
     )
 
@@ -208,9 +241,22 @@ def extract_invoice_details(invoice_text, supplier_data, has_old_voucher, old_vo
 
 
 input_folder = f"runs/{run_name}/001 Output from OCR"
+pdf_input_folder = f"runs/{run_name}/000 Initial input"
 output_csv_path = f"runs/{run_name}/004 Booking of the voucher/vat_lines.csv"
+manifest_path = f"runs/{run_name}/004 Booking of the voucher/vat_lines_manifest.json"
 result_output = []
 
+# Dependencies shared by every invoice
+stage_dependencies = {
+    "vat_codes": hash_value(vat_codes_df.to_csv(index=False)),
+    "prompt_version": hash_value(inspect.getsource(vat_prompt_prefix) + inspect.getsource(extract_invoice_details))
+}
+
+manifest = load_manifest(manifest_path)
+new_manifest = {}
+reused = 0
+invoices = 0
+
 for _, row in merged_df.iterrows():
     voucher_id = row['invoice_number']
     supplier_id = row['id']
@@ -225,24 +271,60 @@ for _, row in merged_df.iterrows():
         old_voucher_id, old_voucher_data = voucher_result
         old_voucher = load_voucher_text(old_voucher_id)
 
-    # Read invoice text
-    file_path = os.path.join(input_folder, f"{voucher_id}.txt")
+    # Read invoice text, or the PDF itself in pdf mode
+    if INPUT_MODE == "pdf":
+        file_path = os.path.join(pdf_input_folder, f"{voucher_id}.pdf")
+    else:
+        file_path = os.path.join(input_folder, f"{voucher_id}.txt")
+
     if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as file:
-            invoice_text = file.read()
+        invoices += 1
+        if INPUT_MODE == "pdf":
+            invoice_text = ""
+            invoice_pdf = extract_first_15_pages(file_path)
+        else:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                invoice_text = file.read()
+            invoice_pdf = None
+
+        # Only this supplier's row and postings feed the prompt, so other supplier edits don't invalidate it
+        dependencies = {
+            "input": hash_value(invoice_pdf if INPUT_MODE == "pdf" else invoice_text),
+            "input_mode": INPUT_MODE,
+            "supplier": hash_value(supplier_data),
+            "postings": hash_value(filtered_postings[filtered_postings['supplier'] == supplier_id].to_csv(index=False)),
+            "old_voucher": hash_value(old_voucher) if voucher_result else "",
+            **stage_dependencies
+        }
+
+        previous = manifest.get(str(voucher_id))
+        if previous and previous["dependencies"] == dependencies:
+            result_output.extend(previous["result"])
+            new_manifest[str(voucher_id)] = previous
+            reused += 1
+            continue
 
         if not voucher_result:
-            invoice_details = extract_invoice_details(invoice_text, supplier_data, False, "", "")
+            invoice_details = extract_invoice_details(invoice_text, supplier_data, False, "", "", invoice_pdf)
         else:
-            invoice_details = extract_invoice_details(invoice_text, supplier_data, True, old_voucher, old_voucher_data)
+            invoice_details = extract_invoice_details(invoice_text, supplier_data, True, old_voucher, old_voucher_data, invoice_pdf)
 
         for item in invoice_details:
             item['voucher'] = voucher_id
             item['old_voucher'] = old_voucher_id
             result_output.append(item)
+
+        # Failed or empty splits stay out of the manifest so the next run retries them
+        if invoice_details:
+            new_manifest[str(voucher_id)] = {"dependencies": dependencies, "result": invoice_details}
     else:
         print(f"⚠️ Invoice text file not found for voucher {voucher_id}")
 
+save_manifest(manifest_path, new_manifest)
+print(f"Reused {reused} of {invoices} invoices from the previous run")
+print(vat_model.summary())
+vat_model.close()
+
 # Flatten vat_lines and save to CSV
 flattened_result = []
 
@@ -2,11 +2,14 @@ import os
 import json
 import ast
 import re
+import inspect
 from collections import defaultdict
 from typing import List, Dict
 
 import pandas as pd
 import google.generativeai as genai
+from context_cache import PrefixCachedModel
+from run_manifest import hash_value, load_manifest, save_manifest
 
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
 
@@ -14,7 +17,10 @@ genai.configure()
 
 RUN_NAME = "Your run name here"
 NUM_ATTEMPTS = 3
+ATTEMPT_MODE = "calls"  # "calls" = NUM_ATTEMPTS requests per voucher, "candidates" = one request for NUM_ATTEMPTS candidates
+USE_CONTEXT_CACHE = True  # Register the chart of accounts and departments once per run as cached content, if they reach the cache minimum
 OUTPUT_CSV_PATH = f"runs/{RUN_NAME}/004 Booking of the voucher/account_department_lines.csv"
+MANIFEST_PATH = f"runs/{RUN_NAME}/004 Booking of the voucher/account_department_manifest.json"
 
 
 vat_line_predictions = pd.read_csv(
@@ -114,6 +120,20 @@ def load_voucher_text(voucher_id):
     return open(path, encoding="utf-8").read() if os.path.exists(path) else None
 
 
+def account_prompt_prefix():
+    """Static start of the account/department prompt. Identical for every call, so it can be cached."""
+    return f"""
+### Chart of accounts
+{accounts_df}
+
+### Departments
+{departments_df}
+"""
+
+
+account_model = PrefixCachedModel("gemini-2.0-flash-001", account_prompt_prefix(), use_cache=USE_CONTEXT_CACHE)
+
+
 def extract_invoice_details(
     predicted_vat_lines, 
     invoice_text: str,
@@ -122,12 +142,13 @@ def extract_invoice_details(
     example_voucher_answer,
     example_voucher_invoice,
     has_old_voucher: bool,
-):
-    """Ask Gemini to fill in account / department for the VAT lines."""
+    candidate_count: int = 1,
+) -> List[List[Dict]]:
+    """Ask Gemini to fill in account / department for the VAT lines. Returns one run per candidate."""
 
     common_part = f"""
 You are a Norwegian accountant following Norwegian accounting standards.
-- I have an invoice and the VAT lines for that invoice. For each VAT line, pick the correct **account code** and **department**.
+- I have an invoice and the VAT lines for that invoice. For each VAT line, pick the correct **account code** and **department** from the tables above.
 - Keep the VAT lines. They are correct.
 - If there is supplier context, adhere to it.
 - Always use double quotes – never single quotes.
@@ -135,12 +156,6 @@ You are a Norwegian accountant following Norwegian accounting standards.
 ### Supplier
 {json.dumps(supplier_data, indent=2)}
 
-### Chart of accounts
-{accounts_df}
-
-### Departments
-{departments_df}
-
 ### Invoice text
 {invoice_text}
 
@@ -168,13 +183,20 @@ Below is an **old invoice** from the same supplier. Use it as an example.
     else:
         prompt = common_part
 
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    response = model.generate_content(prompt, generation_config={"temperature": 1})
+    generation_config = {"temperature": 1}
+    if candidate_count > 1:
+        generation_config["candidate_count"] = candidate_count
+
+    response = account_model.generate_content(prompt, generation_config=generation_config)
+
+    # A missing candidate counts as a failed run, like an unparsable one
+    runs = [parse_run(c) for c in response.candidates[:candidate_count]]
+    return runs + [[]] * (candidate_count - len(runs))
 
-    if not response.candidates:
-        return []
 
-    txt = response.candidates[0].content.parts[0].text.strip()
+def parse_run(candidate) -> List[Dict]:
+    """Parse one response candidate into VAT line dicts, [] if it isn't valid JSON."""
+    txt = candidate.content.parts[0].text.strip()
     code_block = re.search(r"```(?:json)?\s*(.*?)\s*```", txt, re.S)
     if code_block:
         txt = code_block.group(1).strip()
@@ -237,6 +259,26 @@ def consensus_runs(runs: List[List[Dict]], voucher_id: int) -> List[Dict]:
 INPUT_OCR_FOLDER = f"runs/{RUN_NAME}/001 Output from OCR"
 result_output = []
 
+# dependencies shared by every voucher
+STAGE_DEPENDENCIES = {
+    "accounts": hash_value(accounts_df.to_csv(index=False)),
+    "departments": hash_value(departments_df.to_csv(index=False)),
+    "vat_codes": hash_value(vat_codes_df.to_csv(index=False)),
+    "prompt_version": hash_value(
+        inspect.getsource(account_prompt_prefix)
+        + inspect.getsource(extract_invoice_details)
+        + inspect.getsource(parse_run)
+        + inspect.getsource(consensus_runs)
+    ),
+    "attempts": NUM_ATTEMPTS,
+    "attempt_mode": ATTEMPT_MODE,
+}
+
+manifest = load_manifest(MANIFEST_PATH)
+new_manifest = {}
+reused = 0
+vouchers = 0
+
 for voucher_id in vat_line_predictions["voucher"].unique():
     voucher_rows = vat_line_predictions[vat_line_predictions["voucher"] == voucher_id]
     supplier_id = voucher_rows["supplier_id"].iat[0]
@@ -251,6 +293,7 @@ for voucher_id in vat_line_predictions["voucher"].unique():
         continue
 
     invoice_text = open(ocr_path, encoding="utf-8").read()
+    vouchers += 1
 
     # Few‑shot examples (if any)
     first_q = first_a = first_txt = "N/A"
@@ -267,10 +310,30 @@ for voucher_id in vat_line_predictions["voucher"].unique():
     # Skeleton VAT lines for the current voucher
     skeleton_lines = construct_vat_lines(voucher_id, vat_line_predictions)
 
-    # Run the LLM several times
+    # Reuse the previous consensus if nothing this voucher depends on has changed
+    dependencies = {
+        "input": hash_value(invoice_text),
+        "vat_lines": hash_value(skeleton_lines),
+        "supplier": hash_value(supplier_data),
+        "postings": hash_value(
+            filtered_postings[filtered_postings["supplier"] == supplier_id].to_csv(index=False)
+        ),
+        "example_invoice": hash_value(first_txt),
+        **STAGE_DEPENDENCIES,
+    }
+
+    previous = manifest.get(str(voucher_id))
+    if previous and previous["dependencies"] == dependencies:
+        result_output.extend(previous["result"])
+        new_manifest[str(voucher_id)] = previous
+        reused += 1
+        continue
+
+    # Run the LLM several times, as separate requests or as candidates of one request
     all_runs = []
-    for _ in range(NUM_ATTEMPTS):
-        all_runs.append(
+    calls, candidates = (1, NUM_ATTEMPTS) if ATTEMPT_MODE == "candidates" else (NUM_ATTEMPTS, 1)
+    for _ in range(calls):
+        all_runs.extend(
             extract_invoice_details(
                 skeleton_lines,
                 invoice_text,
@@ -279,12 +342,21 @@ for voucher_id in vat_line_predictions["voucher"].unique():
                 first_a,
                 first_txt,
                 has_example,
+                candidates,
             )
         )
 
     # Consensus
     consensus = consensus_runs(all_runs, voucher_id)
     result_output.extend(consensus)
+    # Failed consensus runs stay out of the manifest so the next run retries them
+    if consensus:
+        new_manifest[str(voucher_id)] = {"dependencies": dependencies, "result": consensus}
+
+save_manifest(MANIFEST_PATH, new_manifest)
+print(f"Reused {reused} of {vouchers} vouchers from the previous run")
+print(account_model.summary())
+account_model.close()
 
 
 flattened = []
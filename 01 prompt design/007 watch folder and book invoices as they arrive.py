@@ -0,0 +1,803 @@
+import os
+import csv
+import shutil
+import json
+import ast
+import re
+import time
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+
+import pandas as pd
+import fitz
+import google.generativeai as genai
+from google.cloud import documentai_v1 as documentai
+from supplier_matcher import SupplierMatcher
+from duplicate_index import DuplicateIndex, content_key, extract_fingerprints, fingerprint_keys
+
+# Watches an input folder and pushes every PDF that lands there through OCR, supplier prediction,
+# VAT splitting and account/department prediction, appending the booked lines as soon as they are ready.
+
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "Your Google credentials as a JSON file here"
+
+# Google Cloud settings
+PROJECT_ID = "Your Google Cloud project ID here"
+LOCATION = "eu"
+PROCESSOR_ID = "Your Document AI processor ID here"
+
+run_name = "Your run name here"
+
+# Daemon settings
+POLL_SECONDS = 2  # How often the input folder is listed
+SETTLE_SECONDS = 1  # A PDF must keep the same size this long before it is picked up, so half-copied files are skipped
+INVOICE_WORKERS = 4  # Invoices processed at the same time
+MAX_ATTEMPTS = 3  # Invoices that are not booked are retried this many times, then moved to the failed folder
+RETRY_SECONDS = 30  # Wait before the first retry, doubled for every further attempt
+SUPPLIER_SAMPLES = 5
+SUPPLIER_MAJORITY = 3
+OWN_ORGANIZATION_NUMBERS = []  # Our company's org numbers, ignored by the supplier pre-matcher and the duplicate fingerprints
+ACC_DEP_ATTEMPTS = 3
+DUPLICATE_INDEX_PATH = "runs/duplicate_index.sqlite"  # Shared with 001, so invoices seen in batch runs are caught too
+
+genai.configure()
+
+document_ai_client = documentai.DocumentProcessorServiceClient(
+    client_options={"api_endpoint": f"{LOCATION}-documentai.googleapis.com"}
+)
+
+duplicate_index = DuplicateIndex(DUPLICATE_INDEX_PATH)
+
+# Load the context tables once for the lifetime of the daemon
+supplier_df = pd.read_csv('context/suppliers.csv', encoding='ISO-8859-1')
+suppliers_with_id = pd.read_csv('context/suppliers_with_id.csv', encoding='ISO-8859-1')
+accounts_df = pd.read_csv('context/accounts.csv', encoding='ISO-8859-1')
+departments_df = pd.read_csv('context/departments.csv', encoding='ISO-8859-1')
+vat_codes_df = pd.read_csv('context/vat_codes.csv', encoding='ISO-8859-1')
+filtered_postings = pd.read_csv('context/supplier_postings_2022-01-01_-_2022-08-31/filtered_supplier_postings.csv')
+
+supplier_matcher = SupplierMatcher(supplier_df, OWN_ORGANIZATION_NUMBERS)
+
+supplier_context = "\n".join([f"{row['Supplier name']}, {row['Supplier number']}, {row['Organization number']}"
+                              for _, row in supplier_df.iterrows()])
+
+input_folder = "runs/" + run_name + "/000 Initial input"
+output_text_folder = "runs/" + run_name + "/001 Output from OCR"
+failed_folder = "runs/" + run_name + "/000 Initial input/failed"
+review_folder = "runs/" + run_name + "/000 Initial input/review"  # Invoices with no supplier in the list
+output_folder = "runs/" + run_name + "/007 Streaming bookings"
+booked_lines_csv_path = os.path.join(output_folder, "booked_lines.csv")
+latency_csv_path = os.path.join(output_folder, "latency.csv")
+
+
+def extract_first_15_pages(input_path):
+    """Extracts the first 15 pages of a PDF using PyMuPDF and returns them as PDF bytes."""
+    doc = fitz.open(input_path)
+    new_doc = fitz.open()
+
+    new_doc.insert_pdf(doc, from_page=0, to_page=min(15, len(doc)) - 1)
+
+    pdf_bytes = new_doc.tobytes(no_new_id=True)
+    new_doc.close()
+    doc.close()
+
+    return pdf_bytes
+
+
+def process_invoice_ocr(pdf_path):
+    """Processes a PDF invoice and extracts text using Google Document AI OCR."""
+    try:
+        pdf_bytes = extract_first_15_pages(pdf_path)
+
+        request = documentai.ProcessRequest(
+            name=f"projects/{PROJECT_ID}/locations/{LOCATION}/processors/{PROCESSOR_ID}",
+            raw_document=documentai.RawDocument(content=pdf_bytes, mime_type="application/pdf")
+        )
+
+        result = document_ai_client.process_document(request=request)
+
+        return result.document.text
+
+    except Exception as e:
+        print(f"Error processing file '{pdf_path}': {e}")
+        return None
+
+
+def extract_supplier_from_gemini(invoice_text):
+    prompt = f"""
+Choose the correct supplier number from the supplier list based on invoice text.
+    - Ignore [Redacted] and [Redacted]. That's our company.
+    - If there are several suppliers mentioned, return empty values.
+    - If you can't find a perfect match for either the supplier name or the organization number, return empty values.
+    - If you can't find the supplier in the supplier list, return empty values.
+    - If there are several potential matches from the supplier list, return empty values.
+
+    Empty values = the JSON below with no added content.
+
+    Supplier List:
+    {supplier_context}
+
+    Invoice Text:
+    {invoice_text}
+
+    Return the result in JSON format:
+    {{
+      "supplier_name": "",
+      "supplier_number": "",
+      "organization_number": ""
+    }}
+    """
+
+    empty_result = {
+        "supplier_name": "",
+        "supplier_number": "",
+        "organization_number": ""
+    }
+
+    try:
+        model = genai.GenerativeModel("gemini-2.0-flash")
+        response = model.generate_content(
+            prompt,
+            generation_config={
+                "temperature": 1
+            }
+        )
+
+        json_text = response.candidates[0].content.parts[0].text
+
+        # Remove markdown formatting if present
+        if json_text.startswith("```json"):
+            json_text = json_text[7:]
+        if json_text.endswith("```"):
+            json_text = json_text[:-3]
+
+        parsed = json.loads(json_text.strip())
+
+        # Ensure it's a valid supplier JSON
+        if not isinstance(parsed, dict):
+            return empty_result
+
+        if not all(k in parsed for k in ["supplier_name", "supplier_number", "organization_number"]):
+            return empty_result
+
+        return parsed
+
+    except Exception as e:
+        print(f"Invalid or non-JSON response. Replacing with empty result. Error: {e}")
+        return empty_result
+
+
+def get_first_voucher(supplier_id, df_of_vouchers, vat_codes_df):
+    # Filter for the supplier
+    df_filtered = df_of_vouchers[df_of_vouchers['supplier'] == supplier_id]
+
+    if df_filtered.empty:
+        return False
+
+    # Get the first voucher (by date)
+    first_voucher_row = df_filtered.sort_values(by='date').iloc[0]
+    voucher_id = first_voucher_row['voucher']
+    voucher_rows = df_filtered[df_filtered['voucher'] == voucher_id]
+
+    # Prepare VAT code mapping (convert % strings to float)
+    vat_codes_df = vat_codes_df.copy()
+    vat_codes_df['VAT rate'] = vat_codes_df['VAT rate'].str.replace('%', '').astype(float) / 100
+
+    # Merge in VAT rates
+    merged = pd.merge(voucher_rows, vat_codes_df, how='left', left_on='vatType', right_on='VAT code')
+
+    # Calculate VAT for each row and total payable gross amount
+    merged['vat_amount'] = merged['amount'] * merged['VAT rate']
+    payable_gross_amount = (merged['amount'] + merged['vat_amount']).sum()
+
+    # Build voucher structure
+    voucher_data = {
+        "date": first_voucher_row["date"],
+        "general description": first_voucher_row["description"],
+        "payable_gross_amount": round(payable_gross_amount, 2),
+        "vat_lines": []
+    }
+
+    # Fill VAT lines
+    for _, row in merged.iterrows():
+        voucher_data["vat_lines"].append({
+            "vatType": row["vatType"],
+            "net_amount": row["amount"]
+        })
+
+    return voucher_id, voucher_data
+
+
+def load_voucher_text(voucher_id):
+    folder_path = 'context/supplier_postings_2022-01-01_-_2022-08-31/ocr/'
+    file_path = os.path.join(folder_path, f'{voucher_id}.txt')
+
+    if not os.path.exists(file_path):
+        return None  # or raise FileNotFoundError
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def extract_invoice_details(invoice_text, supplier_data, has_old_voucher, old_voucher, old_voucher_return):
+
+    if has_old_voucher:
+        prompt = f"""
+            Please find the sum payable and group the attached invoice by VAT type.
+            - The payable amount should be a gross amount, i.e. should include VAT
+            - The sum per VAT type should be net, i.e. should not include VAT
+            - Only use the attached VAT codes.
+            - If there is supplier context, please adhere to it
+            - Negative amounts are for credit notes. Positive amounts are for costs.
+            - If the invoice mentions "credit note", multiply the amounts by -1. (100 becomes -100).
+            - If the invoice is from outside of Norway, it's import and the VAT type should be 22 for food items and 21 for non-food items (0% VAT).
+
+            ### **Supplier:**  
+            {json.dumps(supplier_data, indent=2)}
+
+            ### **VAT Codes:**  
+            {json.dumps(vat_codes_df.to_dict(orient='records'), indent=2)}
+
+            ### **Invoice Text:**  
+            {invoice_text}
+
+            ### **Return the result as RAW JSON:**  
+            - Do NOT format the JSON in markdown.  
+            - Do NOT use backticks.  
+            - Return raw JSON directly, like this:  
+            [
+                {{
+                    "date": "",
+                    "general description": "",
+                    "payable_gross_amount": "",
+                    "vat_lines": 
+                        [
+                            {{
+                                "vatType": "",
+                                "net_amount": ""
+                            }}
+                        ]
+                }}
+            ]
+
+
+            Below is an old invoice and the correct return value for it. Use it to understand how to solve the task above.
+
+            ### **The old invoice:**
+            {old_voucher}
+            
+            ### The return value for the old invoice:
+            {old_voucher_return}
+        """
+    else:
+        prompt = f"""
+            Please find the sum payable and group the attached invoice by VAT type.
+            - The payable amount should be a gross amount, i.e. should include VAT
+            - The sum per VAT type should be net, i.e. should not include VAT
+            - Only use the attached VAT codes.
+            - If there is supplier context, please adhere to it
+            - Negative amounts are for credit notes. Positive amounts are for costs.
+
+            ### **Supplier:**  
+            {json.dumps(supplier_data, indent=2)}
+
+            ### **VAT Codes:**  
+            {json.dumps(vat_codes_df.to_dict(orient='records'), indent=2)}
+
+            ### **Invoice Text:**  
+            {invoice_text}
+
+            ### **Return the result as RAW JSON:**  
+            - Do NOT format the JSON in markdown.  
+            - Do NOT use backticks.  
+            - Return raw JSON directly, like this:  
+            [
+                {{
+                    "date": "",
+                    "general description": "",
+                    "payable_gross_amount": "",
+                    "vat_lines": 
+                        [
+                            {{
+                                "vatType": "",
+                                "net_amount": ""
+                            }}
+                        ]
+                }}
+            ]
+        """
+
+
+    model = genai.GenerativeModel("gemini-2.0-flash")
+    response = model.generate_content(
+        prompt,
+        generation_config={"temperature": 1}
+    )
+
+    if not response.candidates:
+        print("No response from Gemini.")
+        return []
+
+    json_text = response.candidates[0].content.parts[0].text.strip()
+
+    if json_text.startswith("```json"):
+        json_text = json_text[7:]
+    if json_text.endswith("```"):
+        json_text = json_text[:-3]
+
+    json_text = json_text.strip()
+
+    try:
+        result = json.loads(json_text)
+        if isinstance(result, list):
+            return [item for item in result if isinstance(item, dict)]
+        else:
+            print(f"Unexpected result format (not a list): {result}")
+            return []
+    except json.JSONDecodeError as e:
+        print(f"JSON parsing error: {e}\nResponse:\n{json_text}")
+        return []
+
+
+def get_first_voucher_question(supplier_id, df_of_vouchers, vat_codes_df):
+    """Return (voucher_id, [question‑style data]) or False if none found."""
+    df = df_of_vouchers[df_of_vouchers["supplier"] == supplier_id]
+    if df.empty:
+        return False
+    voucher_id = df.sort_values("date").iloc[0]["voucher"]
+    rows = df[df["voucher"] == voucher_id]
+
+    vmap = vat_codes_df.copy()
+    vmap["VAT rate"] = vmap["VAT rate"].str.rstrip("% ").astype(float) / 100
+    merged = rows.merge(vmap, left_on="vatType", right_on="VAT code", how="left")
+
+    question = {
+        "vat_lines": [
+            {
+                "vatType": r.vatType,
+                "net_amount": r.amount,
+                "account": "",
+                "department": "",
+            }
+            for _, r in merged.iterrows()
+        ]
+    }
+    return voucher_id, [question]
+
+
+def get_first_voucher_answer(supplier_id, df_of_vouchers, vat_codes_df):
+    """Return (voucher_id, [answer‑style data]) or False if none found."""
+    df = df_of_vouchers[df_of_vouchers["supplier"] == supplier_id]
+    if df.empty:
+        return False
+    voucher_id = df.sort_values("date").iloc[0]["voucher"]
+    rows = df[df["voucher"] == voucher_id]
+
+    vmap = vat_codes_df.copy()
+    vmap["VAT rate"] = vmap["VAT rate"].str.rstrip("% ").astype(float) / 100
+    merged = rows.merge(vmap, left_on="vatType", right_on="VAT code", how="left")
+
+    answer = {
+        "vat_lines": [
+            {
+                "vatType": r.vatType,
+                "net_amount": r.amount,
+                "account": r.account,
+                "department": r.department,
+            }
+            for _, r in merged.iterrows()
+        ]
+    }
+    return voucher_id, [answer]
+
+
+def extract_account_department(
+    predicted_vat_lines, 
+    invoice_text: str,
+    supplier_data: Dict,
+    example_voucher_question,
+    example_voucher_answer,
+    example_voucher_invoice,
+    has_old_voucher: bool,
+):
+    """Ask Gemini to fill in account / department for the VAT lines."""
+
+    common_part = f"""
+You are a Norwegian accountant following Norwegian accounting standards.
+- I have an invoice and the VAT lines for that invoice. For each VAT line, pick the correct **account code** and **department**.
+- Keep the VAT lines. They are correct.
+- If there is supplier context, adhere to it.
+- Always use double quotes – never single quotes.
+
+### Supplier
+{json.dumps(supplier_data, indent=2)}
+
+### Chart of accounts
+{accounts_df}
+
+### Departments
+{departments_df}
+
+### Invoice text
+{invoice_text}
+
+### Return RAW JSON (no markdown, no backticks) ***exactly*** in this format:
+{predicted_vat_lines}
+"""
+
+    if has_old_voucher:
+        prompt = (
+            common_part
+            + f"""
+
+Below is an **old invoice** from the same supplier. Use it as an example.
+
+### Old invoice text
+{example_voucher_invoice}
+
+### VAT lines for the old invoice
+{example_voucher_question}
+
+### Correct return value for the old invoice
+{example_voucher_answer}
+"""
+        )
+    else:
+        prompt = common_part
+
+    model = genai.GenerativeModel("gemini-2.0-flash")
+    response = model.generate_content(prompt, generation_config={"temperature": 1})
+
+    if not response.candidates:
+        return []
+
+    txt = response.candidates[0].content.parts[0].text.strip()
+    code_block = re.search(r"```(?:json)?\s*(.*?)\s*```", txt, re.S)
+    if code_block:
+        txt = code_block.group(1).strip()
+
+    try:
+        parsed = json.loads(txt)
+    except json.JSONDecodeError:
+        try:
+            parsed = ast.literal_eval(txt)
+        except Exception:
+            return []
+
+    if isinstance(parsed, dict):
+        parsed = [parsed]
+    return [p for p in parsed if isinstance(p, dict)]
+
+
+def consensus_runs(runs: List[List[Dict]], voucher_id: int) -> List[Dict]:
+    """Return consensus VAT‑lines for *one* voucher across several runs."""
+
+    if not runs or any(len(r) == 0 for r in runs):
+        return []  # at least one run failed to parse
+
+    base = runs[0][0]
+    out_item = {"voucher": voucher_id, "vat_lines": []}
+
+    lines_by_type = defaultdict(list)
+    for run in runs:
+        parent = run[0]
+        for line in parent.get("vat_lines", []):
+            lines_by_type[line["vatType"]].append(line)
+
+    for vat_type, same_type_lines in lines_by_type.items():
+        if len(same_type_lines) < len(runs):
+            # at least one run missing this VAT type, skip
+            continue
+
+        # pull values in the *same order* as the runs list
+        accounts = [l.get("account", "") for l in same_type_lines]
+        depts = [l.get("department", "") for l in same_type_lines]
+        net_amounts = [l.get("net_amount") for l in same_type_lines]
+        # net_amount should be identical across runs – pick first
+
+        account = accounts[0] if all(a == accounts[0] for a in accounts) else ""
+        department = depts[0] if all(d == depts[0] for d in depts) else ""
+
+        out_item["vat_lines"].append(
+            {
+                "vatType": vat_type,
+                "net_amount": net_amounts[0],
+                "account": account,
+                "department": department,
+            }
+        )
+
+    return [out_item]
+
+
+def predict_supplier(invoice_text):
+    """Majority vote over SUPPLIER_SAMPLES concurrent supplier predictions. Returns the result and its vote count.
+
+    Invoices the pre-matcher resolves from the supplier list skip Gemini and get a vote count of 0."""
+    match, _ = supplier_matcher.match(invoice_text)
+    if match:
+        return match, 0
+
+    with ThreadPoolExecutor(max_workers=SUPPLIER_SAMPLES) as executor:
+        responses = list(executor.map(lambda _: extract_supplier_from_gemini(invoice_text), range(SUPPLIER_SAMPLES)))
+
+    supplier_counts = Counter(r.get('supplier_number', '') for r in responses)
+    most_common_supplier, count = supplier_counts.most_common(1)[0]
+
+    if most_common_supplier == "" or count < SUPPLIER_MAJORITY:
+        return None, count
+
+    return next(r for r in responses if r['supplier_number'] == most_common_supplier), count
+
+
+def book_invoice(pdf_file, arrived):
+    """Runs one invoice through every stage and returns its booked lines and per-stage timings."""
+    invoice_number = pdf_file.replace(".pdf", "")
+    timings = {"invoice_number": invoice_number, "status": "booked"}
+    booked_lines = []
+
+    # Same PDF bytes as an earlier invoice, or a copy in progress on another worker: stop before paying for OCR.
+    # Otherwise the keys stay reserved for this invoice until it is booked; handle_invoice releases them if it isn't
+    with open(os.path.join(input_folder, pdf_file), "rb") as file:
+        keys = [content_key(file.read())]
+    duplicate_of = duplicate_index.check(keys, run_name, invoice_number)
+
+    if duplicate_of:
+        timings["status"] = "duplicate"
+        timings["duplicate_of"] = duplicate_of
+        return booked_lines, timings
+
+    # 001 OCR
+    stage_started = time.time()
+    invoice_text = process_invoice_ocr(os.path.join(input_folder, pdf_file))
+    timings["ocr_seconds"] = round(time.time() - stage_started, 3)
+
+    if not invoice_text:
+        timings["status"] = "ocr_failed"
+        return booked_lines, timings
+
+    # Same supplier invoice sent again as a new scan or export: stop before the supplier ensemble
+    fingerprints = fingerprint_keys(extract_fingerprints(invoice_text, OWN_ORGANIZATION_NUMBERS))
+    duplicate_of = duplicate_index.check(fingerprints, run_name, invoice_number)
+
+    if duplicate_of:
+        timings["status"] = "duplicate"
+        timings["duplicate_of"] = duplicate_of
+        return booked_lines, timings
+
+    with open(os.path.join(output_text_folder, f"{invoice_number}.txt"), "w", encoding="utf-8") as text_file:
+        text_file.write(invoice_text)
+
+    # 002 Supplier prediction
+    stage_started = time.time()
+    supplier_result, majority_count = predict_supplier(invoice_text)
+    timings["supplier_seconds"] = round(time.time() - stage_started, 3)
+
+    timings["majority_count"] = majority_count
+
+    if supplier_result is None:
+        timings["status"] = "no_supplier"
+        return booked_lines, timings
+
+    supplier_rows = suppliers_with_id[
+        suppliers_with_id['supplierNumber'].astype(str) == str(supplier_result['supplier_number'])
+    ]
+    if supplier_rows.empty:
+        timings["status"] = "no_supplier"
+        return booked_lines, timings
+
+    supplier_data = {**supplier_result, **supplier_rows.iloc[0].to_dict()}
+    supplier_id = supplier_rows.iloc[0]['id']
+
+    # 003 VAT split, one-shot with the supplier's first old voucher
+    stage_started = time.time()
+    voucher_result = get_first_voucher(supplier_id, filtered_postings, vat_codes_df)
+
+    if voucher_result:
+        old_voucher_id, old_voucher_data = voucher_result
+        old_voucher = load_voucher_text(old_voucher_id)
+        invoice_details = extract_invoice_details(invoice_text, supplier_data, True, old_voucher, old_voucher_data)
+    else:
+        invoice_details = extract_invoice_details(invoice_text, supplier_data, False, "", "")
+
+    timings["vat_seconds"] = round(time.time() - stage_started, 3)
+
+    if not invoice_details:
+        timings["status"] = "no_vat_lines"
+        return booked_lines, timings
+
+    # 004 Account and department, consensus over ACC_DEP_ATTEMPTS runs
+    stage_started = time.time()
+    header = invoice_details[0]
+    skeleton_lines = [{
+        "vat_lines": [
+            {"vatType": line.get("vatType"), "net_amount": line.get("net_amount"), "department": "", "account": ""}
+            for line in header.get("vat_lines", []) if isinstance(line, dict)
+        ]
+    }]
+
+    first_q = first_a = first_txt = "N/A"
+    has_example = False
+
+    ex_q_res = get_first_voucher_question(supplier_id, filtered_postings, vat_codes_df)
+    ex_a_res = get_first_voucher_answer(supplier_id, filtered_postings, vat_codes_df)
+    if ex_q_res and ex_a_res:
+        old_id, first_q = ex_q_res
+        _, first_a = ex_a_res
+        first_txt = load_voucher_text(old_id) or "N/A"
+        has_example = True
+
+    with ThreadPoolExecutor(max_workers=ACC_DEP_ATTEMPTS) as executor:
+        all_runs = list(executor.map(
+            lambda _: extract_account_department(
+                skeleton_lines, invoice_text, supplier_data, first_q, first_a, first_txt, has_example
+            ),
+            range(ACC_DEP_ATTEMPTS)
+        ))
+
+    consensus = consensus_runs(all_runs, invoice_number)
+    timings["acc_dep_seconds"] = round(time.time() - stage_started, 3)
+
+    for item in consensus:
+        for line in item.get("vat_lines", []):
+            booked_lines.append({
+                "voucher": invoice_number,
+                "supplier_number": supplier_result["supplier_number"],
+                "date": header.get("date"),
+                "general description": header.get("general description"),
+                "payable_gross_amount": header.get("payable_gross_amount"),
+                "vatType": line.get("vatType"),
+                "net_amount": line.get("net_amount"),
+                "account": line.get("account"),
+                "department": line.get("department")
+            })
+
+    if not booked_lines:
+        timings["status"] = "no_consensus"
+        return booked_lines, timings
+
+    # Only booked invoices count as seen, so a resubmission of one that failed on the way is booked normally
+    duplicate_index.add(keys + fingerprints, run_name, invoice_number)
+
+    return booked_lines, timings
+
+
+csv_lock = threading.Lock()
+booked_line_fields = ["voucher", "supplier_number", "date", "general description", "payable_gross_amount",
+                      "vatType", "net_amount", "account", "department"]
+latency_fields = ["invoice_number", "status", "majority_count", "arrived", "finished", "latency_seconds",
+                  "ocr_seconds", "supplier_seconds", "vat_seconds", "acc_dep_seconds", "duplicate_of",
+                  "attempt"]
+
+
+def append_rows(path, fieldnames, rows):
+    with csv_lock:
+        write_header = not os.path.exists(path)
+        with open(path, "a", newline="", encoding="utf-8") as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+def handle_invoice(pdf_file, arrived, attempt):
+    """Books one invoice and logs it. Returns the status, so the watcher knows whether to retry."""
+    try:
+        booked_lines, timings = book_invoice(pdf_file, arrived)
+    except Exception as e:
+        print(f"Error booking '{pdf_file}': {e}")
+        booked_lines, timings = [], {"invoice_number": pdf_file.replace(".pdf", ""), "status": "error"}
+    finally:
+        # Keys of an invoice that was not booked are free again for its retry or a copy
+        duplicate_index.release(run_name, pdf_file.replace(".pdf", ""))
+
+    finished = time.time()
+    timings["arrived"] = round(arrived, 3)
+    timings["finished"] = round(finished, 3)
+    timings["latency_seconds"] = round(finished - arrived, 3)
+    timings["attempt"] = attempt
+
+    append_rows(booked_lines_csv_path, booked_line_fields, booked_lines)
+    append_rows(latency_csv_path, latency_fields, [timings])
+
+    print(f"{timings['status']}: {pdf_file} with {len(booked_lines)} lines, {timings['latency_seconds']} s after arrival")
+    return timings["status"]
+
+
+# Booked invoices and duplicates are done. No supplier is a deterministic outcome, so retrying only pays for OCR and
+# the ensemble again; those invoices go to the review folder. Every other status is retried
+HANDLED_STATUSES = {"booked", "duplicate"}
+REVIEW_STATUSES = {"no_supplier"}
+
+
+def move_invoice(pdf_file, folder):
+    """Moves a PDF out of the input folder. Returns False if it is already gone (removed or renamed meanwhile)."""
+    try:
+        os.makedirs(folder, exist_ok=True)
+        shutil.move(os.path.join(input_folder, pdf_file), os.path.join(folder, pdf_file))
+        return True
+    except OSError as e:
+        print(f"Could not move {pdf_file} to {folder}: {e}")
+        return False
+
+
+os.makedirs(input_folder, exist_ok=True)
+os.makedirs(output_text_folder, exist_ok=True)
+os.makedirs(output_folder, exist_ok=True)
+
+# Invoices booked (or found to be duplicates) by an earlier daemon run
+seen = set()
+if os.path.exists(latency_csv_path):
+    latency_df = pd.read_csv(latency_csv_path, dtype=str)
+    seen = set(latency_df.loc[latency_df["status"].isin(HANDLED_STATUSES), "invoice_number"] + ".pdf")
+
+first_seen = {}  # pdf_file -> (arrival time, size at last poll)
+running = {}  # pdf_file -> (future, arrival time)
+attempts = Counter()  # pdf_file -> attempts that did not book it
+retry_at = {}  # pdf_file -> earliest time of the next attempt
+
+print(f"Watching {input_folder} for new invoices")
+
+with ThreadPoolExecutor(max_workers=INVOICE_WORKERS) as executor:
+    try:
+        while True:
+            now = time.time()
+
+            for pdf_file, (future, arrived) in list(running.items()):
+                if not future.done():
+                    continue
+                del running[pdf_file]
+
+                status = future.result()
+                if status in HANDLED_STATUSES:
+                    seen.add(pdf_file)
+                    continue
+
+                # Invoices that can't be moved are left where they are and not picked up again by this daemon
+                if status in REVIEW_STATUSES:
+                    if move_invoice(pdf_file, review_folder):
+                        print(f"Moved {pdf_file} to {review_folder}: {status}")
+                    else:
+                        seen.add(pdf_file)
+                    continue
+
+                attempts[pdf_file] += 1
+                if attempts[pdf_file] >= MAX_ATTEMPTS:
+                    if move_invoice(pdf_file, failed_folder):
+                        print(f"Moved {pdf_file} to {failed_folder} after {attempts[pdf_file]} attempts")
+                    else:
+                        seen.add(pdf_file)
+                    continue
+
+                try:
+                    first_seen[pdf_file] = (arrived, os.path.getsize(os.path.join(input_folder, pdf_file)))
+                    retry_at[pdf_file] = now + RETRY_SECONDS * 2 ** (attempts[pdf_file] - 1)
+                except OSError:
+                    print(f"{pdf_file} disappeared from {input_folder}, not retrying")
+
+            for pdf_file in os.listdir(input_folder):
+                if not pdf_file.endswith(".pdf") or pdf_file in seen or pdf_file in running:
+                    continue
+                if retry_at.get(pdf_file, 0) > now:
+                    continue
+
+                try:
+                    size = os.path.getsize(os.path.join(input_folder, pdf_file))
+                except OSError:
+                    first_seen.pop(pdf_file, None)  # Removed or renamed since the listing
+                    continue
+                arrived, last_size = first_seen.get(pdf_file, (now, -1))
+
+                if size != last_size:
+                    first_seen[pdf_file] = (arrived, size)
+                    continue
+
+                if now - arrived >= SETTLE_SECONDS:
+                    del first_seen[pdf_file]
+                    running[pdf_file] = (executor.submit(handle_invoice, pdf_file, arrived, attempts[pdf_file] + 1), arrived)
+
+            time.sleep(POLL_SECONDS)
+
+    except KeyboardInterrupt:
+        print("Stopping, waiting for invoices in progress")
@@ -0,0 +1,72 @@
+import math
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Sequential sampling for the supplier ensembles: draw a few samples, stop when they agree, draw more only on
+# disagreement. The answers are supplier numbers, "" meaning no supplier. Two stopping rules:
+#   agreement = stop when the leading supplier is `margin` votes ahead of the runner-up
+#   sprt      = Wald's sequential probability ratio test of "the leading supplier comes back with probability p1"
+#               against "... with probability p0". Stops with the leader when H1 is accepted and with no supplier
+#               when H0 is accepted
+# Only a non-empty leader stops early on agreement; samples agreeing on no supplier are drawn to the cap. At the cap
+# the leader is kept if it has more than half of the votes.
+
+
+class AdaptiveSampler:
+    def __init__(self, start=2, cap=5, rule="agreement", margin=2, p0=0.5, p1=0.9, alpha=0.2, beta=0.1):
+        self.start = start
+        self.cap = cap
+        self.rule = rule
+        self.margin = margin
+        self.p0 = p0
+        self.p1 = p1
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+
+    def decide(self, answers):
+        """Returns (stop, answer) for the answers drawn so far. answer is "" when the ensemble found no supplier."""
+        if len(answers) < self.start:
+            return False, None
+
+        ranked = Counter(answers).most_common()
+        leader, leader_count = ranked[0]
+        runner_up_count = ranked[1][1] if len(ranked) > 1 else 0
+
+        if self.rule == "sprt":
+            others = len(answers) - leader_count
+            llr = (leader_count * math.log(self.p1 / self.p0)
+                   + others * math.log((1 - self.p1) / (1 - self.p0)))
+            if llr >= self.upper and leader != "":
+                return True, leader
+            if llr <= self.lower:
+                return True, ""
+        elif leader_count - runner_up_count >= self.margin and leader != "":
+            return True, leader
+
+        if len(answers) >= self.cap:
+            return True, leader if leader_count * 2 > len(answers) else ""
+
+        return False, None
+
+    def run(self, draw):
+        """Calls draw() until decide() stops. The first `start` draws run concurrently. Returns the responses
+        and the winning answer. draw() returns a supplier dict."""
+        with ThreadPoolExecutor(max_workers=self.start) as executor:
+            responses = list(executor.map(lambda _: draw(), range(self.start)))
+
+        while True:
+            stop, answer = self.decide([r.get("supplier_number", "") for r in responses])
+            if stop:
+                return responses, answer
+            responses.append(draw())
+
+    def replay(self, recorded_answers):
+        """Runs the stopping rule over answers recorded in order. Returns (answer, calls used)."""
+        for calls in range(self.start, len(recorded_answers) + 1):
+            stop, answer = self.decide(recorded_answers[:calls])
+            if stop:
+                return answer, calls
+
+        answers = recorded_answers[:self.cap]
+        leader, leader_count = Counter(answers).most_common(1)[0]
+        return (leader if leader_count * 2 > len(answers) else ""), len(answers)
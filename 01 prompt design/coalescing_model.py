@@ -0,0 +1,80 @@
+import json
+import hashlib
+import threading
+from concurrent.futures import Future
+
+# Wraps a GenerativeModel so identical requests share one real call.
+#   - Deterministic requests (temperature 0, candidate_count 1) are memoized for the lifetime of the wrapper: the
+#     same prompt to the same model returns the first response, whether the duplicate comes later or while the
+#     first call is still in flight.
+#   - Sampled requests (temperature above 0) are different draws on purpose and are only coalesced while in
+#     flight when coalesce_sampled is set.
+
+
+def request_key(model_name, contents, generation_config):
+    """Hash of model, contents (inline data by its bytes) and generation config."""
+    parts = contents if isinstance(contents, list) else [contents]
+    digest = hashlib.sha256(str(model_name).encode("utf-8"))
+
+    for part in parts:
+        if isinstance(part, dict) and isinstance(part.get("data"), bytes):
+            digest.update(part.get("mime_type", "").encode("utf-8") + part["data"])
+        else:
+            digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+
+    digest.update(json.dumps(dict(generation_config or {}), sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CoalescingModel:
+    def __init__(self, model, coalesce_sampled=False):
+        self.model = model
+        self.coalesce_sampled = coalesce_sampled
+        self.lock = threading.Lock()
+        self.requests = {}  # key -> Future of the real call
+        self.calls = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def is_deterministic(generation_config):
+        config = dict(generation_config or {})
+        return config.get("temperature", 1) == 0 and config.get("candidate_count", 1) == 1
+
+    def generate_content(self, contents, generation_config=None, **kwargs):
+        deterministic = self.is_deterministic(generation_config)
+        if not deterministic and not self.coalesce_sampled:
+            with self.lock:
+                self.calls += 1
+            return self.model.generate_content(contents, generation_config=generation_config, **kwargs)
+
+        key = request_key(getattr(self.model, "model_name", ""), contents, generation_config)
+
+        with self.lock:
+            future = self.requests.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.requests[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            response = self.model.generate_content(contents, generation_config=generation_config, **kwargs)
+            future.set_result(response)
+        except Exception as e:
+            future.set_exception(e)
+            deterministic = False  # Failed calls are not remembered, the next duplicate tries again
+        finally:
+            if not deterministic:
+                with self.lock:
+                    self.requests.pop(key, None)
+
+        return future.result()
+
+    def summary(self):
+        total = self.calls + self.coalesced
+        return f"Request coalescing: {self.coalesced} of {total} calls coalesced, {self.calls} sent to the model"
@@ -0,0 +1,106 @@
+import time
+import datetime
+import threading
+
+import google.generativeai as genai
+from google.generativeai import caching
+
+from local_gemini import LocalCachedContent, LocalGenerativeModel
+
+# Static-prefix context caching. The reference tables every call of a stage repeats (supplier list, VAT codes,
+# chart of accounts, departments) are registered once per run as cached content, and each call only sends the
+# per-invoice suffix. Every call is streamed so time to first token can be measured, and cached vs. uncached
+# input tokens are read from usage_metadata.
+
+MIN_CACHED_TOKENS = 4096  # Gemini refuses cached content below this many tokens
+
+
+class PrefixCachedModel:
+    """generate_content(suffix) for a fixed prefix, cached or not. summary() reports tokens and time to first token.
+
+    Cached content needs an explicit model version (e.g. "gemini-2.0-flash-001") and a prefix of at least
+    MIN_CACHED_TOKENS. Shorter prefixes, and prefixes the cache can't be created for, are sent with every call
+    instead; summary() says why the cache was not used.
+    """
+
+    def __init__(self, model_name, prefix, use_cache=True, use_local_model=False, ttl_minutes=60):
+        self.model_name = model_name
+        self.prefix = prefix
+        self.cache = None
+        self.cache_status = "off, disabled"
+        self.lock = threading.Lock()
+        self.calls = []
+
+        GenerativeModel = LocalGenerativeModel if use_local_model else genai.GenerativeModel
+        CachedContent = LocalCachedContent if use_local_model else caching.CachedContent
+
+        self.model = GenerativeModel(model_name)
+
+        if use_cache:
+            try:
+                prefix_tokens = self.model.count_tokens(prefix).total_tokens
+                if prefix_tokens < MIN_CACHED_TOKENS:
+                    self.cache_status = f"off, the prefix is {prefix_tokens} tokens, below the {MIN_CACHED_TOKENS} token minimum"
+                else:
+                    self.cache = CachedContent.create(
+                        model=f"models/{model_name}",
+                        display_name="static prefix",
+                        contents=[prefix],
+                        ttl=datetime.timedelta(minutes=ttl_minutes)
+                    )
+                    self.model = GenerativeModel.from_cached_content(cached_content=self.cache)
+                    self.cache_status = f"on, {prefix_tokens} prefix tokens"
+            except Exception as e:
+                print(f"Could not cache the prompt prefix, sending it with every call instead. Error: {e}")
+                self.cache = None
+                self.cache_status = "off, creating the cache failed"
+
+    def generate_content(self, contents, generation_config=None):
+        parts = contents if isinstance(contents, list) else [contents]
+        if self.cache is None:
+            parts = [self.prefix] + parts
+
+        # Streaming is only used for single-candidate requests; with several candidates the first token is the
+        # whole response. Logprob requests are not streamed so the log-probabilities come back in one piece
+        config = generation_config or {}
+        stream = config.get("candidate_count", 1) == 1 and not config.get("response_logprobs")
+
+        started = time.perf_counter()
+        response = self.model.generate_content(parts, generation_config=generation_config, stream=stream)
+
+        first_token_seconds = None if stream else time.perf_counter() - started
+        for _ in (response if stream else []):
+            if first_token_seconds is None:
+                first_token_seconds = time.perf_counter() - started
+
+        usage = response.usage_metadata
+        cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+
+        with self.lock:
+            self.calls.append({
+                "cached_tokens": cached_tokens,
+                "uncached_tokens": usage.prompt_token_count - cached_tokens,
+                "first_token_seconds": first_token_seconds or 0.0,
+                "seconds": time.perf_counter() - started
+            })
+
+        return response
+
+    def summary(self):
+        if not self.calls:
+            return f"Prompt prefix cache ({self.cache_status}): no calls"
+
+        calls = len(self.calls)
+        cached = sum(c["cached_tokens"] for c in self.calls)
+        uncached = sum(c["uncached_tokens"] for c in self.calls)
+        first_token = sum(c["first_token_seconds"] for c in self.calls) / calls
+        total = sum(c["seconds"] for c in self.calls) / calls
+
+        return (f"Prompt prefix cache ({self.cache_status}): {calls} calls, {cached} cached and "
+                f"{uncached} uncached input tokens ({cached / max(cached + uncached, 1):.0%} cached), "
+                f"{first_token:.2f} s to first token, {total:.2f} s per call")
+
+    def close(self):
+        """Deletes the cached content so it stops being billed for storage."""
+        if self.cache is not None:
+            self.cache.delete()
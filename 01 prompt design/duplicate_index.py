@@ -0,0 +1,158 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Index of every invoice seen across runs, used to stop emailed-twice invoices before they reach OCR or Gemini.
+# Each invoice is stored under several keys: the hash of the PDF bytes, and fingerprints read from the OCR text
+# (supplier org number with invoice number, and org number with KID and gross amount). Lookups are primary key
+# hits in SQLite, so they stay fast with millions of invoices.
+
+ORG_NUMBER_PATTERN = re.compile(
+    r"(?:org\.?\s*(?:nr|nummer)\.?|organisasjonsnummer|foretaksregisteret)[:\s]*(\d{3}\s?\d{3}\s?\d{3})(?!\d)",
+    re.I
+)
+# VAT registration form "NO 123 456 789 MVA". Case-sensitive, so "Invoice no: 123 456 789" is not read as one
+VAT_NUMBER_PATTERN = re.compile(r"\bNO\s?(\d{3}\s?\d{3}\s?\d{3})\s?MVA\b")
+INVOICE_NUMBER_PATTERN = re.compile(
+    r"(?:faktura\s*(?:nr|nummer)|fakturanr|invoice\s*(?:no|number|nr))\.?[:\s#]*([A-Z0-9][A-Z0-9\-/]*\d[A-Z0-9\-/]*)",
+    re.I
+)
+KID_PATTERN = re.compile(r"\bKID(?:\s*(?:nr|nummer))?\.?[:\s]*(\d[\d ]{0,23}\d)", re.I)
+GROSS_PATTERN = re.compile(
+    r"(?:totalt?\s*(?:å\s*betale|inkl\.?\s*mva)?|å\s*betale|beløp\s*å\s*betale|amount\s*due)[^\d\n]{0,30}(-?\d[\d .]*,\d{2}(?!\d)|-?\d[\d,]*\.\d{2}(?!\d))",
+    re.I
+)
+
+
+def content_key(pdf_bytes):
+    return "content:" + hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def normalize_amount(amount):
+    amount = amount.replace(" ", "")
+    if "," in amount and amount.rfind(",") > amount.rfind("."):
+        amount = amount.replace(".", "").replace(",", ".")
+    else:
+        amount = amount.replace(",", "")
+    return f"{float(amount):.2f}"
+
+
+def supplier_organization_number(invoice_text, ignored_organization_numbers=()):
+    """First org number on the invoice that isn't one of ours. Our own number is printed on every invoice as the
+    buyer, so fingerprinting with it would make invoices from different suppliers collide."""
+    ignored = {re.sub(r"\D", "", str(o)) for o in ignored_organization_numbers}
+    matches = sorted(list(ORG_NUMBER_PATTERN.finditer(invoice_text)) + list(VAT_NUMBER_PATTERN.finditer(invoice_text)),
+                     key=lambda m: m.start())
+
+    for match in matches:
+        org_number = re.sub(r"\D", "", match.group(1))
+        if org_number not in ignored:
+            return org_number
+    return ""
+
+
+def extract_fingerprints(invoice_text, ignored_organization_numbers=()):
+    """Reads supplier org number, invoice number, KID and gross amount from invoice text. Missing values are empty
+    strings."""
+    def first(pattern):
+        match = pattern.search(invoice_text)
+        return match.group(1) if match else ""
+
+    gross_amounts = [normalize_amount(a) for a in GROSS_PATTERN.findall(invoice_text)]
+
+    return {
+        "organization_number": supplier_organization_number(invoice_text, ignored_organization_numbers),
+        "invoice_number": first(INVOICE_NUMBER_PATTERN).upper(),
+        "kid": re.sub(r"\D", "", first(KID_PATTERN)),
+        # The last total on the invoice is usually the amount payable
+        "gross_amount": gross_amounts[-1] if gross_amounts else ""
+    }
+
+
+def fingerprint_keys(fingerprints):
+    """Keys that identify the same invoice from the same supplier. Needs the org number to avoid cross-supplier clashes."""
+    org = fingerprints["organization_number"]
+    keys = []
+
+    if org and fingerprints["invoice_number"]:
+        keys.append(f"invoice:{org}:{fingerprints['invoice_number']}")
+    if org and fingerprints["kid"] and fingerprints["gross_amount"]:
+        keys.append(f"kid:{org}:{fingerprints['kid']}:{fingerprints['gross_amount']}")
+
+    return keys
+
+
+class DuplicateIndex:
+    """Persistent key -> first invoice index shared by all runs.
+
+    check() reserves the keys of an invoice that is not a duplicate until add() stores them or release() drops them,
+    so a copy handled at the same time by another worker is caught before its own OCR or Gemini calls.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.pending = {}  # key -> (run_name, invoice_number) of the invoice in flight under it
+        self.checked = 0
+        self.duplicates = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS duplicate_index ("
+            "key TEXT PRIMARY KEY, run_name TEXT NOT NULL, invoice_number TEXT NOT NULL, first_seen REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def check(self, keys, run_name, invoice_number):
+        """Returns "run_name/invoice_number" of the first invoice stored or in flight under any of the keys, or None.
+
+        An invoice matching its own earlier entry (a re-run of the same run) is not a duplicate. When None is
+        returned the keys are reserved for this invoice in the same locked step.
+        """
+        invoice_number = str(invoice_number)
+
+        with self.lock:
+            self.checked += 1
+
+            for key in keys:
+                row = self.connection.execute(
+                    "SELECT run_name, invoice_number FROM duplicate_index WHERE key = ?", (key,)
+                ).fetchone() or self.pending.get(key)
+
+                if row and tuple(row) != (run_name, invoice_number):
+                    self.duplicates += 1
+                    return f"{row[0]}/{row[1]}"
+
+            for key in keys:
+                self.pending.setdefault(key, (run_name, invoice_number))
+
+            return None
+
+    def add(self, keys, run_name, invoice_number):
+        """Stores the keys for this invoice. Called once it has been handled (OCR text written or booked), so an
+        invoice that failed on the way still counts as new when it is sent again. Keys already stored keep their
+        first invoice."""
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO duplicate_index (key, run_name, invoice_number, first_seen) VALUES (?, ?, ?, ?)",
+                [(key, run_name, str(invoice_number), time.time()) for key in keys]
+            )
+            self.connection.commit()
+
+            for key in keys:
+                self.pending.pop(key, None)
+
+    def release(self, run_name, invoice_number):
+        """Drops the keys reserved for an invoice that was not handled, so a later copy is not a duplicate of it.
+        A no-op once add() has stored them."""
+        owner = (run_name, str(invoice_number))
+
+        with self.lock:
+            for key in [k for k, v in self.pending.items() if v == owner]:
+                del self.pending[key]
+
+    def summary(self):
+        return f"Duplicate index: {self.duplicates} duplicates found in {self.checked} checks"
@@ -0,0 +1,28 @@
+import os
+import pandas as pd
+
+# Supplier ground truth from the 006 evaluation. "006 Is it correct/supplier_postings.csv" holds the postings the
+# accountants booked for a run's invoices (voucher = invoice number); their supplier id maps to a supplier number
+# through context/suppliers_with_id.csv.
+
+
+def supplier_ground_truth(run_folder, suppliers_with_id_path="context/suppliers_with_id.csv"):
+    """{invoice_number: supplier_number} for the invoices of a run with booked postings. Empty without 006 postings.
+
+    Vouchers whose postings point to more than one supplier, or to a supplier id not in the list, are left out.
+    """
+    postings_path = os.path.join(run_folder, "006 Is it correct", "supplier_postings.csv")
+    if not os.path.exists(postings_path) or not os.path.exists(suppliers_with_id_path):
+        return {}
+
+    postings = pd.read_csv(postings_path, encoding='ISO-8859-1', dtype=str).dropna(subset=["voucher", "supplier"])
+    suppliers_with_id = pd.read_csv(suppliers_with_id_path, encoding='ISO-8859-1', dtype=str)
+    supplier_numbers = dict(zip(suppliers_with_id["id"], suppliers_with_id["supplierNumber"]))
+
+    ground_truth = {}
+    for voucher, group in postings.groupby("voucher"):
+        numbers = {supplier_numbers.get(supplier_id) for supplier_id in group["supplier"]}
+        if len(numbers) == 1 and None not in numbers:
+            ground_truth[voucher] = numbers.pop()
+
+    return ground_truth
@@ -0,0 +1,244 @@
+import re
+import json
+import math
+import time
+import random
+from types import SimpleNamespace
+
+import fitz
+
+# Local stand-in for google.generativeai.GenerativeModel, used to benchmark pipeline modes without calling Gemini.
+# It answers the supplier and VAT prompts of the prompt design scripts with simple string matching on the
+# invoice text (or the text layer of an inline PDF part), and sleeps to mimic latency that grows with the input.
+
+BASE_LATENCY = 0.3  # Seconds per call
+LATENCY_PER_1K_TOKENS = 0.02
+PDF_PAGE_TOKENS = 258  # Gemini bills each PDF page like an image
+TEMPERATURE_NOISE = 0.1  # Chance per unit of temperature that a sample comes back empty
+CACHED_TOKEN_LATENCY_FACTOR = 0.25  # Cached input tokens cost this share of the prefill time of uncached ones
+LATENCY_PER_OUTPUT_TOKEN = 0.002  # Decode time per output token after the first one, for streamed responses
+# Synthetic probability of the supplier_number value when response_logprobs is set, by how the answer was found
+SUPPLIER_PROBABILITIES = {"organization_number": 0.98, "name": 0.85, "not_found": 0.9, "ambiguous": 0.5, "noise": 0.4}
+LOGPROB_JITTER = 0.05  # Spread around those probabilities
+
+EMPTY_SUPPLIER = {"supplier_name": "", "supplier_number": "", "organization_number": ""}
+INVOICE_BLOCK_PATTERN = re.compile(r"=== INVOICE (.+?) START ===\n(.*?)\n=== INVOICE \1 END ===", re.S)
+AMOUNT_PATTERN = re.compile(r"\d[\d ]*,\d{2}\b|\d[\d,]*\.\d{2}\b")
+
+
+def count_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def parse_amount(text):
+    text = text.replace(" ", "")
+    if "," in text and (text.rfind(",") > text.rfind(".")):
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    return float(text)
+
+
+def supplier_list(prompt):
+    """Parses the 'name, number, org number' rows that follow 'Supplier List:' in a prompt."""
+    match = re.search(r"Supplier List:\s*\n(.*?)\n\s*\n", prompt, re.S)
+    if not match:
+        return []
+
+    suppliers = []
+    for line in match.group(1).splitlines():
+        parts = [p.strip() for p in line.rsplit(",", 2)]
+        if len(parts) == 3:
+            suppliers.append({"supplier_name": parts[0], "supplier_number": parts[1], "organization_number": parts[2]})
+    return suppliers
+
+
+def supplier_matches(prompt, invoice_text):
+    """Suppliers in the prompt's list found in the invoice text. Returns ({supplier_number: supplier}, how)."""
+    digits = re.sub(r"\D", "", invoice_text)
+    lowered = invoice_text.lower()
+
+    by_org = [
+        s for s in supplier_list(prompt)
+        if len(re.sub(r"\D", "", s["organization_number"])) == 9 and re.sub(r"\D", "", s["organization_number"]) in digits
+    ]
+    by_name = [s for s in supplier_list(prompt) if s["supplier_name"] and s["supplier_name"].lower() in lowered]
+
+    unique = {m["supplier_number"]: m for m in by_org + by_name}
+    if len(unique) != 1:
+        return unique, "ambiguous" if unique else "not_found"
+    return unique, "organization_number" if by_org else "name"
+
+
+def answer_supplier(prompt, invoice_text):
+    unique, _ = supplier_matches(prompt, invoice_text)
+    return json.dumps(next(iter(unique.values())) if len(unique) == 1 else EMPTY_SUPPLIER)
+
+
+def synthetic_logprobs(text, probability, random_generator):
+    """Token log-probabilities shaped like Gemini's logprobs_result for a JSON answer.
+
+    The text is cut into count_tokens-sized tokens. The tokens of the supplier_number value (the closing quote when
+    it is empty) share the log of probability, jittered by LOGPROB_JITTER; every other token is near-certain.
+    """
+    probability = min(max(probability + random_generator.uniform(-LOGPROB_JITTER, LOGPROB_JITTER), 0.01), 0.999)
+    tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    match = re.search(r'"supplier_number"\s*:\s*"([^"]*)"', text)
+    start, end = (match.start(1), max(match.end(1), match.start(1) + 1)) if match else (len(text), len(text))
+    value_tokens = [i for i in range(len(tokens)) if i * 4 < end and i * 4 + len(tokens[i]) > start]
+
+    chosen = []
+    for i, token in enumerate(tokens):
+        log_probability = math.log(probability) / len(value_tokens) if i in value_tokens else math.log(0.999)
+        chosen.append(SimpleNamespace(token=token, log_probability=log_probability))
+
+    avg_logprobs = sum(c.log_probability for c in chosen) / max(len(chosen), 1)
+    return avg_logprobs, SimpleNamespace(chosen_candidates=chosen, top_candidates=[])
+
+
+def answer_supplier_batch(prompt, noisy):
+    """Answers a batched supplier prompt with one result per delimited invoice. noisy() decides empty samples."""
+    results = []
+    for invoice_number, invoice_text in INVOICE_BLOCK_PATTERN.findall(prompt):
+        result = EMPTY_SUPPLIER if noisy() else json.loads(answer_supplier(prompt, invoice_text))
+        results.append({"invoice_number": invoice_number, **result})
+    return json.dumps(results)
+
+
+def answer_vat(invoice_text):
+    amounts = [parse_amount(a) for a in AMOUNT_PATTERN.findall(invoice_text)]
+    gross = max(amounts) if amounts else 0.0
+
+    return json.dumps([{
+        "date": "",
+        "general description": invoice_text.strip().splitlines()[0] if invoice_text.strip() else "",
+        "payable_gross_amount": f"{gross:.2f}",
+        "vat_lines": [{"vatType": "1", "net_amount": f"{gross / 1.25:.2f}"}]
+    }])
+
+
+class LocalCachedContent:
+    """Stand-in for caching.CachedContent: holds the cached contents and their token count."""
+
+    def __init__(self, model, contents, display_name=""):
+        self.name = f"cachedContents/local-{id(self)}"
+        self.model = model
+        self.display_name = display_name
+        self.contents = list(contents)
+        self.usage_metadata = SimpleNamespace(total_token_count=LocalGenerativeModel._split_contents(self.contents)[2])
+
+    @classmethod
+    def create(cls, model, contents, display_name="", ttl=None, **kwargs):
+        return cls(model, contents, display_name)
+
+    def delete(self):
+        self.contents = []
+
+
+class LocalStreamedResponse:
+    """Response returned with stream=True. Iterating sleeps until the first token, then through the decode."""
+
+    def __init__(self, response, first_token_seconds):
+        self.candidates = response.candidates
+        self.usage_metadata = response.usage_metadata
+        self.text = response.text
+        self._first_token_seconds = first_token_seconds
+
+    def __iter__(self):
+        time.sleep(self._first_token_seconds)
+        yield self
+        time.sleep(LATENCY_PER_OUTPUT_TOKEN * self.usage_metadata.candidates_token_count)
+
+
+class LocalGenerativeModel:
+    """Implements the parts of GenerativeModel the scripts use: generate_content (with response_logprobs),
+    count_tokens and from_cached_content."""
+
+    def __init__(self, model_name="gemini-2.0-flash", seed=None):
+        self.model_name = model_name
+        self.random = random.Random(seed)
+        self.cached_content = None
+
+    @classmethod
+    def from_cached_content(cls, cached_content, seed=None):
+        model = cls(cached_content.model.replace("models/", ""), seed)
+        model.cached_content = cached_content
+        return model
+
+    @staticmethod
+    def _split_contents(contents):
+        """Returns the prompt text, the text layer of any inline PDF parts and the input token count."""
+        if isinstance(contents, (str, dict)):
+            contents = [contents]
+
+        texts, attachments, tokens = [], [], 0
+        for part in contents:
+            if isinstance(part, str):
+                texts.append(part)
+                tokens += count_tokens(part)
+            elif isinstance(part, dict) and part.get("mime_type") == "application/pdf":
+                doc = fitz.open(stream=part["data"], filetype="pdf")
+                attachments.append("".join(page.get_text() for page in doc))
+                tokens += PDF_PAGE_TOKENS * len(doc)
+                doc.close()
+
+        return "\n".join(texts), "\n".join(attachments), tokens
+
+    def _answer(self, prompt, attachment_text, temperature):
+        """Returns the response text and the synthetic probability of its supplier_number value."""
+        invoice_text = attachment_text or prompt.split("Invoice Text", 1)[-1]
+
+        if "=== INVOICE" in prompt and "Supplier List" in prompt:
+            return answer_supplier_batch(prompt, lambda: self.random.random() < TEMPERATURE_NOISE * temperature), 1.0
+
+        if "supplier_number" in prompt and "Supplier List" in prompt:
+            if self.random.random() < TEMPERATURE_NOISE * temperature:
+                return json.dumps(EMPTY_SUPPLIER), SUPPLIER_PROBABILITIES["noise"]
+            _, how = supplier_matches(prompt, invoice_text)
+            return answer_supplier(prompt, invoice_text), SUPPLIER_PROBABILITIES[how]
+
+        if "by VAT type" in prompt:
+            return answer_vat(invoice_text), 1.0
+
+        return "{}", 1.0
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        config = dict(generation_config or {})
+        temperature = config.get("temperature", 1)
+        candidate_count = config.get("candidate_count", 1)
+
+        if isinstance(contents, (str, dict)):
+            contents = [contents]
+        cached_tokens = 0
+        if self.cached_content is not None:
+            cached_tokens = self.cached_content.usage_metadata.total_token_count
+            contents = self.cached_content.contents + list(contents)
+
+        prompt, attachment_text, prompt_tokens = self._split_contents(contents)
+        uncached_tokens = prompt_tokens - cached_tokens
+        first_token_seconds = BASE_LATENCY + LATENCY_PER_1K_TOKENS * (
+            uncached_tokens + CACHED_TOKEN_LATENCY_FACTOR * cached_tokens
+        ) / 1000
+
+        if not stream:
+            time.sleep(first_token_seconds)
+
+        candidates = []
+        for _ in range(candidate_count):
+            text, probability = self._answer(prompt, attachment_text, temperature)
+            candidate = SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))
+            if config.get("response_logprobs"):
+                candidate.avg_logprobs, candidate.logprobs_result = synthetic_logprobs(text, probability, self.random)
+            candidates.append(candidate)
+
+        usage = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=sum(count_tokens(c.content.parts[0].text) for c in candidates),
+            cached_content_token_count=cached_tokens
+        )
+        response = SimpleNamespace(candidates=candidates, usage_metadata=usage, text=candidates[0].content.parts[0].text)
+        return LocalStreamedResponse(response, first_token_seconds) if stream else response
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=self._split_contents(contents)[2])
@@ -0,0 +1,88 @@
+import os
+import re
+import json
+import math
+import pandas as pd
+
+# Single-call supplier confidence from token log-probabilities. Gemini returns the log-probability of every token
+# it generated when the request sets response_logprobs; the confidence of an answer is the probability of the
+# tokens that spell its supplier_number value. Raw token probabilities are over-confident, so they are mapped to
+# the accuracy observed for similar scores in recorded runs (histogram binning, built by the calibration report).
+
+BINS = 10  # Equal-width confidence bins between 0 and 1
+MIN_BIN_INVOICES = 10  # Bins with fewer recorded invoices keep the raw confidence
+
+SUPPLIER_NUMBER_PATTERN = re.compile(r'"supplier_number"\s*:\s*"([^"]*)"')
+
+
+def supplier_number_confidence(candidate):
+    """Probability of the supplier_number value in a candidate generated with response_logprobs.
+
+    For an empty value the closing quote is scored, i.e. the model's confidence that there is no supplier.
+    Falls back to the candidate's average token probability if the value can't be located, and None without logprobs.
+    """
+    tokens = list(getattr(getattr(candidate, "logprobs_result", None), "chosen_candidates", None) or [])
+    if not tokens:
+        avg_logprobs = getattr(candidate, "avg_logprobs", None)
+        return math.exp(avg_logprobs) if avg_logprobs is not None else None
+
+    match = SUPPLIER_NUMBER_PATTERN.search("".join(t.token for t in tokens))
+    if not match:
+        return math.exp(sum(t.log_probability for t in tokens) / len(tokens))
+
+    start, end = match.start(1), max(match.end(1), match.start(1) + 1)
+    position, log_probability = 0, 0.0
+    for token in tokens:
+        if position < end and position + len(token.token) > start:
+            log_probability += token.log_probability
+        position += len(token.token)
+
+    return math.exp(log_probability)
+
+
+def bin_index(confidence):
+    return min(int(confidence * BINS), BINS - 1)
+
+
+def reliability_table(confidences, correct):
+    """Invoices, mean confidence and accuracy per confidence bin: the points of the reliability curve."""
+    df = pd.DataFrame({"confidence": confidences, "correct": correct}).astype(float)
+    df["bin"] = df["confidence"].map(bin_index)
+
+    table = df.groupby("bin").agg(invoices=("correct", "size"), confidence=("confidence", "mean"),
+                                  accuracy=("correct", "mean"))
+    table = table.reindex(range(BINS))
+    table.insert(0, "range", [f"{b / BINS:.1f}-{(b + 1) / BINS:.1f}" for b in range(BINS)])
+    table["invoices"] = table["invoices"].fillna(0).astype(int)
+    return table
+
+
+def expected_calibration_error(table):
+    filled = table[table["invoices"] > 0]
+    return float((filled["invoices"] * (filled["confidence"] - filled["accuracy"]).abs()).sum() / filled["invoices"].sum())
+
+
+class Calibration:
+    """Bin accuracies saved by the calibration report. calibrate() maps a raw confidence to its bin's accuracy."""
+
+    def __init__(self, path):
+        self.path = path
+        self.accuracy = [None] * BINS
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.accuracy = json.load(file)["accuracy"]
+
+    def fit(self, table):
+        self.accuracy = [round(float(row["accuracy"]), 4) if row["invoices"] >= MIN_BIN_INVOICES else None
+                         for _, row in table.iterrows()]
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump({"bins": BINS, "min_bin_invoices": MIN_BIN_INVOICES, "accuracy": self.accuracy}, file, indent=2)
+
+    def calibrate(self, confidence):
+        if confidence is None:
+            return None
+        accuracy = self.accuracy[bin_index(confidence)]
+        return accuracy if accuracy is not None else confidence
@@ -0,0 +1,135 @@
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+
+# Columnar store for the OCR layout of a run: one row per token or line with its page, normalized bounding box
+# and confidence. Saved as an Arrow IPC file so it can be memory-mapped and filtered without reading it all.
+
+LAYOUT_SCHEMA = pa.schema([
+    ("invoice_number", pa.string()),
+    ("page", pa.int32()),
+    ("kind", pa.string()),  # "token" or "line"
+    ("text", pa.string()),
+    ("x0", pa.float32()),
+    ("y0", pa.float32()),
+    ("x1", pa.float32()),
+    ("y1", pa.float32()),
+    ("confidence", pa.float32()),
+    ("source", pa.string())  # "document_ai" or "text_layer"
+])
+
+
+def _anchor_text(document_text, layout):
+    return "".join(
+        document_text[int(segment.start_index):int(segment.end_index)]
+        for segment in layout.text_anchor.text_segments
+    )
+
+
+def document_layout_rows(invoice_number, document, page_numbers=None):
+    """Rows for every token and line of a Document AI document. page_numbers maps the request's pages to the original PDF."""
+    rows = []
+
+    for index, page in enumerate(document.pages):
+        page_number = page_numbers[index] if page_numbers else page.page_number
+
+        for kind, elements in (("token", page.tokens), ("line", page.lines)):
+            for element in elements:
+                vertices = element.layout.bounding_poly.normalized_vertices
+                xs = [v.x for v in vertices] or [0.0]
+                ys = [v.y for v in vertices] or [0.0]
+
+                rows.append({
+                    "invoice_number": invoice_number,
+                    "page": page_number,
+                    "kind": kind,
+                    "text": _anchor_text(document.text, element.layout).strip(),
+                    "x0": min(xs), "y0": min(ys), "x1": max(xs), "y1": max(ys),
+                    "confidence": element.layout.confidence,
+                    "source": "document_ai"
+                })
+
+    return rows
+
+
+def text_layer_layout_rows(invoice_number, doc, page_numbers):
+    """Rows for the words and lines of the embedded text layer of an open PyMuPDF document. page_numbers are 1-based."""
+    rows = []
+
+    for page_number in page_numbers:
+        page = doc[page_number - 1]
+        width, height = page.rect.width, page.rect.height
+
+        def add_row(kind, text, bbox):
+            rows.append({
+                "invoice_number": invoice_number,
+                "page": page_number,
+                "kind": kind,
+                "text": text,
+                "x0": bbox[0] / width, "y0": bbox[1] / height, "x1": bbox[2] / width, "y1": bbox[3] / height,
+                "confidence": None,
+                "source": "text_layer"
+            })
+
+        for word in page.get_text("words"):
+            add_row("token", word[4], word[:4])
+
+        for block in page.get_text("dict")["blocks"]:
+            for line in block.get("lines", []):
+                text = "".join(span["text"] for span in line["spans"]).strip()
+                if text:
+                    add_row("line", text, line["bbox"])
+
+    return rows
+
+
+def write_layout_store(path, rows):
+    """Writes the rows to the store. Invoices without new rows keep the rows they had in the existing file."""
+    table = pa.Table.from_pylist(rows, schema=LAYOUT_SCHEMA)
+
+    if os.path.exists(path):
+        with pa.memory_map(path, "r") as source:
+            previous = ipc.open_file(source).read_all()
+
+        keep = pc.invert(pc.is_in(previous["invoice_number"], value_set=table["invoice_number"].unique()))
+        table = pa.concat_tables([previous.filter(keep), table])
+
+    table = table.sort_by([("invoice_number", "ascending"), ("page", "ascending"), ("kind", "ascending")])
+
+    with pa.OSFile(path, "wb") as sink:
+        with ipc.new_file(sink, LAYOUT_SCHEMA) as writer:
+            writer.write_table(table)
+
+
+def load_layout(path, invoice_numbers=None, pages=None, region=None, kind=None):
+    """Loads layout rows as a DataFrame, filtered on the memory-mapped file before anything is copied.
+
+    region is (x0, y0, x1, y1) in normalized page coordinates; an element is kept when its box lies inside it.
+    For example (0, 0, 1, 0.25) is the page header and (0, 0.6, 1, 1) the bottom part where totals usually are.
+    """
+    with pa.memory_map(path, "r") as source:
+        table = ipc.open_file(source).read_all()
+
+        mask = pc.is_valid(table["invoice_number"])
+        if invoice_numbers is not None:
+            mask = pc.and_(mask, pc.is_in(table["invoice_number"], value_set=pa.array([str(i) for i in invoice_numbers])))
+        if pages is not None:
+            mask = pc.and_(mask, pc.is_in(table["page"], value_set=pa.array(list(pages), pa.int32())))
+        if kind is not None:
+            mask = pc.and_(mask, pc.equal(table["kind"], kind))
+        if region is not None:
+            x0, y0, x1, y1 = region
+            mask = pc.and_(mask, pc.and_(
+                pc.and_(pc.greater_equal(table["x0"], x0), pc.greater_equal(table["y0"], y0)),
+                pc.and_(pc.less_equal(table["x1"], x1), pc.less_equal(table["y1"], y1))
+            ))
+
+        return table.filter(mask).to_pandas()
+
+
+def region_text(path, invoice_number, pages=None, region=None):
+    """Text of the lines inside a region in reading order, ready to drop into a prompt."""
+    lines = load_layout(path, [invoice_number], pages, region, kind="line")
+    lines = lines.sort_values(["page", "y0", "x0"])
+    return "\n".join(lines["text"])
@@ -0,0 +1,30 @@
+import os
+import json
+import hashlib
+
+# Per-stage manifests shared by the 002-004 scripts. Each stage keeps "manifest.json" next to its output, mapping
+# every invoice to the hashes of what its result depends on (input text, context tables, prompt version, settings)
+# and the result itself, so unchanged invoices are reused instead of sent to Gemini again.
+
+
+def hash_value(value):
+    """Stable SHA-256 of a string, bytes or JSON-serialisable value."""
+    if isinstance(value, bytes):
+        data = value
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+    else:
+        data = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(path, manifest):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, default=lambda o: o.item() if hasattr(o, "item") else str(o))
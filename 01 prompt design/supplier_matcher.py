@@ -0,0 +1,88 @@
+import re
+import unicodedata
+
+# Deterministic supplier lookup that runs before the Gemini supplier ensemble. The index is built once from
+# suppliers.csv: valid Norwegian organization numbers (MOD11 check digit) and normalized supplier names.
+# The invoice text is normalized and scanned once; every 9-digit group and every run of words up to the longest
+# supplier name is a dictionary lookup. An invoice is resolved only when all hits point to the same supplier,
+# everything else is left to Gemini.
+
+ORG_WEIGHTS = [3, 2, 7, 6, 5, 4, 3, 2]
+ORG_CANDIDATE_PATTERN = re.compile(r"(?<![\d.,])(\d{3})[ .]?(\d{3})[ .]?(\d{3})(?![\d,]|\.\d)")
+
+# Legal forms that are often left out on invoices, so "Acme AS" also matches "ACME"
+LEGAL_FORMS = {"as", "asa", "ans", "da", "sa", "ba", "enk", "nuf", "ab", "aps", "oy", "ltd", "gmbh", "inc"}
+MIN_SHORT_NAME_LENGTH = 6  # Names without their legal form must be at least this long to be indexed
+
+
+def valid_organization_number(org_number):
+    """MOD11 check of a 9-digit Norwegian organization number."""
+    if not re.fullmatch(r"\d{9}", org_number):
+        return False
+
+    remainder = sum(int(d) * w for d, w in zip(org_number, ORG_WEIGHTS)) % 11
+    check_digit = 0 if remainder == 0 else 11 - remainder
+    return check_digit != 10 and check_digit == int(org_number[8])
+
+
+def normalize_words(text):
+    """Lowercases, strips accents except æøå and splits on anything that is not a letter or digit."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.findall(r"[0-9a-zæøåäöüéèáà]+", text)
+
+
+class SupplierMatcher:
+    """Index over the supplier list. match() returns the supplier row and how it was found, or (None, reason)."""
+
+    def __init__(self, supplier_df, ignored_organization_numbers=()):
+        self.ignored = {re.sub(r"\D", "", str(o)) for o in ignored_organization_numbers}
+        self.by_org_number = {}
+        self.by_name = {}
+
+        for _, row in supplier_df.iterrows():
+            supplier = {
+                "supplier_name": str(row["Supplier name"]),
+                "supplier_number": str(row["Supplier number"]),
+                "organization_number": str(row["Organization number"])
+            }
+
+            # Our own company is on every invoice as the buyer, so it must never count as a hit
+            org_number = re.sub(r"\D", "", supplier["organization_number"].split(".")[0])
+            if org_number in self.ignored:
+                continue
+            if valid_organization_number(org_number):
+                self.by_org_number.setdefault(org_number, []).append(supplier)
+
+            words = normalize_words(supplier["supplier_name"])
+            names = {tuple(words)}
+            if len(words) > 1 and words[-1] in LEGAL_FORMS and len(" ".join(words[:-1])) >= MIN_SHORT_NAME_LENGTH:
+                names.add(tuple(words[:-1]))
+
+            for name in names:
+                if name:
+                    self.by_name.setdefault(name, []).append(supplier)
+
+        self.longest_name = max((len(name) for name in self.by_name), default=0)
+
+    def match(self, invoice_text):
+        org_hits = {}
+        for groups in ORG_CANDIDATE_PATTERN.findall(invoice_text):
+            org_number = "".join(groups)
+            for supplier in self.by_org_number.get(org_number, []):
+                org_hits[supplier["supplier_number"]] = supplier
+
+        name_hits = {}
+        words = normalize_words(invoice_text)
+        for start in range(len(words)):
+            for length in range(1, min(self.longest_name, len(words) - start) + 1):
+                for supplier in self.by_name.get(tuple(words[start:start + length]), []):
+                    name_hits[supplier["supplier_number"]] = supplier
+
+        hits = {**name_hits, **org_hits}
+        if len(hits) > 1:
+            return None, "ambiguous"
+        if not hits:
+            return None, "no_match"
+
+        matched_by = "organization_number" if org_hits else "name"
+        return next(iter(hits.values())), matched_by
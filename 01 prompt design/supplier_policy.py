@@ -0,0 +1,130 @@
+import os
+import glob
+import json
+import time
+import pandas as pd
+from ground_truth import supplier_ground_truth
+
+# Per-supplier ensemble policy learned from earlier runs. For every supplier the store keeps how much the samples
+# agreed (majority_count over the samples drawn), how often the prediction matched the 006 evaluation's booked
+# supplier, and how often the 003 sense-check confirmed it, and puts the supplier in a tier. Each tier has its own
+# ensemble size, temperature and verification step, so calls are spent on the suppliers that are actually hard
+# to identify. Only the trusted tier skips verification, and it needs evaluated invoices to get there.
+
+POLICIES = {
+    "trusted": {"samples": 1, "temperature": 0, "verify": False},
+    "standard": {"samples": 3, "temperature": 1, "verify": True},
+    "ambiguous": {"samples": 5, "temperature": 1, "verify": True},
+    "unknown": {"samples": 5, "temperature": 1, "verify": True},  # No history, or the first prediction was empty
+}
+
+MIN_INVOICES = 3  # Ensemble-voted invoices needed before a supplier leaves the unknown tier
+MIN_EVALUATED = 5  # Invoices with 006 ground truth needed before a supplier can be trusted
+TRUSTED_AGREEMENT = 0.9
+TRUSTED_ACCURACY = 0.95
+AMBIGUOUS_AGREEMENT = 0.7
+AMBIGUOUS_ACCURACY = 0.8
+
+
+def run_history(runs_folder):
+    """One row per predicted invoice in earlier runs: supplier, sample agreement (None for pre-matched and
+    single-call invoices, which were never voted on), whether it matched the 006 ground truth and the sense-check
+    outcome."""
+    rows = []
+
+    for result_path in glob.glob(os.path.join(runs_folder, "*", "002 Supplier prediction", "result.csv")):
+        run_folder = os.path.dirname(os.path.dirname(result_path))
+        results = pd.read_csv(result_path, dtype=str).fillna("")
+        ground_truth = supplier_ground_truth(run_folder)
+
+        checked = {}
+        checked_path = os.path.join(run_folder, "003 Supplier sense-check", "double_checked_results.csv")
+        if os.path.exists(checked_path):
+            checked_df = pd.read_csv(checked_path, dtype=str).fillna("")
+            if "gated" in checked_df:
+                checked_df = checked_df[checked_df["gated"] != "True"]  # Accepted by the confidence gate, not checked
+            checked = dict(zip(checked_df["invoice_number"], checked_df["status"]))
+
+        for _, result in results[results["supplier_number"] != ""].iterrows():
+            samples = float(result.get("samples_used", "") or 5)
+            if result.get("majority_count", "") == "":
+                agreement = None  # Resolved by the pre-matcher
+            elif samples < 2:
+                agreement = None  # One call (trusted tier or a confident logprob answer), no votes to agree
+            else:
+                agreement = min(float(result["majority_count"]) / samples, 1.0)
+
+            status = checked.get(result["invoice_number"], "")
+            truth = ground_truth.get(result["invoice_number"])
+            rows.append({
+                "supplier_number": result["supplier_number"],
+                "agreement": agreement,
+                "correct": None if truth is None else truth == result["supplier_number"],
+                "confirmed": None if status == "" else status == "correct"
+            })
+
+    return pd.DataFrame(rows, columns=["supplier_number", "agreement", "correct", "confirmed"])
+
+
+def tier_for(voted, agreement, evaluated, accuracy, confirmation_rate):
+    if voted < MIN_INVOICES:
+        return "unknown"
+    if agreement < AMBIGUOUS_AGREEMENT or any(
+        rate is not None and rate < AMBIGUOUS_ACCURACY for rate in (accuracy, confirmation_rate)
+    ):
+        return "ambiguous"
+    if agreement >= TRUSTED_AGREEMENT and evaluated >= MIN_EVALUATED and accuracy >= TRUSTED_ACCURACY:
+        return "trusted"
+    return "standard"
+
+
+def share(values):
+    values = values.dropna()
+    return float(values.astype(float).mean()) if len(values) else None
+
+
+class SupplierPolicyStore:
+    """JSON store of per-supplier statistics and tiers. policy_for() returns (tier, policy) for a supplier number."""
+
+    def __init__(self, path):
+        self.path = path
+        self.suppliers = {}
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.suppliers = json.load(file).get("suppliers", {})
+
+    def learn(self, runs_folder="runs"):
+        """Rebuilds the statistics from every run under runs_folder and saves the store."""
+        history = run_history(runs_folder)
+        self.suppliers = {}
+
+        for supplier_number, group in history.groupby("supplier_number"):
+            agreement = share(group["agreement"])
+            accuracy = share(group["correct"])
+            confirmation_rate = share(group["confirmed"])
+            voted = int(group["agreement"].notna().sum())
+            evaluated = int(group["correct"].notna().sum())
+
+            self.suppliers[supplier_number] = {
+                "invoices": len(group),
+                "pre_matched": len(group) - voted,
+                "agreement": round(agreement, 3) if agreement is not None else None,
+                "evaluated": evaluated,
+                "accuracy": round(accuracy, 3) if accuracy is not None else None,
+                "checked": int(group["confirmed"].notna().sum()),
+                "confirmation_rate": round(confirmation_rate, 3) if confirmation_rate is not None else None,
+                "tier": tier_for(voted, agreement, evaluated, accuracy, confirmation_rate)
+            }
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump({"updated": time.strftime("%Y-%m-%d %H:%M:%S"), "suppliers": self.suppliers}, file, indent=2)
+
+    def policy_for(self, supplier_number):
+        tier = self.suppliers.get(str(supplier_number), {}).get("tier", "unknown") if supplier_number else "unknown"
+        return tier, POLICIES[tier]
+
+    def summary(self):
+        tiers = pd.Series([s["tier"] for s in self.suppliers.values()], dtype=str).value_counts()
+        return f"Supplier policy store: {len(self.suppliers)} suppliers, " + ", ".join(f"{n} {t}" for t, n in tiers.items())
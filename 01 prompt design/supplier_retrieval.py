@@ -0,0 +1,71 @@
+import re
+import math
+from collections import defaultdict
+
+from supplier_matcher import ORG_CANDIDATE_PATTERN, normalize_words
+
+# Local top-k retrieval over the supplier list, so supplier prompts only carry the suppliers an invoice can be about.
+# Each supplier is a set of character n-grams of its normalized name, weighted by IDF over the supplier list.
+# A supplier scores the IDF-weighted share of its n-grams found in the invoice text, plus 1 when its org number
+# is printed on the invoice. Looking up the invoice n-grams in an inverted index keeps this fast for large lists.
+
+NGRAM_SIZE = 3
+
+
+def char_ngrams(text):
+    grams = set()
+    for word in normalize_words(text):
+        padded = f" {word} "
+        grams.update(padded[i:i + NGRAM_SIZE] for i in range(max(1, len(padded) - NGRAM_SIZE + 1)))
+    return grams
+
+
+class SupplierRetriever:
+    """Ranks the rows of supplier_df for an invoice text. top_k returns the best k rows as a DataFrame."""
+
+    def __init__(self, supplier_df):
+        self.supplier_df = supplier_df.reset_index(drop=True)
+        self.org_numbers = [
+            re.sub(r"\D", "", str(o).split(".")[0]) for o in self.supplier_df["Organization number"]
+        ]
+
+        supplier_grams = [char_ngrams(str(name)) for name in self.supplier_df["Supplier name"]]
+
+        document_frequency = defaultdict(int)
+        for grams in supplier_grams:
+            for gram in grams:
+                document_frequency[gram] += 1
+
+        count = len(supplier_grams)
+        self.idf = {gram: math.log((count + 1) / (df + 0.5)) for gram, df in document_frequency.items()}
+
+        self.postings = defaultdict(list)
+        for index, grams in enumerate(supplier_grams):
+            for gram in grams:
+                self.postings[gram].append(index)
+        self.norms = [sum(self.idf[g] for g in grams) or 1.0 for grams in supplier_grams]
+
+    def scores(self, invoice_text):
+        scores = [0.0] * len(self.norms)
+
+        for gram in char_ngrams(invoice_text):
+            for index in self.postings.get(gram, []):
+                scores[index] += self.idf[gram] / self.norms[index]
+
+        printed = {"".join(groups) for groups in ORG_CANDIDATE_PATTERN.findall(invoice_text)}
+        for index, org_number in enumerate(self.org_numbers):
+            if org_number in printed:
+                scores[index] += 1.0
+
+        return scores
+
+    def rank(self, invoice_text):
+        """Supplier numbers as strings, best match first."""
+        scores = self.scores(invoice_text)
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])
+        return [str(self.supplier_df.at[i, "Supplier number"]) for i in order]
+
+    def top_k(self, invoice_text, k):
+        scores = self.scores(invoice_text)
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
+        return self.supplier_df.iloc[order]
@@ -0,0 +1,66 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from duplicate_index import DuplicateIndex, content_key, extract_fingerprints, fingerprint_keys
+
+OWN_ORGANIZATION_NUMBER = "911111111"
+
+
+def invoice_text(supplier, supplier_org_number):
+    return f"""{supplier}
+Org.nr: {supplier_org_number}
+Fakturanummer: 1001
+Kunde: Vår Bedrift AS, NO {OWN_ORGANIZATION_NUMBER} MVA
+Invoice no: 123 456 789
+Totalt å betale 1 250,00
+"""
+
+
+def test_suppliers_sharing_an_invoice_number_are_not_duplicates(tmp_path):
+    acme = fingerprint_keys(extract_fingerprints(invoice_text("Acme AS", "923609016"), [OWN_ORGANIZATION_NUMBER]))
+    beta = fingerprint_keys(extract_fingerprints(invoice_text("Beta Handel AS", "987654325"), [OWN_ORGANIZATION_NUMBER]))
+
+    assert acme == ["invoice:923609016:1001"]
+    assert beta == ["invoice:987654325:1001"]
+
+    index = DuplicateIndex(str(tmp_path / "duplicate_index.sqlite"))
+    index.add(acme, "run", "acme-1001")
+    assert index.check(beta, "run", "beta-1001") is None
+    assert index.check(acme, "run", "acme-1001-again") == "run/acme-1001"
+
+
+def test_no_fingerprint_without_a_supplier_org_number():
+    text = f"Kunde: NO {OWN_ORGANIZATION_NUMBER} MVA\nInvoice no: 123 456 789\nFakturanummer: 1001\n"
+    assert fingerprint_keys(extract_fingerprints(text, [OWN_ORGANIZATION_NUMBER])) == []
+
+
+def test_identical_pdfs_processed_concurrently_are_caught(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicate_index.sqlite"))
+    keys = [content_key(b"%PDF-1.4 same bytes")]
+    barrier = threading.Barrier(2)
+
+    def process(invoice_number):
+        barrier.wait()
+        duplicate_of = index.check(keys, "run", invoice_number)
+        if duplicate_of is None:
+            time.sleep(0.05)  # OCR
+            index.add(keys, "run", invoice_number)
+        return duplicate_of
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(process, ["inv1", "inv1copy"]))
+
+    assert results.count(None) == 1
+    assert set(results) - {None} <= {"run/inv1", "run/inv1copy"}
+
+
+def test_released_keys_are_not_duplicates(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "duplicate_index.sqlite"))
+    keys = [content_key(b"%PDF-1.4 same bytes")]
+
+    assert index.check(keys, "run", "inv1") is None
+    assert index.check(keys, "run", "inv1copy") == "run/inv1"
+
+    index.release("run", "inv1")  # OCR failed
+    assert index.check(keys, "run", "inv1copy") is None
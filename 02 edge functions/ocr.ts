@@ -41,6 +41,18 @@ async function createAccessToken() {
   if (!access_token) throw new Error("No access_token returned by Google");
   return access_token;
 }
+const PAGE_BUDGET = 5;
+// pdf-lib cannot read text, so pages are picked by position: the first pages carry the supplier header,
+// the last page usually carries the totals and VAT summary
+function selectPages(totalPages) {
+  if (totalPages <= PAGE_BUDGET) return [
+    ...Array(totalPages).keys()
+  ];
+  return [
+    ...Array(PAGE_BUDGET - 1).keys(),
+    totalPages - 1
+  ];
+}
 const DOC_AI_URL = `https://${GCP_LOCATION}-documentai.googleapis.com/v1/projects/${GCP_PROJECT_ID}/locations/${GCP_LOCATION}/processors/${GCP_PROCESSOR_ID}:process`;
 function toBase64(bytes) {
   return encodeBase64(bytes);
@@ -124,7 +136,7 @@ Deno.serve(async (req)=>{
         console.log("4");
         let pageCount;
         try {
-          pageCount = Math.min(5, fullPdf.getPageCount());
+          pageCount = fullPdf.getPageCount();
         } catch (e) {
           console.error("Failed to get page count:", e);
           throw new Error("PDF is loaded but invalid page structure.");
@@ -133,9 +145,7 @@ Deno.serve(async (req)=>{
           throw new Error("Original PDF has no pages!");
         }
         console.log("6");
-        const pages = await newPdf.copyPages(fullPdf, [
-          ...Array(pageCount).keys()
-        ]);
+        const pages = await newPdf.copyPages(fullPdf, selectPages(pageCount));
         console.log("7");
         pages.forEach((page)=>newPdf.addPage(page));
         console.log("8");